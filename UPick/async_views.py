@@ -0,0 +1,221 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.db import close_old_connections, connections
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import HttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from .caching import aget_version, count_cache_entry, get_cache
+from .fieldsets import farm_columns, farm_lookups, requested_expansions, requested_fields, summary_columns
+from .filters import FarmFilter, FarmSummaryFilter, PlantFilter
+from .metrics import get_request_metrics, serializer_timer
+from .models import Farm, FarmPlants, FarmSummary, WorkingHour
+from .pagination import UPickCursorPagination, UPickPagination
+from .schedule import get_request_clock
+from .taxonomy import aget_taxonomy
+from .serializers import (
+    FarmDetailSerializer, FarmListSerializer, PlantFarmsSerializer,
+    FastFarmListSerializer, FastFarmSummarySerializer, FastPlantFarmsSerializer,
+)
+
+# Native async farm and plant endpoints on the async ORM, routed in place of the
+# viewsets when UPICK_ASYNC_VIEWS is set. They answer page number lists and details
+# with the same JSON, status codes and list filters as FarmViewSet and PlantViewSet,
+# without holding a thread while the database works. Keyset pages (?cursor=) are
+# rejected with a 400. Conditional GET, the response cache, read replicas, streamed
+# lists and the export action stay with the viewsets.
+
+
+# Threads for the queries run next to the request's own, each one keeps its connection
+# open for CONN_MAX_AGE seconds, so this is the size of their connection pool
+query_executor = ThreadPoolExecutor(max_workers=settings.UPICK_DB_POOL_SIZE, thread_name_prefix='upick-query')
+
+
+def json_response(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status)
+
+
+def serializer_context(request, **extra):
+    return {'request': request, 'format': None, 'view': None, 'clock': get_request_clock(request), **extra}
+
+
+async def fetch_rows(queryset, *lookups):
+    rows = [row async for row in queryset.aiterator()]
+    # aprefetch_related_objects() and prefetching with aiterator() need Django 5.0
+    await sync_to_async(prefetch_related_objects)(rows, *lookups)
+    return rows
+
+
+async def count_in_own_connection(request, queryset):
+    """
+    Counts queryset in a worker thread with its own database connection. The async
+    ORM runs all queries of a request on one thread, one after the other, so this is
+    what lets the count overlap with the page query.
+    """
+    metrics = get_request_metrics(request)
+
+    def count():
+        close_old_connections()
+        try:
+            if metrics is None:
+                return queryset.count()
+            with connections[queryset.db].execute_wrapper(metrics.record_query):
+                return queryset.count()
+        finally:
+            close_old_connections()
+
+    return await sync_to_async(count, thread_sensitive=False, executor=query_executor)()
+
+
+#  ------------ lists ------------------- #
+
+class InvalidPage(Exception):
+    pass
+
+
+async def paginate(request, queryset, basename, lookups):
+    """
+    Returns the UPickPagination holding the requested page, with the rows fetched and
+    prefetched. The count comes from the count cache or runs next to the page query.
+    """
+    pagination = UPickPagination()
+    pagination.request = request
+    page_size = pagination.get_page_size(request)
+    page_number = request.query_params.get(pagination.page_query_param) or 1
+
+    cache = get_cache()
+    cache_key, cache_timeout = count_cache_entry(request, basename, await aget_version('catalog'))
+    count = await cache.aget(cache_key)
+    if count is None and page_number in pagination.last_page_strings:
+        # The last page can only be found once the count is known
+        count = await count_in_own_connection(request, queryset)
+        await cache.aset(cache_key, count, timeout=cache_timeout)
+
+    paginator = Paginator(queryset, page_size)
+    if count is not None:
+        paginator.count = count
+    if page_number in pagination.last_page_strings:
+        page_number = paginator.num_pages
+    try:
+        page_number = int(page_number)
+    except (TypeError, ValueError):
+        raise InvalidPage()
+    if page_number < 1:
+        raise InvalidPage()
+
+    bottom = (page_number - 1) * page_size
+    page_rows = fetch_rows(queryset[bottom:bottom + page_size], *lookups)
+    if count is None:
+        count, rows = await asyncio.gather(count_in_own_connection(request, queryset), page_rows)
+        paginator.count = count
+        await cache.aset(cache_key, count, timeout=cache_timeout)
+    else:
+        rows = await page_rows
+
+    if page_number > paginator.num_pages and not (page_number == 1 and paginator.allow_empty_first_page):
+        raise InvalidPage()
+    pagination.page = Page(rows, page_number, paginator)
+    return pagination
+
+
+async def list_response(request, filterset, basename, serializer_class, lookups, **extra):
+    cursor_param = UPickCursorPagination.cursor_query_param
+    if cursor_param in request.query_params:
+        return json_response({cursor_param: ['Cursor pages are not served by the async views.']}, status=400)
+    context = serializer_context(request, **extra)
+    if serializer_class is FastPlantFarmsSerializer or 'farm_plants' in context.get('expand', ()):
+        context['taxonomy'] = await aget_taxonomy()
+    try:
+        queryset = await filterset.aqs()
+        pagination = await paginate(request, queryset, basename, lookups)
+    except ValidationError as error:
+        return json_response(error.detail, status=400)
+    except InvalidPage:
+        return json_response({'detail': 'Invalid page.'}, status=404)
+
+    rows = list(pagination.page)
+    serializer = serializer_class(rows, many=True, context=context)
+    with serializer_timer(request):
+        results = serializer.data
+    return json_response({
+        'info': pagination.get_info(len(results)),
+        'results': results
+    })
+
+
+async def farm_list(request):
+    request = Request(request)
+    try:
+        fields, expand = requested_fields(request), requested_expansions(request)
+    except ValidationError as error:
+        return json_response(error.detail, status=400)
+    if settings.UPICK_FARM_SUMMARY and settings.UPICK_FAST_SERIALIZERS and 'farm_plants' not in expand:
+        queryset = FarmSummary.objects.order_by('id')
+        if fields is not None:
+            queryset = queryset.only(*summary_columns(fields))
+        filterset = FarmSummaryFilter(request.query_params, queryset=queryset, request=request)
+        return await list_response(request, filterset, 'farm', FastFarmSummarySerializer, [], fields=fields)
+
+    queryset = Farm.objects.order_by('id')
+    today = get_request_clock(request).days_today()
+    if settings.UPICK_FAST_SERIALIZERS:
+        serializer_class = FastFarmListSerializer
+        if fields is not None:
+            queryset = queryset.only(*farm_columns(fields))
+        lookups = farm_lookups(fields, expand, today=today)
+    else:
+        serializer_class = FarmListSerializer
+        lookups = farm_lookups(None, expand, today=today)
+    filterset = FarmFilter(request.query_params, queryset=queryset, request=request)
+    return await list_response(request, filterset, 'farm', serializer_class, lookups, fields=fields, expand=expand)
+
+
+async def plant_list(request):
+    request = Request(request)
+    queryset = FarmPlants.objects.select_related('farm__address').order_by('id')
+    serializer_class = FastPlantFarmsSerializer
+    if not settings.UPICK_FAST_SERIALIZERS:
+        queryset = queryset.select_related('plant__category')
+        serializer_class = PlantFarmsSerializer
+    filterset = PlantFilter(request.query_params, queryset=queryset, request=request)
+    return await list_response(request, filterset, 'farmplants', serializer_class, [todays_working_hours(request)])
+
+
+def todays_working_hours(request):
+    today = get_request_clock(request).days_today()
+    return Prefetch('farm__working_hours', queryset=WorkingHour.objects.filter(day__in=today))
+
+
+#  ------------ details ------------------- #
+
+async def detail_response(request, queryset, pk, serializer_class, lookups, **extra):
+    try:
+        instance = await queryset.aget(pk=pk)
+    except queryset.model.DoesNotExist:
+        return json_response({'detail': f'No {queryset.model._meta.object_name} matches the given query.'}, status=404)
+    await sync_to_async(prefetch_related_objects)([instance], *lookups)
+    serializer = serializer_class(instance, context=serializer_context(request, **extra))
+    with serializer_timer(request):
+        data = serializer.data
+    return json_response(data)
+
+
+async def farm_detail(request, pk):
+    request = Request(request)
+    try:
+        fields, _ = requested_fields(request), requested_expansions(request)
+    except ValidationError as error:
+        return json_response(error.detail, status=400)
+    queryset = Farm.objects.all() if fields is None else Farm.objects.only(*farm_columns(fields))
+    lookups = farm_lookups(fields, detail=True)
+    return await detail_response(request, queryset, pk, FarmDetailSerializer, lookups, fields=fields)
+
+
+async def plant_detail(request, pk):
+    request = Request(request)
+    queryset = FarmPlants.objects.select_related('plant__category', 'farm__address')
+    return await detail_response(request, queryset, pk, PlantFarmsSerializer, [todays_working_hours(request)])
@@ -0,0 +1,169 @@
+import platform
+import sqlite3
+import time
+from datetime import date
+import django
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from .models import Address, Farm, FarmPlants
+from .seed import SeedLoader, flush_catalog, synthetic_records
+
+# Benchmarks of the API hot paths. Each scale gets its own on-disk SQLite database
+# of synthetic farms, every scenario is requested `iterations` times through the test
+# client, and the latency percentiles, query count and response size are recorded.
+
+
+#  ------------ database ------------------- #
+
+def use_sqlite_database(path, alias='default'):
+    # Points the alias at an SQLite file, the way the test runner swaps in its test database
+    connections[alias].close()
+    connections.settings[alias] = connections.configure_settings({
+        alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(path)},
+    })[alias]
+    del connections[alias]
+
+
+def prepare_database(path, farm_count, batch_size=5000):
+    """
+    Migrates the SQLite file at path and fills it with farm_count synthetic farms,
+    unless an earlier run already did. Returns the loading time in seconds.
+    """
+    use_sqlite_database(path)
+    call_command('migrate', verbosity=0)
+    if Farm.objects.count() == farm_count:
+        return 0
+    started = time.perf_counter()
+    flush_catalog()
+    loader = SeedLoader(batch_size=batch_size)
+    loader.load(synthetic_records(farm_count))
+    loader.finish()
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return time.perf_counter() - started
+
+
+#  ------------ scenarios ------------------- #
+
+def scenarios():
+    """
+    Returns (name, path, params) for every benchmarked request: the farm list with
+    each FarmFilter option, a farm detail and the plant list with each PlantFilter option.
+    Ids and the search point are taken from the middle of the current database.
+    """
+    farm_count = Farm.objects.count()
+    farm = Farm.objects.order_by('id')[farm_count // 2]
+    address = Address.objects.get(farm=farm)
+    farm_plant = FarmPlants.objects.select_related('plant').filter(farm=farm).first()
+    point = {'address__lat': address.lat, 'address__long': address.long}
+
+    return [
+        ('farms', '/UPick/farms/', {}),
+        ('farms_page_size_100', '/UPick/farms/', {'page_size': 100}),
+        ('farms_last_page', '/UPick/farms/', {'page': (farm_count + 19) // 20}),
+        ('farms_cursor', '/UPick/farms/', {'cursor': ''}),
+        ('farms_radius', '/UPick/farms/', {'radius': 50, **point}),
+        ('farms_radius_by_distance', '/UPick/farms/', {'radius': 50, 'ordering': 'distance', **point}),
+        ('farms_is_open', '/UPick/farms/', {'is_open': 'true'}),
+        ('farms_is_closed', '/UPick/farms/', {'is_open': 'false'}),
+        ('farms_entrance_fee', '/UPick/farms/', {'entrance_fee_min': 5, 'entrance_fee_max': 10}),
+        ('farms_free', '/UPick/farms/', {'entrance_fee_max': 0}),
+        ('farms_combined', '/UPick/farms/', {'radius': 100, 'is_open': 'true', 'entrance_fee_max': 10, **point}),
+        ('farms_search', '/UPick/farms/', {'q': farm.title}),
+        ('farm_detail', f'/UPick/farms/{farm.id}/', {}),
+        ('plants', '/UPick/plants/', {}),
+        ('plants_page_size_100', '/UPick/plants/', {'page_size': 100}),
+        ('plants_category', '/UPick/plants/', {'plant__category': farm_plant.plant.category_id}),
+        ('plants_farm', '/UPick/plants/', {'farm': farm.id}),
+        ('plants_plant', '/UPick/plants/', {'plant': farm_plant.plant_id}),
+        ('plants_in_season', '/UPick/plants/', {'in_season': date.today().isoformat()}),
+        ('plants_search', '/UPick/plants/', {'q': farm_plant.plant.title}),
+        ('plants_radius', '/UPick/plants/', {'radius': 50, **point}),
+        ('plants_radius_by_distance', '/UPick/plants/', {'radius': 50, 'ordering': 'distance', **point}),
+    ]
+
+
+#  ------------ measuring ------------------- #
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of a non-empty list
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def measure(client, path, params, iterations, warmup=2):
+    """
+    Requests path iterations times after warmup unmeasured requests. Rendered responses
+    and counts are not cached, so each one runs the full query and serializer path. The
+    cache versions stay in place, as they do between requests in production.
+    """
+    latencies = []
+    for iteration in range(warmup + iterations):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(path, params, HTTP_ACCEPT='application/json')
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} {params} returned {response.status_code}: {content[:200]!r}')
+        if iteration >= warmup:
+            latencies.append(elapsed * 1000)
+
+    return {
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p90_ms': round(percentile(latencies, 0.90), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'max_ms': round(max(latencies), 3),
+        'queries': len(queries),
+        'bytes': len(content),
+    }
+
+
+def run_benchmarks(iterations, only=None):
+    # The benchmarked database must already be selected, see prepare_database()
+    client = Client()
+    results = {}
+    # A zero timeout leaves the counts of the list pages uncached
+    with override_settings(UPICK_RESPONSE_CACHE=None, UPICK_COUNT_TIMEOUT=0, UPICK_OPEN_FILTER_TIMEOUT=0):
+        for name, path, params in scenarios():
+            if only and not any(pattern in name for pattern in only):
+                continue
+            results[name] = measure(client, path, params, iterations)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'machine': platform.machine(),
+    }
+
+
+#  ------------ baseline comparison ------------------- #
+
+def compare(results, baseline, tolerance=0.5, min_delta_ms=2.0):
+    """
+    Returns a list of regressions of results against baseline. A scenario regresses
+    when its median latency grows by more than tolerance (and by at least min_delta_ms,
+    so sub-millisecond noise never fails a run) or when it needs more queries.
+    """
+    regressions = []
+    for scale, scenarios_results in results['scales'].items():
+        baseline_scenarios = baseline.get('scales', {}).get(scale, {})
+        for name, result in scenarios_results.items():
+            previous = baseline_scenarios.get(name)
+            if previous is None:
+                continue
+            limit = max(previous['p50_ms'] * (1 + tolerance), previous['p50_ms'] + min_delta_ms)
+            if result['p50_ms'] > limit:
+                regressions.append(
+                    f'{scale} farms, {name}: p50 {result["p50_ms"]:.1f}ms, baseline {previous["p50_ms"]:.1f}ms')
+            if result['queries'] > previous['queries']:
+                regressions.append(
+                    f'{scale} farms, {name}: {result["queries"]} queries, baseline {previous["queries"]}')
+    return regressions
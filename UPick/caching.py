@@ -0,0 +1,178 @@
+from hashlib import sha1
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+# Query parameters that select a page or shape the output without changing which rows match
+NON_FILTER_PARAMS = {'page', 'page_size', 'cursor', 'count', 'ordering', 'format', 'fields', 'expand'}
+
+
+def get_cache():
+    return caches[settings.UPICK_CACHE]
+
+
+#  ------------ versions ------------------- #
+
+# Cache keys embed one or more versions so that bumping a version from the model
+# signals in UPick.signals invalidates every dependent entry at once:
+#   catalog     any farm, address, working hour, farm plant, plant or category changed
+#   farm:<id>   the farm, its address, working hours or farm plants changed, only
+#               stored once bumped, see object_version()
+#   taxonomy    any plant or plant category changed
+
+# Versions start from the clock rather than 1, so a version evicted from the cache
+# never comes back with a value that older entries were stored under.
+
+def get_version(name):
+    cache = get_cache()
+    key = f'upick:version:{name}'
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_version(name):
+    # get_version() for the async views
+    cache = get_cache()
+    key = f'upick:version:{name}'
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_version(name):
+    cache = get_cache()
+    key = f'upick:version:{name}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+    cache.set(f'upick:changed:{name}', timezone.now().timestamp(), timeout=None)
+    # Reads stay off the replicas until they have the change, see UPick.routers
+    if settings.UPICK_READ_REPLICAS and settings.UPICK_REPLICA_LAG:
+        cache.set('upick:recent_write', True, timeout=settings.UPICK_REPLICA_LAG)
+
+
+def get_versions(names):
+    """
+    Returns ({name: version}, changed_at) for the names in one cache round trip,
+    changed_at being the time of the latest bump among them. A version read before
+    its first bump counts as changed when it is first read.
+    """
+    cache = get_cache()
+    keys = [f'upick:{kind}:{name}' for name in [*names, 'catalog'] for kind in ('version', 'changed')]
+    found = cache.get_many(list(dict.fromkeys(keys)))
+    versions, changed = {}, []
+    for name in names:
+        if ':' in name:
+            version, changed_at = object_version(name, found)
+        else:
+            version, changed_at = shared_version(name, found)
+        versions[name] = version
+        changed.append(changed_at)
+    return versions, max(changed)
+
+
+def shared_version(name, found):
+    # The version and change time of name, stored on first read
+    cache = get_cache()
+    version = found.get(f'upick:version:{name}')
+    if version is None:
+        version = get_version(name)
+    changed_at = found.get(f'upick:changed:{name}')
+    if changed_at is None:
+        now = timezone.now().timestamp()
+        key = f'upick:changed:{name}'
+        changed_at = now if cache.add(key, now, timeout=None) else cache.get(key, now)
+    return version, changed_at
+
+
+def object_version(name, found):
+    # Per-object versions like farm:<id> are only stored by bump_version, so requests for
+    # ids without an object leave no keys behind. Until the first bump the catalog version,
+    # which every write bumps too, stands in.
+    version, changed_at = found.get(f'upick:version:{name}'), found.get(f'upick:changed:{name}')
+    if version is None or changed_at is None:
+        catalog, catalog_changed_at = shared_version('catalog', found)
+        if version is None:
+            version = f'catalog-{catalog}'
+        if changed_at is None:
+            changed_at = catalog_changed_at
+    return version, changed_at
+
+
+def catalog_version():
+    return get_version('catalog')
+
+
+def bump_catalog_version():
+    bump_version('catalog')
+
+
+#  ------------ list counts ------------------- #
+
+def normalized_filter_params(request):
+    params = request.query_params
+    return sorted(
+        (name, sorted(params.getlist(name)))
+        for name in params
+        if name not in NON_FILTER_PARAMS
+    )
+
+
+def count_cache_entry(request, basename, version=None):
+    """
+    Returns the (key, timeout) under which the row count of a filtered list is cached.
+    Counts filtered on is_open change with the clock and only live for a short while.
+    version is the catalog version, read from the cache when not given.
+    """
+    filter_params = normalized_filter_params(request)
+    digest = sha1(repr(filter_params).encode()).hexdigest()
+    if version is None:
+        version = catalog_version()
+    key = f'upick:count:{basename}:{version}:{digest}'
+    if any(name == 'is_open' for name, _ in filter_params):
+        return key, settings.UPICK_OPEN_FILTER_TIMEOUT
+    return key, settings.UPICK_COUNT_TIMEOUT
+
+
+def cached_count(queryset, key, timeout):
+    cache = get_cache()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout=timeout)
+    return count
+
+
+#  ------------ rendered responses ------------------- #
+
+def get_response_cache():
+    alias = settings.UPICK_RESPONSE_CACHE
+    return caches[alias] if alias else None
+
+
+def response_cache_key(request, basename, versions):
+    params = sorted((name, sorted(request.query_params.getlist(name))) for name in request.query_params)
+    digest = sha1(repr((request.path, params)).encode()).hexdigest()
+    version_part = ':'.join(str(version) for version in get_versions(versions)[0].values())
+    return f'upick:response:{basename}:{version_part}:{digest}'
+
+
+def response_cache_timeout(request, clock):
+    """
+    Seconds a rendered response can be reused. Entries expire when the first is_open
+    value they contain would change, and is_open filtered lists only live for a short while.
+    """
+    timeout = settings.UPICK_RESPONSE_CACHE_TIMEOUT
+    if 'is_open' in request.query_params:
+        timeout = min(timeout, settings.UPICK_OPEN_FILTER_TIMEOUT)
+    seconds_valid = clock.seconds_valid()
+    if seconds_valid is not None:
+        timeout = min(timeout, seconds_valid)
+    return timeout
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Backends whose entries stay in one process or on one host
+PER_HOST_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_caches(app_configs, **kwargs):
+    """
+    The cache versions bumped by the model signals only invalidate the other workers'
+    counts and responses when they share the cache, see UPickFront/settings.py.
+    """
+    warnings = []
+    for setting in ('UPICK_CACHE', 'UPICK_RESPONSE_CACHE'):
+        alias = getattr(settings, setting)
+        backend = settings.CACHES.get(alias, {}).get('BACKEND') if alias else None
+        if backend in PER_HOST_BACKENDS:
+            warnings.append(Warning(
+                f'{setting} uses the {alias!r} cache, a {backend.rsplit(".", 1)[-1]}, which workers on '
+                'other hosts do not share. They keep serving what was cached before a change.',
+                hint='Point the cache at memcached or redis, see CACHES in UPickFront/settings.py.',
+                id='UPick.W001',
+            ))
+    return warnings
@@ -0,0 +1,31 @@
+from hashlib import sha1
+from django.conf import settings
+
+# Conditional GET support. The validators of a response come from the cache versions
+# it depends on (see UPick.caching), which the model signals bump on every change, so
+# they are checked before the response cache and without any query. The versions, the
+# request and a time bucket for is_open values produce the ETag and Last-Modified headers.
+
+
+#  ------------ validators ------------------- #
+
+def conditional_validators(request, versions, changed_at, now):
+    """
+    Returns the (etag, last_modified) pair for a response built from the ``versions``
+    dict at ``now``, changed_at being the time of their latest bump. is_open values
+    can change without any row changing, so both validators also move forward every
+    UPICK_ETAG_TIME_BUCKET seconds.
+    """
+    bucket_size = settings.UPICK_ETAG_TIME_BUCKET
+    bucket = int(now.timestamp()) // bucket_size
+    params = sorted((name, sorted(request.query_params.getlist(name))) for name in request.query_params)
+    fingerprint = (
+        request.path,
+        params,
+        request.accepted_renderer.media_type,
+        sorted(versions.items()),
+        bucket,
+    )
+    etag = '"%s"' % sha1(repr(fingerprint).encode()).hexdigest()
+    last_modified = int(max(changed_at, bucket * bucket_size))
+    return etag, last_modified
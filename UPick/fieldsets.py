@@ -0,0 +1,166 @@
+from django.db.models import Prefetch
+from rest_framework.exceptions import ValidationError
+from .models import Address, FarmPlants, Plant, WorkingHour
+
+# Sparse fieldsets for the farm endpoints. ?fields=id,title,address.geo_location keeps
+# only the named keys, dotted names select inside nested objects. The selection also
+# trims the farm columns fetched with only() and skips the prefetches nobody asked for.
+# ?expand=farm_plants embeds each farm's plants in the list, which otherwise has none.
+
+# The keys of a farm response, nested objects list their own keys
+FARM_PLANT_SCHEMA = dict.fromkeys([
+    'id', 'title', 'category', 'image_url', 'description', 'season_start', 'season_end',
+    'organic', 'scientific_name', 'country_of_origin', 'plant_farm',
+])
+FARM_SCHEMA = {
+    'id': None,
+    'image_url': None,
+    'title': None,
+    'working_hours': dict.fromkeys(['day', 'opening_time', 'closing_time', 'is_open']),
+    'description': None,
+    'address': {
+        **dict.fromkeys(['street', 'city', 'state', 'country', 'zip_code']),
+        'geo_location': dict.fromkeys(['lat', 'long']),
+    },
+    'entrance_fee': None,
+    'phone': None,
+    'email': None,
+    'website': None,
+    'farm_plants': FARM_PLANT_SCHEMA,
+    'distance_miles': None,
+}
+FARM_EXPANSIONS = {'farm_plants'}
+
+# Farm and address columns each key is built from
+FARM_COLUMNS = {
+    'working_hours': ['time_zone'],
+    'farm_plants': [],
+    'address': [],
+    'distance_miles': [],
+}
+ADDRESS_COLUMNS = {'geo_location': ['lat', 'long']}
+# FarmSummary columns, the address keys are columns of the summary too
+SUMMARY_COLUMNS = {
+    'working_hours': ['weekly_hours', 'time_zone'],
+    'farm_plants': [],
+    'distance_miles': [],
+}
+
+
+#  ------------ parsing ------------------- #
+
+def _split(request, name):
+    values = ','.join(request.query_params.getlist(name))
+    return [value.strip() for value in values.split(',') if value.strip()]
+
+
+def requested_fields(request, schema=FARM_SCHEMA):
+    """
+    Returns the ?fields= selection as {name: nested selection or None}, keys in response
+    order, or None when the request has no fields parameter.
+    """
+    names = _split(request, 'fields')
+    if not names:
+        return None
+
+    selection = {}
+    unknown = []
+    for name in names:
+        level_schema, level = schema, selection
+        parts = name.split('.')
+        for depth, part in enumerate(parts):
+            if level_schema is None or part not in level_schema:
+                unknown.append(name)
+                break
+            if depth == len(parts) - 1:
+                level[part] = None
+            elif level.get(part, {}) is not None:
+                level = level.setdefault(part, {})
+            else:
+                # The whole object was already selected
+                break
+            level_schema = level_schema[part]
+    if unknown:
+        raise ValidationError({'fields': [f'Unknown fields: {", ".join(unknown)}.']})
+    return _in_schema_order(selection, schema)
+
+
+def _in_schema_order(selection, schema):
+    return {
+        name: None if selection[name] is None else _in_schema_order(selection[name], schema[name])
+        for name in schema if name in selection
+    }
+
+
+def requested_expansions(request, allowed=FARM_EXPANSIONS):
+    names = set(_split(request, 'expand'))
+    if names - allowed:
+        raise ValidationError({'expand': [f'Unknown relations: {", ".join(sorted(names - allowed))}.']})
+    return names
+
+
+def select_fields(data, fields):
+    # Keeps the selected keys of a representation, lists are trimmed item by item
+    if fields is None or data is None:
+        return data
+    if isinstance(data, list):
+        return [select_fields(item, fields) for item in data]
+    return {name: select_fields(data[name], subfields) for name, subfields in fields.items() if name in data}
+
+
+#  ------------ querying ------------------- #
+
+def farm_columns(fields):
+    # The arguments for Farm.objects.only(), None when every column is needed
+    if fields is None:
+        return None
+    columns = {'id'}
+    for name in fields:
+        columns.update(FARM_COLUMNS.get(name, [name]))
+    return sorted(columns)
+
+
+def summary_columns(fields):
+    # The arguments for FarmSummary.objects.only(), None when every column is needed
+    if fields is None:
+        return None
+    columns = {'id'}
+    for name, subfields in fields.items():
+        if name == 'address':
+            # A null lat tells a farm without an address
+            columns.add('lat')
+            for address_name in subfields or FARM_SCHEMA['address']:
+                columns.update(ADDRESS_COLUMNS.get(address_name, [address_name]))
+        else:
+            columns.update(SUMMARY_COLUMNS.get(name, [name]))
+    return sorted(columns)
+
+
+def farm_lookups(fields, expand=(), detail=False, today=None):
+    """
+    The prefetch lookups for the selected farm fields. Farm plants are fetched for the
+    detail view, or for the list with ?expand=farm_plants, where the in-process
+    taxonomy supplies the plant names. The list only shows today's working hours,
+    today being the days of RequestClock.days_today() the list passes.
+    """
+    lookups = []
+    if fields is None or 'working_hours' in fields:
+        if today is None:
+            lookups.append('working_hours')
+        else:
+            lookups.append(Prefetch('working_hours', queryset=WorkingHour.objects.filter(day__in=today)))
+    if fields is None or 'address' in fields:
+        address_fields = fields and fields['address']
+        if address_fields is None:
+            lookups.append('address')
+        else:
+            columns = {'id', 'farm_id'}
+            for name in address_fields:
+                columns.update(ADDRESS_COLUMNS.get(name, [name]))
+            lookups.append(Prefetch('address', queryset=Address.objects.only(*columns)))
+    if fields is None or 'farm_plants' in fields:
+        if detail:
+            lookups.append(Prefetch('plants__plant', queryset=Plant.objects.select_related('category')))
+        elif 'farm_plants' in expand:
+            lookups.append(Prefetch('plants', queryset=FarmPlants.objects.order_by('id')))
+    return lookups
@@ -1,98 +1,201 @@
 from django_filters import rest_framework as filters
-from django.db.models import Q, DecimalField, ExpressionWrapper, F, Value
-from django.utils import timezone
-from django.db.models.functions import Coalesce
+from django_filters.utils import translate_validation
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.utils.functional import cached_property
 from rest_framework.exceptions import ValidationError
-from .models import Farm
-from math import cos, radians
-import math
+from .models import Farm, FarmPlants, FarmSummary
+from .geo import covering_geohashes, geohash_q, haversine_expression
+from .schedule import get_request_clock, open_farm_ids
+from .search import asearch_plan, search, search_plan
+from .seasons import in_season_ids
+
+class RadiusFilterSet(filters.FilterSet):
+    # Radius search and distance ordering around the address found at ``address_field``, None
+    # when the model has the location columns itself, and ?q= keyword search on the
+    # SearchToken entries of ``search_kind`` at ``search_field``
+    address_field = 'address'
+    search_kind = 'farm'
+    search_field = 'id'
 
-class FarmFilter(filters.FilterSet):
-    
-    is_open = filters.BooleanFilter(method='filter_is_open', label='Is Open')
     radius = filters.NumberFilter(method='filter_radius_long_lat', label='Radius')
     address__lat = filters.NumberFilter(method='filter_radius_long_lat', label='Latitude')
     address__long = filters.NumberFilter(method='filter_radius_long_lat', label='Longitude')
+    ordering = filters.ChoiceFilter(method='filter_ordering', choices=[('distance', 'Distance')], label='Ordering')
+    q = filters.CharFilter(method='filter_search', label='Search')
+
+    #  ------------ async views ------------------- #
+
+    async def aqs(self):
+        """
+        The filtered queryset for the async views. Everything that would query the
+        database while building qs (form validation of model choices, the search plan)
+        is awaited first, so qs itself runs no query.
+        """
+        await self.aprepare()
+        if not self.is_valid():
+            raise translate_validation(self.errors)
+        return self.qs
+
+    async def aprepare(self):
+        if any(isinstance(filter_, filters.ModelChoiceFilter) for filter_ in self.filters.values()):
+            await sync_to_async(self.is_valid)()
+        self.search_terms = await asearch_plan(self.search_kind, self.request.query_params.get('q', ''))
+
+    #  ------------ keyword search ------------------- #
+
+    @cached_property
+    def search_terms(self):
+        # The ?q= terms rarest first, which takes a few index probes
+        return search_plan(self.search_kind, self.request.query_params.get('q', ''))
+
+    def filter_search(self, queryset, name, value):
+        # Ranked by relevance, ?ordering=distance still wins
+        return search(queryset, self.search_kind, self.search_terms, self.search_field)
+
+    #  ------------ filtering based on location radius ------------------- #
+
+    def get_search_point(self):
+        client_radius = self.request.query_params.get('radius')
+        client_latitude = self.request.query_params.get('address__lat')
+        client_longitude = self.request.query_params.get('address__long')
+
+        if not client_radius or not client_latitude or not client_longitude:
+            raise ValidationError('Please provide values for radius, address__lat, and address__long.')
+
+        try:
+            radius = float(client_radius)
+            latitude = float(client_latitude)
+            longitude = float(client_longitude)
+        except ValueError:
+            raise ValidationError('radius, address__lat, and address__long must be numbers.')
+
+        if radius < 0 or not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            raise ValidationError('Please provide a positive radius and a valid latitude and longitude.')
+
+        return radius, latitude, longitude
+
+    def address_lookup(self, name):
+        return name if self.address_field is None else f'{self.address_field}__{name}'
+
+    def annotate_distance(self, queryset):
+        if 'distance_miles' in queryset.query.annotations:
+            return queryset
+        _, latitude, longitude = self.get_search_point()
+        return queryset.annotate(distance_miles=haversine_expression(
+            latitude, longitude, self.address_lookup('lat'), self.address_lookup('long')
+        ))
+
+    def filter_radius_long_lat(self, queryset, name, value):
+        # radius, address__lat and address__long all route here, only apply the search once
+        radius, latitude, longitude = self.get_search_point()
+        if name != 'radius':
+            return queryset
+
+        # Prune candidates through the indexed geohash cells covering the circle,
+        # then keep only the farms whose great-circle distance is within the radius
+        prefixes = covering_geohashes(latitude, longitude, radius)
+        cells = geohash_q(self.address_lookup('geohash'), prefixes)
+        if self.address_field is None:
+            # As a subquery, otherwise SQLite walks the id order of the page instead of the geo index
+            cells = Q(id__in=queryset.model._default_manager.filter(cells).values('id'))
+        queryset = queryset.filter(cells)
+        queryset = self.annotate_distance(queryset)
+        return queryset.filter(distance_miles__lte=radius)
+
+    #  ------------ ordering based on distance ------------------- #
+
+    def filter_ordering(self, queryset, name, value):
+        if value == 'distance':
+            queryset = self.annotate_distance(queryset).order_by('distance_miles', 'id')
+        return queryset
+
+
+class FarmFilter(RadiusFilterSet):
+    
+    is_open = filters.BooleanFilter(method='filter_is_open', label='Is Open')
     entrance_fee = filters.RangeFilter(method='filter_entrance_fee', label='Entrance Fee')
+    plant = filters.NumberFilter(method='filter_plant', label='Plant', decimal_places=0)
+    category = filters.NumberFilter(method='filter_category', label='Plant Category', decimal_places=0)
 
 
     class Meta:
         model = Farm
         
-        fields = ['radius', 'address__lat', 'address__long','is_open', 'entrance_fee']
+        fields = ['q', 'radius', 'address__lat', 'address__long','is_open', 'entrance_fee', 'plant', 'category', 'ordering']
 
     #  ------------ filtering based on who is open ------------------- #
 
     def filter_is_open(self, queryset, name, value):
-        current_day = timezone.now().strftime('%a').lower()[0:3]
-        current_time = timezone.now().time()
-        
+        # One range lookup on the OpenInterval schedule index, evaluated in each farm's time zone
+        open_farms = open_farm_ids(get_request_clock(self.request).now)
+
         if value is True:
-            # Filter farms that are open at the current day and time
-            queryset = queryset.filter(
-                working_hours__day=current_day,
-                working_hours__opening_time__lte=current_time,
-                working_hours__closing_time__gte=current_time
-            )
+            queryset = queryset.filter(id__in=open_farms)
         elif value is False:
-            # Filter farms that are not open at the current day and time
-            queryset = queryset.filter(
-                Q(working_hours__day=current_day) &
-                (Q(working_hours__opening_time__gt=current_time) | Q(working_hours__closing_time__lt=current_time))
-            )
+            queryset = queryset.exclude(id__in=open_farms)
     
         return queryset
 
-    #  ------------ filtering based on location radius ------------------- #
+    #  ------------ filtering based on entrance fee------------------- #
 
-    def filter_radius_long_lat(self, queryset, name, value):
-        client_radius = self.request.query_params.get('radius')
-        client_latitude = self.request.query_params.get('address__lat')
-        client_longitude = self.request.query_params.get('address__long')
+    def filter_entrance_fee(self, queryset, name, value):
+        entrance_fee_min, entrance_fee_max = value.start, value.stop
+        if entrance_fee_min is None and entrance_fee_max is None:
+            return queryset
 
-        if not client_radius or not client_latitude or not client_longitude:
-            raise ValidationError('Please provide values for radius, address__lat, and address__long.')
+        # Compare the bare column so the fee index serves the range
+        fee_range = Q()
+        if entrance_fee_min is not None:
+            fee_range &= Q(entrance_fee__gte=entrance_fee_min)
+        if entrance_fee_max is not None:
+            fee_range &= Q(entrance_fee__lte=entrance_fee_max)
 
-        radius = float(client_radius)
-        latitude = float(client_latitude)
-        longitude = float(client_longitude)
+        # Farms without an entrance fee are free
+        if (entrance_fee_min is None or entrance_fee_min <= 0) and (entrance_fee_max is None or entrance_fee_max >= 0):
+            fee_range |= Q(entrance_fee__isnull=True)
 
-        # Calculate the latitude and longitude ranges based on the given radius
-        lat_diff = radius / 69.0  # Approximate latitude degrees per mile
-        lon_diff = radius / (69.0 * abs(math.cos(math.radians(latitude))))  # Approximate longitude degrees per mile
+        return queryset.filter(fee_range)
 
-        min_latitude = latitude - lat_diff
-        max_latitude = latitude + lat_diff
-        min_longitude = longitude - lon_diff
-        max_longitude = longitude + lon_diff
+    #  ------------ filtering based on plants ------------------- #
 
-        # Filter farms within the latitude and longitude ranges
-        queryset = queryset.filter(
-            Q(address__lat__gte =  min_latitude) & 
-            Q(address__lat__lte =  max_latitude) &
-            Q(address__long__gte =  min_longitude) & 
-            Q(address__long__lte =  max_longitude) 
-        )
+    def filter_plant(self, queryset, name, value):
+        return queryset.filter(id__in=FarmPlants.objects.filter(plant_id=value).values('farm_id'))
 
-        return queryset
-    
-    #  ------------ filtering based on entrance fee------------------- #
+    def filter_category(self, queryset, name, value):
+        return queryset.filter(id__in=FarmPlants.objects.filter(plant__category_id=value).values('farm_id'))
+
+
+class FarmSummaryFilter(FarmFilter):
+    # FarmFilter on the FarmSummary table, where the farm location and the ids of its
+    # plants and their categories are in the row itself
+    address_field = None
+
+    class Meta(FarmFilter.Meta):
+        model = FarmSummary
+
+    def filter_plant(self, queryset, name, value):
+        return queryset.filter(plant_ids__contains=f',{int(value)},')
+
+    def filter_category(self, queryset, name, value):
+        return queryset.filter(category_ids__contains=f',{int(value)},')
+
+
+class PlantFilter(RadiusFilterSet):
+    address_field = 'farm__address'
+    search_kind = 'plant'
+    search_field = 'plant_id'
+
+    in_season = filters.DateFilter(method='filter_in_season', label='In Season On')
+
+    class Meta:
+        model = FarmPlants
+        fields = ['q', 'plant__category', 'farm', 'plant', 'in_season', 'radius', 'address__lat', 'address__long', 'ordering']
+
+
+    #  ------------ filtering based on season ------------------- #
+
+    def filter_in_season(self, queryset, name, value):
+        # One range lookup on the SeasonInterval day-of-year index
+        return queryset.filter(id__in=in_season_ids(value))
 
-    def filter_entrance_fee(self, queryset, name, value):
-        entrance_fee_min = value.start if value.start is not None else 0
-        entrance_fee_max = value.stop if value.stop is not None else 999999999
-
-        # Handle null values by considering them as zero
-        entrance_fee_coalesce = ExpressionWrapper(
-            Coalesce(F('entrance_fee'), Value(0, output_field=DecimalField())),
-            output_field=DecimalField()
-        )
-
-        # Filter farms with entrance fees within the specified range
-        queryset = queryset.annotate(entrance_fee_coalesce=entrance_fee_coalesce)
-        queryset = queryset.filter(
-            entrance_fee_coalesce__gte=entrance_fee_min,
-            entrance_fee_coalesce__lte=entrance_fee_max
-        )
-        
-        return queryset
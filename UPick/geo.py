@@ -0,0 +1,179 @@
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+import math
+
+EARTH_RADIUS_MILES = 3958.8
+
+# Precision stored on Address.geohash, a 9 character geohash is roughly a 5m x 5m cell
+GEOHASH_PRECISION = 9
+
+# Upper bound on the number of geohash cells used to cover a search area
+MAX_COVERING_CELLS = 32
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+#  ------------ geohash encoding ------------------- #
+
+def encode_geohash(lat, long, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    long_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(geohash) < precision:
+        if even:
+            mid = (long_range[0] + long_range[1]) / 2
+            if long >= mid:
+                bits = (bits << 1) | 1
+                long_range[0] = mid
+            else:
+                bits = bits << 1
+                long_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits = bits << 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(geohash)
+
+
+def geohash_cell_size(precision):
+    # Returns the (height, width) of a geohash cell in degrees
+    total_bits = precision * 5
+    long_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << long_bits)
+
+
+def _next_prefix(prefix):
+    # Smallest geohash that sorts after every geohash starting with prefix
+    chars = list(prefix)
+    while chars:
+        index = _BASE32.index(chars[-1])
+        if index < len(_BASE32) - 1:
+            chars[-1] = _BASE32[index + 1]
+            return ''.join(chars)
+        chars.pop()
+    return None
+
+
+#  ------------ search area ------------------- #
+
+def bounding_box(lat, long, radius):
+    """
+    Returns (min_lat, max_lat, long_ranges) enclosing the circle of ``radius`` miles.
+    ``long_ranges`` is split in two when the circle crosses the antimeridian and
+    covers every longitude when the circle contains a pole.
+    """
+    angular_radius = radius / EARTH_RADIUS_MILES
+    lat_diff = math.degrees(angular_radius)
+    min_lat = lat - lat_diff
+    max_lat = lat + lat_diff
+
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), [(-180.0, 180.0)]
+
+    ratio = math.sin(angular_radius) / math.cos(math.radians(lat))
+    if ratio >= 1:
+        return min_lat, max_lat, [(-180.0, 180.0)]
+
+    long_diff = math.degrees(math.asin(ratio))
+    min_long = long - long_diff
+    max_long = long + long_diff
+
+    if min_long < -180:
+        return min_lat, max_lat, [(min_long + 360, 180.0), (-180.0, max_long)]
+    if max_long > 180:
+        return min_lat, max_lat, [(min_long, 180.0), (-180.0, max_long - 360)]
+    return min_lat, max_lat, [(min_long, max_long)]
+
+
+def _cell_indexes(low, high, origin, size, cell_count):
+    first = int((low - origin) // size)
+    last = int((high - origin) // size)
+    return range(max(first, 0), min(last, cell_count - 1) + 1)
+
+
+def covering_geohashes(lat, long, radius, max_cells=MAX_COVERING_CELLS):
+    """
+    Returns the sorted geohash prefixes whose cells cover the search circle,
+    using the finest precision that needs at most ``max_cells`` cells.
+    """
+    min_lat, max_lat, long_ranges = bounding_box(lat, long, radius)
+    return covering_box(min_lat, max_lat, long_ranges, max_cells)
+
+
+def covering_box(min_lat, max_lat, long_ranges, max_cells=MAX_COVERING_CELLS):
+    # Same as covering_geohashes() for a latitude range and list of longitude ranges
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = geohash_cell_size(precision)
+        rows = _cell_indexes(min_lat, max_lat, -90.0, height, round(180.0 / height))
+        column_ranges = [
+            _cell_indexes(min_long, max_long, -180.0, width, round(360.0 / width))
+            for min_long, max_long in long_ranges
+        ]
+        # Ranges are counted before any cell is listed, large boxes span millions of fine cells
+        if len(rows) * sum(map(len, column_ranges)) <= max_cells or precision == 1:
+            break
+
+    columns = [column for column_range in column_ranges for column in column_range]
+    prefixes = {
+        encode_geohash(-90.0 + (row + 0.5) * height, -180.0 + (column + 0.5) * width, precision)
+        for row in rows
+        for column in columns
+    }
+    return sorted(prefixes)
+
+
+def geohash_q(field, prefixes):
+    """
+    Builds an index friendly predicate matching every geohash under ``prefixes``.
+    Prefixes that are adjacent in sort order are merged into a single range.
+    """
+    ranges = []
+    for prefix in prefixes:
+        upper = _next_prefix(prefix)
+        if ranges and ranges[-1][1] == prefix:
+            ranges[-1][1] = upper
+        else:
+            ranges.append([prefix, upper])
+
+    predicate = Q()
+    for lower, upper in ranges:
+        bounds = Q(**{f'{field}__gte': lower})
+        if upper is not None:
+            bounds &= Q(**{f'{field}__lt': upper})
+        predicate |= bounds
+    return predicate
+
+
+#  ------------ distance ------------------- #
+
+def haversine_miles(lat1, long1, lat2, long2):
+    d_lat = math.radians(lat2 - lat1)
+    d_long = math.radians(long2 - long1)
+    a = (math.sin(d_lat / 2) ** 2
+         + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(d_long / 2) ** 2)
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_expression(lat, long, lat_field, long_field):
+    # Database side equivalent of haversine_miles for annotating querysets
+    d_lat = Radians(F(lat_field) - Value(lat)) / 2
+    d_long = Radians(F(long_field) - Value(long)) / 2
+    a = (Power(Sin(d_lat), 2)
+         + Value(math.cos(math.radians(lat))) * Cos(Radians(F(lat_field))) * Power(Sin(d_long), 2))
+    return Value(2 * EARTH_RADIUS_MILES) * ASin(Least(Sqrt(a), Value(1.0)), output_field=FloatField())
@@ -0,0 +1,71 @@
+import json
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_test_environment
+from UPick.benchmark import compare, environment, prepare_database, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the farm and plant endpoints on on-disk SQLite databases of synthetic farms, '
+        'writes the results as JSON and fails when they regress against a baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1000,10000,100000',
+                            help='Comma separated farm counts, one database each')
+        parser.add_argument('--iterations', type=int, default=20, help='Measured requests per scenario')
+        parser.add_argument('--only', action='append', help='Only run scenarios whose name contains this')
+        parser.add_argument('--data-dir', default=Path(tempfile.gettempdir()) / 'upick-benchmark',
+                            help='Where the SQLite databases are kept between runs')
+        parser.add_argument('--output', default='benchmark-results.json', help='Results file')
+        parser.add_argument('--baseline',
+                            help='Results file of an earlier run to compare against, UPick/benchmark-baseline.json '
+                                 'holds a run of the default scales on a developer machine')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='Allowed relative growth of the median latency')
+
+    def handle(self, *args, **options):
+        try:
+            scales = [int(scale) for scale in options['scales'].split(',')]
+        except ValueError:
+            raise CommandError('--scales must be a comma separated list of farm counts.')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as baseline_file:
+                baseline = json.load(baseline_file)
+
+        data_dir = Path(options['data_dir'])
+        data_dir.mkdir(parents=True, exist_ok=True)
+        setup_test_environment()
+
+        results = {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'environment': environment(),
+            'iterations': options['iterations'],
+            'scales': {},
+        }
+        # Without the debug toolbar or query logging
+        with override_settings(DEBUG=False):
+            for scale in scales:
+                seconds = prepare_database(data_dir / f'upick-{scale}.sqlite3', scale)
+                if seconds:
+                    self.stdout.write(f'Loaded {scale} farms in {seconds:.1f}s')
+                scale_results = run_benchmarks(options['iterations'], options['only'])
+                results['scales'][str(scale)] = scale_results
+                for name, result in scale_results.items():
+                    self.stdout.write(
+                        f'{scale:>7} {name:28} p50 {result["p50_ms"]:>8.2f}ms  p90 {result["p90_ms"]:>8.2f}ms  '
+                        f'p99 {result["p99_ms"]:>8.2f}ms  {result["queries"]:>3} queries  {result["bytes"]:>8} bytes')
+
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+        self.stdout.write(f'Results written to {options["output"]}')
+
+        if baseline is not None:
+            regressions = compare(results, baseline, tolerance=options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against %s:\n  %s' % (options['baseline'], '\n  '.join(regressions)))
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}'))
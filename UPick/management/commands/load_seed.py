@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from UPick.models import Farm
+from UPick.seed import SeedLoader, flush_catalog, read_seed_file, synthetic_records
+
+DEFAULT_SEED_FILES = [
+    settings.BASE_DIR / 'Seed' / 'Seed.sql',
+    settings.BASE_DIR / 'Seed' / 'UPick_farmplants.sql',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Loads the catalogue from MySQL insert dumps (.sql) or JSONL files (.jsonl) with bulk inserts, '
+        'and optionally adds synthetic farms for load testing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='Dumps to load, defaults to the files in Seed/')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per insert statement and transaction')
+        parser.add_argument('--scale', type=int, default=0,
+                            help='Add this many times the loaded farm count of synthetic farms')
+        parser.add_argument('--synthetic-only', action='store_true', help='Skip the dumps, needs --farms')
+        parser.add_argument('--farms', type=int, default=0, help='Add this many synthetic farms')
+        parser.add_argument('--random-seed', type=int, default=0, help='Seed of the synthetic data generator')
+        parser.add_argument('--flush', action='store_true', help='Empty the UPick tables first')
+        parser.add_argument('--database', default='default', help='Database alias to load into')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        using = options['database']
+        if options['flush']:
+            flush_catalog(using)
+
+        loader = SeedLoader(batch_size=options['batch_size'], using=using)
+        if not options['synthetic_only']:
+            for path in options['files'] or DEFAULT_SEED_FILES:
+                loader.load(read_seed_file(path))
+
+        synthetic_farms = options['farms'] + options['scale'] * Farm.objects.using(using).count()
+        if synthetic_farms:
+            loader.load(synthetic_records(synthetic_farms, seed=options['random_seed'], using=using))
+        loader.finish()
+
+        for table, rows in loader.rows.items():
+            seconds = loader.seconds[table]
+            rate = rows / seconds if seconds else 0
+            self.stdout.write(f'{table:24} {rows:>10} rows {seconds:>8.2f}s {rate:>12,.0f} rows/s')
@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from UPick.models import FarmSummary
+from UPick.summary import rebuild_farm_summaries, stale_farm_summaries
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the FarmSummary table read by the farm list and checks every row against its farm.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify-only', action='store_true', help='Only check the table, without rebuilding it')
+        parser.add_argument('--database', default='default', help='Database alias to rebuild')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not options['verify_only']:
+            started = time.perf_counter()
+            rebuild_farm_summaries(using=using)
+            rows = FarmSummary.objects.using(using).count()
+            self.stdout.write(f'Rebuilt {rows} farm summaries in {time.perf_counter() - started:.2f}s')
+
+        stale = stale_farm_summaries(using=using)
+        if stale:
+            shown = ', '.join(str(farm_id) for farm_id in stale[:20])
+            raise CommandError(f'{len(stale)} farm summaries differ from their farms: {shown}'
+                               f'{" ..." if len(stale) > 20 else ""}')
+        self.stdout.write('Every farm summary matches its farm.')
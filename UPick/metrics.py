@@ -0,0 +1,149 @@
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+# Per-request instrumentation that is cheap enough to leave on in production.
+# RequestMetricsMiddleware counts and times every SQL query through database
+# execute wrappers, the views time their serializers with serializer_timer(), and
+# the totals go into a Server-Timing header and a sampled structured log line.
+
+logger = logging.getLogger('UPick.metrics')
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.slow_queries = []
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db_seconds += elapsed
+            threshold = settings.UPICK_SLOW_QUERY_MS
+            if threshold is not None and elapsed * 1000 >= threshold:
+                self.slow_queries.append((elapsed, sql))
+
+    def server_timing(self, total_seconds, streaming=False):
+        if streaming:
+            # Headers go out before a streamed body is serialized, only the queries run so
+            # far are known. The full timings are in the logged request line.
+            return 'db;dur=%.1f;desc="%d queries before the body"' % (self.db_seconds * 1000, self.queries)
+        return ', '.join([
+            'db;dur=%.1f;desc="%d queries"' % (self.db_seconds * 1000, self.queries),
+            'serialize;dur=%.1f' % (self.serializer_seconds * 1000),
+            'total;dur=%.1f' % (total_seconds * 1000),
+        ])
+
+
+def get_request_metrics(request):
+    # The metrics of the request, or None when RequestMetricsMiddleware is not installed
+    return getattr(getattr(request, '_request', request), '_upick_metrics', None)
+
+
+@contextmanager
+def serializer_timer(request):
+    """
+    Adds the time spent in the block to the serializer time of the request. Queries
+    run by the serializer are already counted as database time and are left out.
+    """
+    metrics = get_request_metrics(request)
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    db_seconds = metrics.db_seconds
+    try:
+        yield
+    finally:
+        metrics.serializer_seconds += time.perf_counter() - started - (metrics.db_seconds - db_seconds)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the query count, database time, serializer time and response size of each
+    request. Every response gets a Server-Timing header (streamed responses only carry
+    the queries run before the body), a UPICK_METRICS_SAMPLE_RATE share of the requests
+    is logged to the UPick.metrics logger, and queries slower than UPICK_SLOW_QUERY_MS
+    are logged with their SQL.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = request._upick_metrics = RequestMetrics()
+        with self.instrument(metrics):
+            response = self.get_response(request)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = request._upick_metrics = RequestMetrics()
+        # The async ORM queries on the request's sync thread, instrument the connections there
+        stack = await sync_to_async(self.instrument)(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        response['Server-Timing'] = metrics.server_timing(time.perf_counter() - metrics.started, response.streaming)
+        if response.streaming:
+            # Streamed results are serialized while the body is sent, report them at the end
+            response.streaming_content = self.measure_stream(request, response, metrics, response.streaming_content)
+        else:
+            self.report(request, response, metrics, len(response.content))
+        return response
+
+    def instrument(self, metrics):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics.record_query))
+        return stack
+
+    def measure_stream(self, request, response, metrics, streaming_content):
+        size = 0
+        with self.instrument(metrics):
+            for chunk in streaming_content:
+                size += len(chunk)
+                yield chunk
+        self.report(request, response, metrics, size)
+
+    def report(self, request, response, metrics, size):
+        for elapsed, sql in metrics.slow_queries:
+            logger.warning(json.dumps({
+                'event': 'slow_query', 'method': request.method, 'path': request.path,
+                'ms': round(elapsed * 1000, 1), 'sql': sql,
+            }))
+        if random.random() < settings.UPICK_METRICS_SAMPLE_RATE:
+            logger.info(json.dumps({
+                'event': 'request',
+                'method': request.method,
+                'path': request.path,
+                'query': request.META.get('QUERY_STRING', ''),
+                'status': response.status_code,
+                'ms': round((time.perf_counter() - metrics.started) * 1000, 1),
+                'queries': metrics.queries,
+                'db_ms': round(metrics.db_seconds * 1000, 1),
+                'serialize_ms': round(metrics.serializer_seconds * 1000, 1),
+                'bytes': size,
+            }))
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.1 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+# A frozen copy of UPick.geo.encode_geohash() as of this migration
+
+GEOHASH_PRECISION = 9
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode_geohash(lat, long, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    long_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(geohash) < precision:
+        if even:
+            mid = (long_range[0] + long_range[1]) / 2
+            if long >= mid:
+                bits = (bits << 1) | 1
+                long_range[0] = mid
+            else:
+                bits = bits << 1
+                long_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits = bits << 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(geohash)
+
+
+def populate_geohash(apps, schema_editor):
+    Address = apps.get_model('UPick', 'Address')
+    addresses = list(Address.objects.only('id', 'lat', 'long'))
+    for address in addresses:
+        address.geohash = encode_geohash(address.lat, address.long)
+    Address.objects.bulk_update(addresses, ['geohash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('UPick', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='geohash',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=12),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_geohash, migrations.RunPython.noop),
+    ]
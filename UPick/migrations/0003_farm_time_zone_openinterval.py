@@ -0,0 +1,75 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# A frozen copy of UPick.schedule.working_hour_intervals() as of this migration
+
+SECONDS_PER_DAY = 24 * 60 * 60
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+
+DAY_INDEX = {day: index for index, day in enumerate(['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'])}
+
+
+def _seconds(value):
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def working_hour_intervals(day, opening_time, closing_time):
+    if opening_time is None or closing_time is None:
+        return []
+
+    day_start = DAY_INDEX[day] * SECONDS_PER_DAY
+    opens_at = day_start + _seconds(opening_time)
+    closes_at = day_start + _seconds(closing_time)
+    if closing_time < opening_time:
+        closes_at += SECONDS_PER_DAY
+
+    if closes_at < SECONDS_PER_WEEK:
+        return [(opens_at, closes_at)]
+    return [(opens_at, SECONDS_PER_WEEK - 1), (0, closes_at - SECONDS_PER_WEEK)]
+
+
+def populate_open_intervals(apps, schema_editor):
+    WorkingHour = apps.get_model('UPick', 'WorkingHour')
+    OpenInterval = apps.get_model('UPick', 'OpenInterval')
+    rows = []
+    for hour in WorkingHour.objects.select_related('farm').iterator(chunk_size=2000):
+        for opens_at, closes_at in working_hour_intervals(hour.day, hour.opening_time, hour.closing_time):
+            rows.append(OpenInterval(
+                farm_id=hour.farm_id,
+                time_zone=hour.farm.time_zone,
+                opens_at=opens_at,
+                closes_at=closes_at,
+            ))
+    OpenInterval.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('UPick', '0002_address_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='farm',
+            name='time_zone',
+            field=models.CharField(choices=[('America/New_York', 'Eastern'), ('America/Chicago', 'Central'), ('America/Denver', 'Mountain'), ('America/Phoenix', 'Arizona'), ('America/Los_Angeles', 'Pacific'), ('America/Anchorage', 'Alaska'), ('Pacific/Honolulu', 'Hawaii'), ('UTC', 'UTC')], default='UTC', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='OpenInterval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_zone', models.CharField(max_length=64)),
+                ('opens_at', models.PositiveIntegerField()),
+                ('closes_at', models.PositiveIntegerField()),
+                ('farm', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='open_intervals', to='UPick.farm')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['time_zone', 'opens_at', 'closes_at', 'farm'], name='upick_openinterval_now_idx')],
+            },
+        ),
+        migrations.RunPython(populate_open_intervals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('UPick', '0003_farm_time_zone_openinterval'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='farm',
+            name='last_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
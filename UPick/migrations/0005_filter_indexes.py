@@ -0,0 +1,42 @@
+# Generated by Django 4.2.1 on 2026-10-18 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Indexes matched to the FarmFilter and PlantViewSet predicates, each one is checked
+    against the SQLite query plan in UPick.tests.FilterIndexTests.
+
+    On MySQL (InnoDB) every secondary index also stores the primary key, so the
+    composite indexes below are covering for the id lookups the filters do. Check the
+    plans there with EXPLAIN FORMAT=TREE on the queries logged by the filter tests.
+    """
+
+    dependencies = [
+        ('UPick', '0004_last_updated_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='address',
+            name='geohash',
+            field=models.CharField(editable=False, max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['geohash', 'lat', 'long', 'farm'], name='upick_address_geo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='farm',
+            index=models.Index(fields=['entrance_fee'], name='upick_farm_fee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='farmplants',
+            index=models.Index(fields=['plant', 'season_start', 'season_end'], name='upick_farmplants_season_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workinghour',
+            index=models.Index(fields=['farm', 'day', 'opening_time', 'closing_time'], name='upick_workinghour_day_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.1 on 2026-10-18 13:37
+
+from datetime import date
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# A frozen copy of UPick.seasons.season_intervals() as of this migration
+
+LAST_DAY = 366
+
+
+def season_day(value):
+    return date(2000, value.month, value.day).timetuple().tm_yday
+
+
+def season_intervals(season_start, season_end):
+    if season_start is None or season_end is None:
+        return []
+    if (season_end - season_start).days >= 365:
+        return [(1, LAST_DAY)]
+
+    start_day, end_day = season_day(season_start), season_day(season_end)
+    if start_day <= end_day:
+        return [(start_day, end_day)]
+    return [(start_day, LAST_DAY), (1, end_day)]
+
+
+def populate_season_intervals(apps, schema_editor):
+    FarmPlants = apps.get_model('UPick', 'FarmPlants')
+    SeasonInterval = apps.get_model('UPick', 'SeasonInterval')
+    rows = []
+    for farm_plant_id, season_start, season_end in FarmPlants.objects.values_list(
+            'id', 'season_start', 'season_end').iterator(chunk_size=2000):
+        for start_day, end_day in season_intervals(season_start, season_end):
+            rows.append(SeasonInterval(farm_plant_id=farm_plant_id, start_day=start_day, end_day=end_day))
+    SeasonInterval.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('UPick', '0005_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeasonInterval',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_day', models.PositiveSmallIntegerField()),
+                ('end_day', models.PositiveSmallIntegerField()),
+                ('farm_plant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='season_intervals', to='UPick.farmplants')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['start_day', 'end_day', 'farm_plant'], name='upick_seasoninterval_day_idx')],
+            },
+        ),
+        migrations.RunPython(populate_season_intervals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.1 on 2026-10-18 16:02
+
+import re
+import unicodedata
+from django.db import migrations, models
+
+
+# A frozen copy of the tokenizer and field weights of UPick.search as of this migration
+
+MAX_TOKEN_LENGTH = 32
+
+STOP_WORDS = {'a', 'an', 'and', 'at', 'by', 'for', 'in', 'of', 'on', 'or', 'the', 'to', 'with'}
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+FARM_FIELDS = {'title': 8, 'address__city': 4, 'address__state': 2, 'description': 1}
+PLANT_FIELDS = {'title': 8, 'scientific_name': 4, 'category__name': 2, 'country_of_origin': 1}
+
+
+def tokenize(text):
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower()
+    return [word[:MAX_TOKEN_LENGTH] for word in _WORD.findall(text) if len(word) > 1 and word not in STOP_WORDS]
+
+
+def document_tokens(weighted_texts):
+    tokens = {}
+    for text, weight in weighted_texts:
+        for token in tokenize(text):
+            tokens[token] = min(tokens.get(token, 0) + weight, 32767)
+    return tokens
+
+
+def populate_search_tokens(apps, schema_editor):
+    SearchToken = apps.get_model('UPick', 'SearchToken')
+    for kind, model, fields in (('farm', apps.get_model('UPick', 'Farm'), FARM_FIELDS),
+                                ('plant', apps.get_model('UPick', 'Plant'), PLANT_FIELDS)):
+        names = list(fields)
+        rows = []
+        for object_id, *texts in model.objects.values_list('id', *names).iterator(chunk_size=2000):
+            for token, weight in document_tokens(zip(texts, (fields[name] for name in names))).items():
+                rows.append(SearchToken(kind=kind, object_id=object_id, token=token, weight=weight))
+        SearchToken.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('UPick', '0006_seasoninterval'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('farm', 'Farm'), ('plant', 'Plant')], max_length=5)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('token', models.CharField(max_length=32)),
+                ('weight', models.PositiveSmallIntegerField()),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['kind', 'token', 'object_id', 'weight'], name='upick_searchtoken_token_idx'),
+                    models.Index(fields=['kind', 'object_id'], name='upick_searchtoken_object_idx'),
+                ],
+            },
+        ),
+        migrations.RunPython(populate_search_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 4.2.1 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+# A frozen copy of UPick.summary.summary_rows() and its encoding as of this migration
+
+FARM_VALUES = ['id', 'title', 'image_url', 'description', 'entrance_fee', 'phone', 'email', 'website', 'time_zone']
+ADDRESS_VALUES = ['street', 'city', 'state', 'country', 'zip_code', 'lat', 'long', 'geohash']
+
+SUMMARY_FIELDS = FARM_VALUES + ADDRESS_VALUES + ['weekly_hours', 'plant_ids', 'category_ids']
+
+CHUNK_SIZE = 2000
+
+
+def _encode_time(value):
+    return '-' if value is None else value.isoformat()
+
+
+def encode_weekly_hours(working_hours):
+    return ';'.join(
+        f'{day} {_encode_time(opening_time)} {_encode_time(closing_time)}'
+        for day, opening_time, closing_time in working_hours
+    )
+
+
+def encode_ids(ids):
+    return f',{",".join(str(id_) for id_ in ids)},' if ids else ''
+
+
+def summary_rows(farms, working_hours, farm_plants):
+    farms = farms.order_by('id').values_list(*FARM_VALUES, *(f'address__{name}' for name in ADDRESS_VALUES))
+    last_id = None
+    while True:
+        chunk = list((farms if last_id is None else farms.filter(id__gt=last_id))[:CHUNK_SIZE])
+        if not chunk:
+            return
+        farm_ids = [row[0] for row in chunk]
+        last_id = farm_ids[-1]
+
+        hours = {}
+        for farm_id, *hour in working_hours.filter(farm_id__in=farm_ids).order_by('farm_id', 'id').values_list(
+                'farm_id', 'day', 'opening_time', 'closing_time'):
+            hours.setdefault(farm_id, []).append(hour)
+        plants, categories = {}, {}
+        for farm_id, plant_id, category_id in farm_plants.filter(farm_id__in=farm_ids).order_by(
+                'farm_id', 'plant_id').values_list('farm_id', 'plant_id', 'plant__category_id'):
+            plants.setdefault(farm_id, []).append(plant_id)
+            categories.setdefault(farm_id, set()).add(category_id)
+
+        for row in chunk:
+            farm_id = row[0]
+            yield dict(zip(SUMMARY_FIELDS, (
+                *row,
+                encode_weekly_hours(hours.get(farm_id, ())),
+                encode_ids(sorted(set(plants.get(farm_id, ())))),
+                encode_ids(sorted(categories.get(farm_id, ()))),
+            )))
+
+
+def populate_farm_summaries(apps, schema_editor):
+    FarmSummary = apps.get_model('UPick', 'FarmSummary')
+    rows = summary_rows(
+        apps.get_model('UPick', 'Farm').objects.all(),
+        apps.get_model('UPick', 'WorkingHour').objects.all(),
+        apps.get_model('UPick', 'FarmPlants').objects.all(),
+    )
+    FarmSummary.objects.bulk_create((FarmSummary(**values) for values in rows), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('UPick', '0007_searchtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FarmSummary',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=255)),
+                ('image_url', models.CharField(max_length=2000, null=True)),
+                ('description', models.TextField(null=True)),
+                ('entrance_fee', models.DecimalField(decimal_places=2, max_digits=6, null=True)),
+                ('phone', models.CharField(max_length=255, null=True)),
+                ('email', models.CharField(max_length=254, null=True)),
+                ('website', models.CharField(max_length=2000, null=True)),
+                ('time_zone', models.CharField(max_length=64)),
+                ('street', models.CharField(max_length=100, null=True)),
+                ('city', models.CharField(max_length=100, null=True)),
+                ('state', models.CharField(max_length=100, null=True)),
+                ('country', models.CharField(max_length=100, null=True)),
+                ('zip_code', models.CharField(max_length=10, null=True)),
+                ('lat', models.FloatField(null=True)),
+                ('long', models.FloatField(null=True)),
+                ('geohash', models.CharField(max_length=12, null=True)),
+                ('weekly_hours', models.TextField(default='')),
+                ('plant_ids', models.TextField(default='')),
+                ('category_ids', models.TextField(default='')),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['entrance_fee'], name='upick_summary_fee_idx'),
+                    models.Index(fields=['geohash', 'lat', 'long', 'id'], name='upick_summary_geo_idx'),
+                ],
+            },
+        ),
+        migrations.RunPython(populate_farm_summaries, migrations.RunPython.noop),
+    ]
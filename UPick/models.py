@@ -1,10 +1,21 @@
 from django.db import models
+from .geo import encode_geohash
 
 # Create your models here.
 
 # -------------------- FARM --------------------#
 
 class Farm(models.Model):
+    TIME_ZONES = [
+        ('America/New_York', 'Eastern'),
+        ('America/Chicago', 'Central'),
+        ('America/Denver', 'Mountain'),
+        ('America/Phoenix', 'Arizona'),
+        ('America/Los_Angeles', 'Pacific'),
+        ('America/Anchorage', 'Alaska'),
+        ('Pacific/Honolulu', 'Hawaii'),
+        ('UTC', 'UTC'),
+    ]
     title = models.CharField(max_length=255)
     image_url = models.CharField(max_length = 2000, null = True)
     description = models.TextField(null=True)
@@ -12,7 +23,15 @@ class Farm(models.Model):
     phone = models.CharField(max_length=255, null = True)
     email = models.EmailField(unique=True, null = True)
     website = models.CharField(max_length = 2000, null=True)
-    last_updated = models.DateTimeField(auto_now=True)
+    # Working hours are in the farm's local time
+    time_zone = models.CharField(max_length=64, choices=TIME_ZONES, default='UTC')
+    last_updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Range scans for the entrance fee filter
+            models.Index(fields=['entrance_fee'], name='upick_farm_fee_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"{self.title}"
@@ -26,11 +45,26 @@ class Address(models.Model):
     zip_code = models.CharField(max_length=10)
     lat = models.FloatField()
     long = models.FloatField()
+    # Derived from lat/long on save, used to prune radius searches with index range scans
+    geohash = models.CharField(max_length=12, editable=False)
     farm = models.OneToOneField(Farm, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # Covers the radius search: geohash ranges, then haversine on lat/long
+            models.Index(fields=['geohash', 'lat', 'long', 'farm'], name='upick_address_geo_idx'),
+        ]
+
     def __str__(self) -> str:
         return f"{self.street} {self.city} {self.state} {self.country} {self.zip_code}"
 
+    def save(self, *args, **kwargs):
+        self.geohash = encode_geohash(self.lat, self.long)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ('lat' in update_fields or 'long' in update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        super().save(*args, **kwargs)
+
 class WorkingHour(models.Model):
     DAYS_OF_WEEK = [
         ('mon', 'Monday'),
@@ -46,6 +80,25 @@ class WorkingHour(models.Model):
     closing_time = models.TimeField(null=True)
     farm = models.ForeignKey(Farm, on_delete=models.CASCADE, related_name= 'working_hours')
 
+    class Meta:
+        indexes = [
+            # Covers the prefetch of a page of farms' working hours for today
+            models.Index(fields=['farm', 'day', 'opening_time', 'closing_time'], name='upick_workinghour_day_idx'),
+        ]
+
+class OpenInterval(models.Model):
+    # Weekly schedule index rebuilt from WorkingHour, see UPick.schedule.
+    # Bounds are inclusive seconds since Monday 00:00 in the farm's local time
+    farm = models.ForeignKey(Farm, on_delete=models.CASCADE, related_name='open_intervals')
+    time_zone = models.CharField(max_length=64)
+    opens_at = models.PositiveIntegerField()
+    closes_at = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['time_zone', 'opens_at', 'closes_at', 'farm'], name='upick_openinterval_now_idx'),
+        ]
+
 # -------------------- PLANT --------------------#
 
 class PlantCategory(models.Model):
@@ -76,3 +129,77 @@ class FarmPlants(models.Model):
     season_end = models.DateField()
     organic = models.BooleanField() 
     description = models.TextField(null=True)
+
+    class Meta:
+        indexes = [
+            # Serves the plant filter and season lookups of a plant without touching the table
+            models.Index(fields=['plant', 'season_start', 'season_end'], name='upick_farmplants_season_idx'),
+        ]
+
+class SeasonInterval(models.Model):
+    # Day-of-year index of FarmPlants seasons rebuilt on save, see UPick.seasons.
+    # Days are inclusive and counted in a leap year so that Feb 29 has its own day
+    farm_plant = models.ForeignKey(FarmPlants, on_delete=models.CASCADE, related_name='season_intervals')
+    start_day = models.PositiveSmallIntegerField()
+    end_day = models.PositiveSmallIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_day', 'end_day', 'farm_plant'], name='upick_seasoninterval_day_idx'),
+        ]
+
+# -------------------- SEARCH --------------------#
+
+class SearchToken(models.Model):
+    # Inverted index of farm and plant text for ?q= searches, see UPick.search.
+    # One row per token of a farm or plant, weighted by the fields it appears in
+    KINDS = [
+        ('farm', 'Farm'),
+        ('plant', 'Plant'),
+    ]
+    kind = models.CharField(max_length=5, choices=KINDS)
+    object_id = models.PositiveBigIntegerField()
+    token = models.CharField(max_length=32)
+    weight = models.PositiveSmallIntegerField()
+
+    class Meta:
+        indexes = [
+            # Token lookups and prefix ranges, covering the relevance sums
+            models.Index(fields=['kind', 'token', 'object_id', 'weight'], name='upick_searchtoken_token_idx'),
+            # Reindexing one farm or plant
+            models.Index(fields=['kind', 'object_id'], name='upick_searchtoken_object_idx'),
+        ]
+
+# -------------------- SUMMARY --------------------#
+
+class FarmSummary(models.Model):
+    # Read-optimized copy of each farm for the farm list, rebuilt by the model signals, see
+    # UPick.summary. The id is the farm id, the address columns are null without an address
+    id = models.BigIntegerField(primary_key=True)
+    title = models.CharField(max_length=255)
+    image_url = models.CharField(max_length=2000, null=True)
+    description = models.TextField(null=True)
+    entrance_fee = models.DecimalField(max_digits=6, decimal_places=2, null=True)
+    phone = models.CharField(max_length=255, null=True)
+    email = models.CharField(max_length=254, null=True)
+    website = models.CharField(max_length=2000, null=True)
+    time_zone = models.CharField(max_length=64)
+    street = models.CharField(max_length=100, null=True)
+    city = models.CharField(max_length=100, null=True)
+    state = models.CharField(max_length=100, null=True)
+    country = models.CharField(max_length=100, null=True)
+    zip_code = models.CharField(max_length=10, null=True)
+    lat = models.FloatField(null=True)
+    long = models.FloatField(null=True)
+    geohash = models.CharField(max_length=12, null=True)
+    # 'mon 08:00:00 17:00:00;tue - -' in working hour order, '-' for no time
+    weekly_hours = models.TextField(default='')
+    # ',3,17,42,' so a single id matches with contains=',17,'
+    plant_ids = models.TextField(default='')
+    category_ids = models.TextField(default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['entrance_fee'], name='upick_summary_fee_idx'),
+            models.Index(fields=['geohash', 'lat', 'long', 'id'], name='upick_summary_geo_idx'),
+        ]
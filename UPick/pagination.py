@@ -0,0 +1,79 @@
+from functools import partial
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from .caching import cached_count, count_cache_entry
+
+
+class CachedCountPaginator(Paginator):
+    # Reads the total row count from the cache instead of running COUNT(*) on every page
+
+    def __init__(self, object_list, per_page, cache_key=None, cache_timeout=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.cache_key = cache_key
+        self.cache_timeout = cache_timeout
+
+    @cached_property
+    def count(self):
+        if self.cache_key is None:
+            return super().count
+        return cached_count(self.object_list, self.cache_key, self.cache_timeout)
+
+
+class UPickPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cache_key, cache_timeout = count_cache_entry(request, view.basename)
+        self.django_paginator_class = partial(
+            CachedCountPaginator, cache_key=cache_key, cache_timeout=cache_timeout)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_info(self, results_per_page):
+        return {
+            'count': self.page.paginator.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results_per_page': results_per_page
+        }
+
+
+class UPickCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key, opted into with ?cursor= (empty for the first page).
+    Every page is an index range scan, and the total count is only computed with ?count=true.
+    Pages are always in id order, so ?ordering= and the ?q= relevance order are rejected.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = 'id'
+    count_query_param = 'count'
+    ordered_params = ('ordering', 'q')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordered = [name for name in self.ordered_params if request.query_params.get(name)]
+        if ordered:
+            raise ValidationError({self.cursor_query_param: [
+                f'Cursor pages are in id order and cannot be combined with {", ".join(ordered)}.'
+            ]})
+        self.queryset = queryset
+        self.basename = view.basename
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count(self):
+        if self.request.query_params.get(self.count_query_param, '').lower() in ('1', 'true'):
+            cache_key, cache_timeout = count_cache_entry(self.request, self.basename)
+            return cached_count(self.queryset, cache_key, cache_timeout)
+        return None
+
+    def get_info(self, results_per_page):
+        return {
+            'count': self.get_count(),
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results_per_page': results_per_page
+        }
@@ -0,0 +1,120 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DatabaseError, connections
+from .caching import get_cache
+
+# Read replicas for the GET-only viewsets. FarmViewSet and PlantViewSet run each
+# request inside replica_reads(), which points the reads of that request at one of
+# the UPICK_READ_REPLICAS aliases, taken in turn among the ones passing their health
+# check. Everything else, writes and the reads the model signals make while saving,
+# stays on default. A replica failing its check, or a query during a request, is
+# left out for UPICK_REPLICA_RETRY seconds, and with no healthy replica reads go to default.
+# For UPICK_REPLICA_LAG seconds after any write reads stay on default too, so that what
+# the version-keyed caches store under the new versions never comes from a replica
+# that hasn't applied the write yet.
+
+_read_alias = ContextVar('upick_read_alias', default=None)
+_turn = itertools.count()
+_lock = threading.Lock()
+# Monotonic time of the last passed check and until when a failed replica is left out
+_checked_at = {}
+_down_until = {}
+
+
+class ReadReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as default
+        databases = {'default', *settings.UPICK_READ_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+#  ------------ health checks ------------------- #
+
+def is_healthy(alias):
+    """
+    Whether the replica can take reads. A passed check is trusted for
+    UPICK_REPLICA_CHECK_INTERVAL seconds, a failed one for UPICK_REPLICA_RETRY seconds.
+    """
+    now = time.monotonic()
+    if _down_until.get(alias, 0) > now:
+        return False
+    if now - _checked_at.get(alias, float('-inf')) < settings.UPICK_REPLICA_CHECK_INTERVAL:
+        return True
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except DatabaseError:
+        mark_down(alias)
+        return False
+    _checked_at[alias] = now
+    return True
+
+
+def mark_down(alias):
+    with _lock:
+        _down_until[alias] = time.monotonic() + settings.UPICK_REPLICA_RETRY
+        _checked_at.pop(alias, None)
+    # Drop the broken connection, the next check opens a new one
+    try:
+        connections[alias].close()
+    except DatabaseError:
+        pass
+
+
+def reset_health():
+    _checked_at.clear()
+    _down_until.clear()
+
+
+def choose_replica():
+    # The next healthy replica in turn, None when there is none or after a recent write
+    replicas = settings.UPICK_READ_REPLICAS
+    if not replicas or get_cache().get('upick:recent_write'):
+        return None
+    start = next(_turn)
+    for offset in range(len(replicas)):
+        alias = replicas[(start + offset) % len(replicas)]
+        if is_healthy(alias):
+            return alias
+    return None
+
+
+#  ------------ routing a request ------------------- #
+
+@contextmanager
+def replica_reads(alias):
+    # Routes the reads made inside the block to alias, or to default when alias is None
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+def replica_stream(alias, streaming_content):
+    """
+    Reads the chunks of a streamed response body, generated after the view returned,
+    with the reads routed to alias. The routing is only set while a chunk is made,
+    not while the server holds it.
+    """
+    iterator = iter(streaming_content)
+    while True:
+        with replica_reads(alias):
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+        yield chunk
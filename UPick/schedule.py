@@ -0,0 +1,172 @@
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Farm, OpenInterval, WorkingHour
+
+SECONDS_PER_DAY = 24 * 60 * 60
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+
+DAY_INDEX = {day: index for index, (day, _) in enumerate(WorkingHour.DAYS_OF_WEEK)}
+
+
+def _seconds(value):
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def second_of_week(local_now):
+    # local_now is an aware datetime already converted to the farm's time zone
+    return local_now.weekday() * SECONDS_PER_DAY + _seconds(local_now.time())
+
+
+#  ------------ building the index ------------------- #
+
+def working_hour_intervals(day, opening_time, closing_time):
+    """
+    Converts one WorkingHour row into inclusive (opens_at, closes_at) second-of-week
+    intervals. Closing times before the opening time run past midnight into the
+    next day, and Sunday night hours wrap around to Monday morning.
+    """
+    if opening_time is None or closing_time is None:
+        return []
+
+    day_start = DAY_INDEX[day] * SECONDS_PER_DAY
+    opens_at = day_start + _seconds(opening_time)
+    closes_at = day_start + _seconds(closing_time)
+    if closing_time < opening_time:
+        closes_at += SECONDS_PER_DAY
+
+    if closes_at < SECONDS_PER_WEEK:
+        return [(opens_at, closes_at)]
+    return [(opens_at, SECONDS_PER_WEEK - 1), (0, closes_at - SECONDS_PER_WEEK)]
+
+
+def rebuild_open_intervals(farm_ids=None, using='default'):
+    """
+    Rebuilds the OpenInterval rows of the given farms, or of every farm when
+    farm_ids is None.
+    """
+    farms = Farm.objects.using(using)
+    hours = WorkingHour.objects.using(using)
+    intervals = OpenInterval.objects.using(using)
+    if farm_ids is not None:
+        farms = farms.filter(id__in=farm_ids)
+        hours = hours.filter(farm_id__in=farm_ids)
+        intervals = intervals.filter(farm_id__in=farm_ids)
+
+    time_zones = dict(farms.values_list('id', 'time_zone'))
+    rows = []
+    for farm_id, day, opening_time, closing_time in hours.values_list(
+            'farm_id', 'day', 'opening_time', 'closing_time').iterator(chunk_size=2000):
+        for opens_at, closes_at in working_hour_intervals(day, opening_time, closing_time):
+            rows.append(OpenInterval(
+                farm_id=farm_id,
+                time_zone=time_zones[farm_id],
+                opens_at=opens_at,
+                closes_at=closes_at,
+            ))
+
+    with transaction.atomic(using=using):
+        intervals.delete()
+        OpenInterval.objects.using(using).bulk_create(rows, batch_size=1000)
+
+
+#  ------------ querying the index ------------------- #
+
+def open_now_q(now):
+    """
+    Predicate on OpenInterval matching the intervals that contain ``now``.
+    There is one index range per supported time zone, so the lookup never
+    touches WorkingHour and needs no query of its own.
+    """
+    predicate = Q()
+    for time_zone, _ in Farm.TIME_ZONES:
+        current = second_of_week(now.astimezone(ZoneInfo(time_zone)))
+        predicate |= Q(time_zone=time_zone, opens_at__lte=current, closes_at__gte=current)
+    return predicate
+
+
+def open_farm_ids(now):
+    # Subquery of the ids of farms open at ``now``, used with id__in so each farm matches once
+    return OpenInterval.objects.filter(open_now_q(now)).values('farm_id')
+
+
+#  ------------ request clock ------------------- #
+
+class RequestClock:
+    """
+    The current time, read once per request and shared by the filters and serializers.
+    Local day and time are computed once per farm time zone. The clock also tracks
+    the earliest moment one of the answers it gave would change, see seconds_valid().
+    """
+
+    def __init__(self, now=None):
+        self.now = now if now is not None else timezone.now()
+        self.valid_until = None
+        self._local = {}
+
+    def local(self, time_zone):
+        if time_zone not in self._local:
+            local_now = self.now.astimezone(ZoneInfo(time_zone))
+            self._local[time_zone] = (local_now.strftime('%a').lower()[0:3], local_now.time())
+            # The current day changes at local midnight
+            self._changes_at(local_now.date() + timedelta(days=1), time.min, time_zone)
+        return self._local[time_zone]
+
+    def today(self, time_zone):
+        return self.local(time_zone)[0]
+
+    def days_today(self):
+        # The days it is today in one of the farm time zones
+        return {self.today(time_zone) for time_zone, _ in Farm.TIME_ZONES}
+
+    def is_open(self, working_hour, time_zone):
+        """
+        Whether the farm is open now by working_hour, by the same rule as open_now_q().
+        None when the working hour is not for today, unless it is yesterday's and runs
+        past midnight into today.
+        """
+        day, now = self.local(time_zone)
+        opening_time, closing_time = working_hour.opening_time, working_hour.closing_time
+        today = self.now.astimezone(ZoneInfo(time_zone)).date()
+        if working_hour.day != day:
+            yesterday = WorkingHour.DAYS_OF_WEEK[(DAY_INDEX[day] - 1) % 7][0]
+            wraps = opening_time is not None and closing_time is not None and closing_time < opening_time
+            if working_hour.day != yesterday or not wraps:
+                return None
+            # The hours after midnight of yesterday's row
+            if now <= closing_time:
+                closes = datetime.combine(today, closing_time) + timedelta(seconds=1)
+                self._changes_at(closes.date(), closes.time(), time_zone)
+            return now <= closing_time
+        if opening_time is None or closing_time is None:
+            return False
+
+        if now < opening_time:
+            self._changes_at(today, opening_time, time_zone)
+        if closing_time < opening_time:
+            # Open past midnight, the hours after midnight belong to tomorrow
+            return opening_time <= now
+        if now <= closing_time:
+            closes = datetime.combine(today, closing_time) + timedelta(seconds=1)
+            self._changes_at(closes.date(), closes.time(), time_zone)
+        return opening_time <= now <= closing_time
+
+    def _changes_at(self, day, local_time, time_zone):
+        moment = datetime.combine(day, local_time, tzinfo=ZoneInfo(time_zone))
+        if self.valid_until is None or moment < self.valid_until:
+            self.valid_until = moment
+
+    def seconds_valid(self):
+        # Seconds the answers given so far stay correct, None if none depend on the time
+        if self.valid_until is None:
+            return None
+        return max(0, int((self.valid_until - self.now).total_seconds()))
+
+
+def get_request_clock(request):
+    clock = getattr(request, '_upick_clock', None)
+    if clock is None:
+        clock = request._upick_clock = RequestClock()
+    return clock
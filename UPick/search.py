@@ -0,0 +1,154 @@
+import re
+import unicodedata
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, OuterRef, Q, Subquery, Value, When
+from .models import Farm, Plant, SearchToken
+
+# Keyword search for ?q=. Farm and plant text is split into tokens stored in the
+# SearchToken table, kept current by the model signals. A query matches the farms or
+# plants having a token starting with each of its terms, ranked by the summed weight
+# of the fields the terms were found in, exact tokens counting double.
+
+# Longest token stored, longer words are cut (and still match by prefix)
+MAX_TOKEN_LENGTH = 32
+
+# Terms of a query beyond this many are ignored
+MAX_QUERY_TERMS = 8
+
+# Matching tokens counted per term to find the rarest term of a query
+RARITY_PROBE = 1000
+
+STOP_WORDS = {'a', 'an', 'and', 'at', 'by', 'for', 'in', 'of', 'on', 'or', 'the', 'to', 'with'}
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+# Weight of a token by the field it comes from
+FARM_FIELDS = {'title': 8, 'address__city': 4, 'address__state': 2, 'description': 1}
+PLANT_FIELDS = {'title': 8, 'scientific_name': 4, 'category__name': 2, 'country_of_origin': 1}
+
+
+#  ------------ tokens ------------------- #
+
+def tokenize(text):
+    # Lowercase ASCII words, accents folded, stop words and single characters dropped
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower()
+    return [word[:MAX_TOKEN_LENGTH] for word in _WORD.findall(text) if len(word) > 1 and word not in STOP_WORDS]
+
+
+def document_tokens(weighted_texts):
+    # {token: weight} of a document given as (text, weight) pairs, repeated words add up
+    tokens = {}
+    for text, weight in weighted_texts:
+        for token in tokenize(text):
+            tokens[token] = min(tokens.get(token, 0) + weight, 32767)
+    return tokens
+
+
+def search_terms(query):
+    terms = []
+    for term in tokenize(query):
+        if term not in terms:
+            terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+
+#  ------------ building the index ------------------- #
+
+def _rebuild(kind, queryset, fields, object_ids, using):
+    tokens = SearchToken.objects.using(using).filter(kind=kind)
+    if object_ids is not None:
+        queryset = queryset.filter(id__in=object_ids)
+        tokens = tokens.filter(object_id__in=object_ids)
+
+    names = list(fields)
+    rows = []
+    for object_id, *texts in queryset.values_list('id', *names).iterator(chunk_size=2000):
+        weighted_texts = zip(texts, (fields[name] for name in names))
+        for token, weight in document_tokens(weighted_texts).items():
+            rows.append(SearchToken(kind=kind, object_id=object_id, token=token, weight=weight))
+
+    with transaction.atomic(using=using):
+        tokens.delete()
+        SearchToken.objects.using(using).bulk_create(rows, batch_size=1000)
+
+
+def index_farms(farm_ids=None, using='default'):
+    # Rebuilds the search tokens of the given farms, or of every farm when farm_ids is None
+    _rebuild('farm', Farm.objects.using(using), FARM_FIELDS, farm_ids, using)
+
+
+def index_plants(plant_ids=None, using='default'):
+    _rebuild('plant', Plant.objects.using(using), PLANT_FIELDS, plant_ids, using)
+
+
+def rebuild_search_index(using='default'):
+    index_farms(using=using)
+    index_plants(using=using)
+
+
+#  ------------ querying the index ------------------- #
+
+def _prefix_q(term):
+    # Tokens starting with term as a closed range, which both SQLite and MySQL serve from the index
+    return Q(token__gte=term, token__lte=term.ljust(MAX_TOKEN_LENGTH, 'z'))
+
+
+def search_plan(kind, query):
+    """
+    Returns the terms of query rarest first, counting at most RARITY_PROBE matching
+    tokens per term, or an empty list when query has no searchable term.
+    """
+    terms = search_terms(query)
+    if len(terms) > 1:
+        tokens = SearchToken.objects.filter(kind=kind)
+        rarity = {term: tokens.filter(_prefix_q(term))[:RARITY_PROBE].count() for term in terms}
+        terms.sort(key=rarity.get)
+    return terms
+
+
+async def asearch_plan(kind, query):
+    terms = search_terms(query)
+    if len(terms) > 1:
+        tokens = SearchToken.objects.filter(kind=kind)
+        rarity = {term: await tokens.filter(_prefix_q(term))[:RARITY_PROBE].acount() for term in terms}
+        terms.sort(key=rarity.get)
+    return terms
+
+
+def search_matches(kind, terms):
+    # {'object_id', 'relevance'} of the objects of kind matching every term, see search_plan()
+    tokens = SearchToken.objects.filter(kind=kind)
+    if len(terms) > 1:
+        # Every term has to match, so the objects of the rarest term are the only candidates
+        tokens = tokens.filter(object_id__in=tokens.filter(_prefix_q(terms[0])).values('object_id'))
+
+    any_term = Q()
+    scores = {}
+    for index, term in enumerate(terms):
+        prefix = _prefix_q(term)
+        any_term |= prefix
+        scores[f'term_{index}'] = Max(Case(
+            When(token=term, then=F('weight') * 2),
+            When(prefix, then=F('weight')),
+            default=Value(0),
+            output_field=IntegerField(),
+        ))
+
+    relevance = sum((F(name) for name in scores), Value(0))
+    return tokens.filter(any_term).order_by().values('object_id').annotate(
+        **scores).filter(**{f'{name}__gt': 0 for name in scores}).annotate(relevance=relevance)
+
+
+def search(queryset, kind, terms, field='id'):
+    """
+    Keeps the rows of queryset whose field (a farm or plant id) matches all terms,
+    best matches first and then by id. Returns queryset unchanged without terms.
+    """
+    if not terms:
+        return queryset
+    matches = search_matches(kind, terms)
+    relevance = matches.filter(object_id=OuterRef(field)).values('relevance')[:1]
+    return queryset.filter(**{f'{field}__in': matches.values('object_id')}).annotate(
+        relevance=Subquery(relevance)).order_by('-relevance', 'id')
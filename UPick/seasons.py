@@ -0,0 +1,60 @@
+from datetime import date
+from django.db import transaction
+from .models import FarmPlants, SeasonInterval
+
+# Day numbers come from a leap year so every calendar day, Feb 29 included, has one
+LAST_DAY = 366
+
+
+def season_day(value):
+    return date(2000, value.month, value.day).timetuple().tm_yday
+
+
+#  ------------ building the index ------------------- #
+
+def season_intervals(season_start, season_end):
+    """
+    Converts a FarmPlants season into inclusive (start_day, end_day) intervals.
+    The years of the dates are ignored: seasons running over the new year are
+    split in two, an end day before the start day in the same year included,
+    and seasons of a year or longer cover every day.
+    """
+    if season_start is None or season_end is None:
+        return []
+    if (season_end - season_start).days >= 365:
+        return [(1, LAST_DAY)]
+
+    start_day, end_day = season_day(season_start), season_day(season_end)
+    if start_day <= end_day:
+        return [(start_day, end_day)]
+    return [(start_day, LAST_DAY), (1, end_day)]
+
+
+def rebuild_season_intervals(farm_plant_ids=None, using='default'):
+    """
+    Rebuilds the SeasonInterval rows of the given farm plants, or of every farm
+    plant when farm_plant_ids is None.
+    """
+    farm_plants = FarmPlants.objects.using(using)
+    intervals = SeasonInterval.objects.using(using)
+    if farm_plant_ids is not None:
+        farm_plants = farm_plants.filter(id__in=farm_plant_ids)
+        intervals = intervals.filter(farm_plant_id__in=farm_plant_ids)
+
+    rows = []
+    for farm_plant_id, season_start, season_end in farm_plants.values_list(
+            'id', 'season_start', 'season_end').iterator(chunk_size=2000):
+        for start_day, end_day in season_intervals(season_start, season_end):
+            rows.append(SeasonInterval(farm_plant_id=farm_plant_id, start_day=start_day, end_day=end_day))
+
+    with transaction.atomic(using=using):
+        intervals.delete()
+        SeasonInterval.objects.using(using).bulk_create(rows, batch_size=1000)
+
+
+#  ------------ querying the index ------------------- #
+
+def in_season_ids(value):
+    # Subquery of the ids of the farm plants in season on the date ``value``
+    day = season_day(value)
+    return SeasonInterval.objects.filter(start_day__lte=day, end_day__gte=day).values('farm_plant_id')
@@ -0,0 +1,254 @@
+import json
+import random
+import re
+import time
+from datetime import date, time as dtime, timedelta, timezone as dt_timezone
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import connections, models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .geo import encode_geohash
+from .models import Address, Farm, FarmPlants, Plant, PlantCategory, WorkingHour
+
+# Loading catalogue data in bulk. Records from the MySQL dumps in Seed/, from JSONL
+# files or from the synthetic generator are (table, columns, values) tuples, which
+# SeedLoader turns into model instances and inserts with bulk_create.
+
+
+#  ------------ reading dumps ------------------- #
+
+_INSERT_RE = re.compile(r'insert\s+into\s+`?(\w+)`?\s*\((.*?)\)\s*values\s*\((.*)\)\s*;?\s*$', re.IGNORECASE)
+_TOKEN_RE = re.compile(r"\s*(?:'((?:[^'\\]|''|\\.)*)'|([^,\s]+))\s*(?:,|$)")
+# mysqldump backslash escapes, any other escaped character stands for itself
+_ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+
+
+def _unescape(match):
+    escaped = match.group(1)
+    return "'" if escaped is None else _ESCAPES.get(escaped, escaped)
+
+
+def parse_sql_values(text):
+    values = []
+    position = 0
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if match is None:
+            raise ValueError(f'Cannot parse values: {text[position:position + 40]!r}')
+        quoted, bare = match.groups()
+        if quoted is not None:
+            values.append(re.sub(r"''|\\(.)", _unescape, quoted, flags=re.DOTALL))
+        elif bare.lower() == 'null':
+            values.append(None)
+        elif bare.lower() in ('true', 'false'):
+            values.append(bare.lower() == 'true')
+        else:
+            values.append(float(bare) if '.' in bare or 'e' in bare.lower() else int(bare))
+        position = match.end()
+    return values
+
+
+def read_sql_dump(lines):
+    # One insert statement per line, as in Seed/Seed.sql; other statements and comments are skipped
+    for line in lines:
+        match = _INSERT_RE.match(line.strip())
+        if match is None:
+            continue
+        table, columns, values = match.groups()
+        columns = [column.strip().strip('`') for column in columns.split(',')]
+        yield table, columns, parse_sql_values(values)
+
+
+def read_jsonl(lines):
+    # One {"table": ..., "row": {column: value}} object per line
+    for line in lines:
+        if line.strip():
+            record = json.loads(line)
+            yield record['table'], list(record['row']), list(record['row'].values())
+
+
+def read_seed_file(path):
+    with open(path, encoding='utf-8') as lines:
+        reader = read_jsonl if str(path).endswith('.jsonl') else read_sql_dump
+        yield from reader(lines)
+
+
+#  ------------ loading ------------------- #
+
+def _to_python(field, value):
+    if value is None:
+        return None
+    if isinstance(field, models.DateTimeField):
+        value = field.to_python(value)
+        return timezone.make_aware(value, dt_timezone.utc) if timezone.is_naive(value) else value
+    if isinstance(field, models.DateField) and isinstance(value, str) and len(value) > 10:
+        # The dumps store dates as datetimes
+        return parse_datetime(value).date()
+    return field.to_python(value)
+
+
+class SeedLoader:
+    """
+    Inserts records with bulk_create, batch_size rows per statement and one transaction
+    per batch. Records must come grouped by table in dependency order, as they do in
+    the dumps. Call finish() afterwards to rebuild the derived indexes.
+    """
+
+    def __init__(self, batch_size=1000, using='default'):
+        self.batch_size = batch_size
+        self.using = using
+        self.models = {model._meta.db_table: model for model in apps.get_app_config('UPick').get_models()}
+        self.fields = {}
+        self.pending = []
+        self.pending_model = None
+        self.rows = {}
+        self.seconds = {}
+
+    def load(self, records):
+        for table, columns, values in records:
+            model = self.models[table]
+            if model is not self.pending_model or len(self.pending) >= self.batch_size:
+                self.flush()
+                self.pending_model = model
+            self.pending.append(self.build(model, columns, values))
+        self.flush()
+
+    def build(self, model, columns, values):
+        if model not in self.fields:
+            self.fields[model] = {field.column: field for field in model._meta.concrete_fields}
+        fields = self.fields[model]
+        instance = model(**{
+            fields[column].attname: _to_python(fields[column], value)
+            for column, value in zip(columns, values)
+        })
+        if model is Address:
+            instance.geohash = encode_geohash(instance.lat, instance.long)
+        return instance
+
+    def flush(self):
+        if not self.pending:
+            return
+        model = self.pending_model
+        manager = model.objects.using(self.using)
+        # auto_now overwrites last_updated on insert, the timestamps of the dump are written back
+        dumped = [(instance, instance.last_updated) for instance in self.pending
+                  if getattr(instance, 'last_updated', None) is not None and instance.pk is not None]
+        started = time.perf_counter()
+        with transaction.atomic(using=self.using):
+            manager.bulk_create(self.pending, batch_size=self.batch_size)
+            if dumped:
+                for instance, last_updated in dumped:
+                    instance.last_updated = last_updated
+                manager.bulk_update([instance for instance, _ in dumped], ['last_updated'], batch_size=self.batch_size)
+        name = model._meta.db_table
+        self.rows[name] = self.rows.get(name, 0) + len(self.pending)
+        self.seconds[name] = self.seconds.get(name, 0) + time.perf_counter() - started
+        self.pending = []
+
+    def finish(self):
+        # bulk_create skips save() and the model signals, rebuild what they would maintain
+        from .caching import get_cache, get_response_cache
+        from .schedule import rebuild_open_intervals
+        from .search import rebuild_search_index
+        from .seasons import rebuild_season_intervals
+        from .summary import rebuild_farm_summaries
+
+        for table, rebuild in (('UPick_openinterval', rebuild_open_intervals),
+                               ('UPick_seasoninterval', rebuild_season_intervals),
+                               ('UPick_searchtoken', rebuild_search_index),
+                               ('UPick_farmsummary', rebuild_farm_summaries)):
+            started = time.perf_counter()
+            rebuild(using=self.using)
+            self.rows[table] = self.models[table].objects.using(self.using).count()
+            self.seconds[table] = time.perf_counter() - started
+
+        get_cache().clear()
+        response_cache = get_response_cache()
+        if response_cache is not None:
+            response_cache.clear()
+
+
+def flush_catalog(using='default'):
+    # Empties every UPick table, like manage.py flush does for the whole database
+    connection = connections[using]
+    tables = [model._meta.db_table for model in apps.get_app_config('UPick').get_models()]
+    sql_list = connection.ops.sql_flush(no_style(), tables, reset_sequences=True, allow_cascade=True)
+    connection.ops.execute_sql_flush(sql_list)
+
+
+#  ------------ synthetic data ------------------- #
+
+# Rough longitude bands of the US time zones, west to east
+_TIME_ZONE_BANDS = [
+    (-150, 'America/Anchorage'),
+    (-115, 'America/Los_Angeles'),
+    (-102, 'America/Denver'),
+    (-87, 'America/Chicago'),
+    (180, 'America/New_York'),
+]
+
+
+def _next_id(model, using):
+    return (model.objects.using(using).aggregate(models.Max('id'))['id__max'] or 0) + 1
+
+
+def synthetic_records(farm_count, plants_per_farm=5, seed=0, using='default'):
+    """
+    Generates farm_count farms in the continental US with an address, weekly hours
+    and plants_per_farm farm plants each. Plants are picked from the existing
+    catalogue, a small one is generated first if it is empty. Ids are assigned here
+    because bulk_create does not return them on MySQL.
+    """
+    rng = random.Random(seed)
+
+    plant_ids = list(Plant.objects.using(using).values_list('id', flat=True))
+    if not plant_ids:
+        category_id = _next_id(PlantCategory, using)
+        plant_id = _next_id(Plant, using)
+        for index in range(10):
+            yield 'UPick_plantcategory', ['id', 'name'], [category_id + index, f'Category {index}']
+        for index in range(100):
+            yield ('UPick_plant', ['id', 'title', 'scientific_name', 'country_of_origin', 'category_id'],
+                   [plant_id + index, f'Plant {index}', f'Plantae synthetica {index}', 'United States',
+                    category_id + index % 10])
+        plant_ids = list(range(plant_id, plant_id + 100))
+
+    farm_id = _next_id(Farm, using)
+    locations = [(rng.uniform(25.0, 49.0), rng.uniform(-124.0, -67.0)) for _ in range(farm_count)]
+
+    for index in range(farm_count):
+        long = locations[index][1]
+        time_zone = next(zone for bound, zone in _TIME_ZONE_BANDS if long < bound)
+        fee = None if rng.random() < 0.6 else round(rng.uniform(0, 25), 2)
+        yield ('UPick_farm',
+               ['id', 'title', 'image_url', 'description', 'entrance_fee', 'phone', 'email', 'website', 'time_zone'],
+               [farm_id + index, f'Synthetic Farm {farm_id + index}', 'https://images.pexels.com/photos/2437291/pexels-photo-2437291.jpeg',
+                'Pick your own fruit and vegetables', fee, '(555) 0100000',
+                f'farm{farm_id + index}@synthetic.upick.example', None, time_zone])
+
+    address_id = _next_id(Address, using)
+    for index, (lat, long) in enumerate(locations):
+        yield ('UPick_address', ['id', 'street', 'city', 'state', 'country', 'zip_code', 'lat', 'long', 'farm_id'],
+               [address_id + index, f'{index} Orchard Road', 'Springfield', 'CA', 'United States', '95076',
+                lat, long, farm_id + index])
+
+    hour_id = _next_id(WorkingHour, using)
+    for index in range(farm_count):
+        for day, _ in WorkingHour.DAYS_OF_WEEK:
+            opening = dtime(rng.randint(6, 9), rng.choice((0, 30)))
+            closing = dtime(rng.randint(14, 19), rng.choice((0, 30)))
+            yield ('UPick_workinghour', ['id', 'day', 'opening_time', 'closing_time', 'farm_id'],
+                   [hour_id, day, opening, closing, farm_id + index])
+            hour_id += 1
+
+    farm_plant_id = _next_id(FarmPlants, using)
+    for index in range(farm_count):
+        for plant_id in rng.sample(plant_ids, min(plants_per_farm, len(plant_ids))):
+            season_start = date(2023, 1, 1) + timedelta(days=rng.randint(0, 364))
+            season_end = season_start + timedelta(days=rng.randint(30, 200))
+            yield ('UPick_farmplants',
+                   ['id', 'farm_id', 'plant_id', 'image_url', 'season_start', 'season_end', 'organic', 'description'],
+                   [farm_plant_id, farm_id + index, plant_id, None, season_start, season_end,
+                    rng.random() < 0.3, None])
+            farm_plant_id += 1
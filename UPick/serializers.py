@@ -1,11 +1,29 @@
-from datetime import timedelta
-from django.utils import timezone
+from django.db import models
 from rest_framework import serializers
 from .models import Farm, WorkingHour, Plant, PlantCategory, FarmPlants, Address
+from .fieldsets import select_fields
+from .schedule import RequestClock
+from .summary import weekly_hours
+from .taxonomy import build_taxonomy, get_taxonomy
 
 # Helper Serializers
 
 # ------------------- Woking Hours Serializers ----------------------------#
+
+def get_clock(context):
+    # The viewset puts the request clock in the context, fall back to one clock per serialization
+    if 'clock' not in context:
+        context['clock'] = RequestClock()
+    return context['clock']
+
+
+def get_context_taxonomy(context):
+    # Async views load the taxonomy before serializing and pass it in the context
+    if 'taxonomy' not in context:
+        context['taxonomy'] = get_taxonomy()
+    return context['taxonomy']
+
+
 class WorkingHoursSerializer(serializers.ModelSerializer):
     is_open = serializers.SerializerMethodField()
 
@@ -14,14 +32,21 @@ class WorkingHoursSerializer(serializers.ModelSerializer):
         fields = ['day', 'opening_time', 'closing_time', 'is_open']
     
     def get_is_open(self, obj):
-        current_day = timezone.now().strftime('%A').lower()[0:3]  # Get the current day of the week (e.g., "monday")
-        if obj.day == current_day:
-            now = timezone.now().time()
-            print(obj.opening_time, now, obj.closing_time)
-            if obj.opening_time <= now <= obj.closing_time:
-                return True
-            return False
-        return None
+        return get_clock(self.context).is_open(obj, obj.farm.time_zone)
+
+
+class TodayWorkingHoursListSerializer(serializers.ListSerializer):
+    # Drops the rows that are not for today in the farm's time zone before serializing them
+
+    def to_representation(self, data):
+        clock = get_clock(self.context)
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        return [
+            self.child.to_representation(item)
+            for item in iterable
+            if item.day == clock.today(item.farm.time_zone)
+        ]
+
 
 class ListWorkingHoursSerializer(serializers.ModelSerializer):
     is_open = serializers.SerializerMethodField()
@@ -29,27 +54,18 @@ class ListWorkingHoursSerializer(serializers.ModelSerializer):
     class Meta:
         model = WorkingHour
         fields = ['day', 'opening_time', 'closing_time', 'is_open']
+        list_serializer_class = TodayWorkingHoursListSerializer
 
     def get_is_open(self, obj):
-        current_day = timezone.now().strftime('%A').lower()[0:3]
-        if obj.day == current_day:
-            now = timezone.now().time()
-            if obj.opening_time <= now <= obj.closing_time:
-                return True
-            return False
-        return None
+        return get_clock(self.context).is_open(obj, obj.farm.time_zone)
 
     def to_representation(self, instance):
-        current_day = timezone.now().strftime('%a').lower()[0:3]
-        if instance.day == current_day:
-            representation = {
-                'day': instance.day,
-                'opening_time': instance.opening_time,
-                'closing_time': instance.closing_time,
-                'is_open': self.get_is_open(instance),
-            }
-            return representation
-        return None
+        return {
+            'day': instance.day,
+            'opening_time': instance.opening_time,
+            'closing_time': instance.closing_time,
+            'is_open': self.get_is_open(instance),
+        }
 
 # ------------------- Farm Address Serializer ----------------------------#
 
@@ -137,9 +153,21 @@ class FarmDetailSerializer(serializers.ModelSerializer):
                   'email', 
                   'website', 
                   'farm_plants']
-    
-    
-        
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Drop the fields left out with ?fields=, their relations are not prefetched
+        fields = self.context.get('fields')
+        if fields is not None:
+            for name in list(self.fields):
+                if name not in fields:
+                    self.fields.pop(name)
+
+    def to_representation(self, instance):
+        return select_fields(super().to_representation(instance), self.context.get('fields'))
+
+
+
 class FarmListSerializer(serializers.ModelSerializer):
     working_hours= ListWorkingHoursSerializer(many=True)
     address = FarmAddressSerializer()
@@ -162,12 +190,11 @@ class FarmListSerializer(serializers.ModelSerializer):
         representation = super().to_representation(instance)
         working_hours = representation['working_hours']
         address = representation['address']
-        non_null_working_hours = [wh for wh in working_hours if wh is not None]
         representation = {
             'id': instance.id,
             'image_url': instance.image_url,
             'title': instance.title,
-            'working_hours': non_null_working_hours,
+            'working_hours': working_hours,
             'description': instance.description,
             'address': address,
             'entrance_fee': instance.entrance_fee,
@@ -176,7 +203,12 @@ class FarmListSerializer(serializers.ModelSerializer):
             'website': instance.website,
             'farm_plants': []
         }
-        return representation
+        if 'farm_plants' in self.context.get('expand', ()):
+            representation['farm_plants'] = fast_farm_plants(instance, get_context_taxonomy(self.context))
+        distance_miles = getattr(instance, 'distance_miles', None)
+        if distance_miles is not None:
+            representation['distance_miles'] = round(distance_miles, 2)
+        return select_fields(representation, self.context.get('fields'))
 
 
 # ------------------- Plant Serializers ----------------------------#
@@ -205,4 +237,195 @@ class PlantFarmsSerializer(serializers.ModelSerializer):
             'country_of_origin': plant['country_of_origin'],
             'plant_farm': farm
         }
+        distance_miles = getattr(instance, 'distance_miles', None)
+        if distance_miles is not None:
+            representation['distance_miles'] = round(distance_miles, 2)
+        return representation
+
+
+# Fast List Serializers
+
+# Read-only serializers for the list endpoints that build the same output as
+# FarmListSerializer and PlantFarmsSerializer straight from model attributes,
+# skipping the DRF field machinery. Enabled with settings.UPICK_FAST_SERIALIZERS.
+
+def fast_working_hours(farm, clock):
+    time_zone = farm.time_zone
+    today = clock.today(time_zone)
+    return [
+        {
+            'day': working_hour.day,
+            'opening_time': working_hour.opening_time,
+            'closing_time': working_hour.closing_time,
+            'is_open': clock.is_open(working_hour, time_zone),
+        }
+        for working_hour in farm.working_hours.all()
+        if working_hour.day == today
+    ]
+
+
+def fast_address(farm, fields=None):
+    try:
+        address = farm.address
+    except Address.DoesNotExist:
+        return None
+    return address_representation(address, fields)
+
+
+def address_representation(address, fields=None):
+    if fields is not None:
+        # Only the selected columns of the address were fetched
+        return {
+            name: select_fields({'lat': address.lat, 'long': address.long}, subfields)
+            if name == 'geo_location' else getattr(address, name)
+            for name, subfields in fields.items()
+        }
+    return {
+        'street': address.street,
+        'city': address.city,
+        'state': address.state,
+        'country': address.country,
+        'zip_code': address.zip_code,
+        'geo_location': {'lat': address.lat, 'long': address.long},
+    }
+
+
+def fast_farm_plants(farm, taxonomy):
+    farm_plants = []
+    for farm_plant in farm.plants.all():
+        plant = taxonomy.plants[farm_plant.plant_id]
+        farm_plants.append({
+            'id': farm_plant.id,
+            'title': plant['title'],
+            'category': plant['category'],
+            'image_url': farm_plant.image_url,
+            'description': farm_plant.description,
+            'season_start': farm_plant.season_start,
+            'season_end' : farm_plant.season_end,
+            'organic' : farm_plant.organic,
+            'scientific_name': plant['scientific_name'],
+            'country_of_origin': plant['country_of_origin'],
+            'plant_farm': {}
+        })
+    return farm_plants
+
+
+def fast_farm(farm, clock, fields=None, taxonomy=None, working_hours=fast_working_hours, address=fast_address):
+    """
+    fields is a ?fields= selection (see UPick.fieldsets), only the selected keys are
+    built. With a taxonomy the farm plants are embedded, otherwise farm_plants is empty.
+    working_hours and address build those keys, fast_summary() passes its own.
+    """
+    if fields is not None:
+        return fast_farm_fields(farm, clock, fields, taxonomy, working_hours, address)
+    representation = {
+        'id': farm.id,
+        'image_url': farm.image_url,
+        'title': farm.title,
+        'working_hours': working_hours(farm, clock),
+        'description': farm.description,
+        'address': address(farm),
+        'entrance_fee': farm.entrance_fee,
+        'phone': farm.phone,
+        'email': farm.email,
+        'website': farm.website,
+        'farm_plants': [] if taxonomy is None else fast_farm_plants(farm, taxonomy)
+    }
+    distance_miles = getattr(farm, 'distance_miles', None)
+    if distance_miles is not None:
+        representation['distance_miles'] = round(distance_miles, 2)
+    return representation
+
+
+def fast_farm_fields(farm, clock, fields, taxonomy, working_hours, address):
+    representation = {}
+    for name, subfields in fields.items():
+        if name == 'distance_miles':
+            distance_miles = getattr(farm, 'distance_miles', None)
+            if distance_miles is not None:
+                representation[name] = round(distance_miles, 2)
+        elif name == 'address':
+            representation[name] = address(farm, subfields)
+        elif name == 'working_hours':
+            representation[name] = select_fields(working_hours(farm, clock), subfields)
+        elif name == 'farm_plants':
+            representation[name] = [] if taxonomy is None else select_fields(fast_farm_plants(farm, taxonomy), subfields)
+        else:
+            representation[name] = getattr(farm, name)
+    return representation
+
+
+# Farm Summary Serializers
+
+# The same farm output built from a FarmSummary row (see UPick.summary), which
+# carries the address columns and the encoded week itself
+
+def summary_working_hours(summary, clock):
+    time_zone = summary.time_zone
+    today = clock.today(time_zone)
+    return [
+        {
+            'day': working_hour.day,
+            'opening_time': working_hour.opening_time,
+            'closing_time': working_hour.closing_time,
+            'is_open': clock.is_open(working_hour, time_zone),
+        }
+        for working_hour in weekly_hours(summary.weekly_hours)
+        if working_hour.day == today
+    ]
+
+
+def summary_address(summary, fields=None):
+    # Address columns are null for farms without an address, lat is always fetched
+    if summary.lat is None:
+        return None
+    return address_representation(summary, fields)
+
+
+def fast_summary(summary, clock, fields=None):
+    return fast_farm(summary, clock, fields, working_hours=summary_working_hours, address=summary_address)
+
+
+class FastFarmListSerializer(serializers.BaseSerializer):
+
+    def to_representation(self, instance):
+        taxonomy = None
+        if 'farm_plants' in self.context.get('expand', ()):
+            taxonomy = get_context_taxonomy(self.context)
+        return fast_farm(instance, get_clock(self.context), self.context.get('fields'), taxonomy)
+
+
+class FastFarmSummarySerializer(serializers.BaseSerializer):
+
+    def to_representation(self, instance):
+        return fast_summary(instance, get_clock(self.context), self.context.get('fields'))
+
+
+class FastPlantFarmsSerializer(serializers.BaseSerializer):
+
+    def to_representation(self, instance):
+        # Plant and category come from the in-process taxonomy instead of a join
+        plant = get_context_taxonomy(self.context).plants.get(instance.plant_id)
+        if plant is None:
+            # Added after the taxonomy was loaded
+            plant, category = instance.plant, instance.plant.category
+            plant = build_taxonomy(None, [(category.id, category.name)], [
+                (plant.id, plant.title, plant.scientific_name, plant.country_of_origin, category.id)
+            ]).plants[plant.id]
+        representation = {
+            'id': instance.id,
+            'title': plant['title'],
+            'category': plant['category'],
+            'image_url': instance.image_url,
+            'description': instance.description,
+            'season_start': instance.season_start,
+            'season_end' : instance.season_end,
+            'organic' : instance.organic,
+            'scientific_name': plant['scientific_name'],
+            'country_of_origin': plant['country_of_origin'],
+            'plant_farm': fast_farm(instance.farm, get_clock(self.context))
+        }
+        distance_miles = getattr(instance, 'distance_miles', None)
+        if distance_miles is not None:
+            representation['distance_miles'] = round(distance_miles, 2)
         return representation
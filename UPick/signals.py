@@ -0,0 +1,138 @@
+from functools import partial
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from .caching import bump_catalog_version, bump_version
+from .models import Address, Farm, FarmPlants, FarmSummary, OpenInterval, Plant, PlantCategory, SearchToken, WorkingHour
+from .schedule import rebuild_open_intervals
+from .search import index_farms, index_plants
+from .seasons import rebuild_season_intervals
+from .summary import rebuild_farm_summaries
+from .taxonomy import clear_taxonomy
+
+#  ------------ keeping the open-now schedule index current ------------------- #
+
+@receiver([post_save, post_delete], sender=WorkingHour)
+def rebuild_farm_schedule(sender, instance, **kwargs):
+    rebuild_open_intervals([instance.farm_id])
+
+
+@receiver(post_save, sender=Farm)
+def update_schedule_time_zone(sender, instance, created, **kwargs):
+    if not created:
+        OpenInterval.objects.filter(farm_id=instance.id).exclude(
+            time_zone=instance.time_zone).update(time_zone=instance.time_zone)
+
+
+#  ------------ keeping the season index current ------------------- #
+
+@receiver(post_save, sender=FarmPlants)
+def rebuild_farm_plant_seasons(sender, instance, **kwargs):
+    rebuild_season_intervals([instance.id])
+
+
+#  ------------ keeping the search index current ------------------- #
+
+@receiver(post_save, sender=Farm)
+def index_farm(sender, instance, **kwargs):
+    index_farms([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Address)
+def index_farm_address(sender, instance, **kwargs):
+    index_farms([instance.farm_id])
+
+
+@receiver(post_save, sender=Plant)
+def index_plant(sender, instance, **kwargs):
+    index_plants([instance.id])
+
+
+@receiver(post_save, sender=PlantCategory)
+def index_category_plants(sender, instance, created, **kwargs):
+    if not created:
+        index_plants(list(instance.plant.values_list('id', flat=True)))
+
+
+@receiver(post_delete, sender=Farm)
+@receiver(post_delete, sender=Plant)
+def remove_search_tokens(sender, instance, **kwargs):
+    SearchToken.objects.filter(kind=sender._meta.model_name, object_id=instance.id).delete()
+
+
+#  ------------ keeping the farm summaries current ------------------- #
+
+@receiver(post_save, sender=Farm)
+def summarize_farm(sender, instance, **kwargs):
+    rebuild_farm_summaries([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Address)
+@receiver([post_save, post_delete], sender=WorkingHour)
+@receiver([post_save, post_delete], sender=FarmPlants)
+def summarize_farm_relation(sender, instance, **kwargs):
+    rebuild_farm_summaries([instance.farm_id])
+
+
+@receiver(post_save, sender=Plant)
+def summarize_plant_farms(sender, instance, created, **kwargs):
+    # The category of the plant may have changed
+    if not created:
+        rebuild_farm_summaries(list(instance.farms.order_by().values_list('farm_id', flat=True).distinct()))
+
+
+@receiver(post_delete, sender=Farm)
+def remove_farm_summary(sender, instance, **kwargs):
+    FarmSummary.objects.filter(id=instance.id).delete()
+
+
+#  ------------ invalidating cached counts ------------------- #
+
+# Versions are bumped once the write commits. A bump inside the transaction would let
+# other requests cache the old rows again under the new version before they can see the change.
+
+@receiver([post_save, post_delete], sender=Farm)
+@receiver([post_save, post_delete], sender=Address)
+@receiver([post_save, post_delete], sender=WorkingHour)
+@receiver([post_save, post_delete], sender=FarmPlants)
+@receiver([post_save, post_delete], sender=Plant)
+@receiver([post_save, post_delete], sender=PlantCategory)
+def invalidate_catalog(sender, using, **kwargs):
+    transaction.on_commit(bump_catalog_version, using=using)
+
+
+#  ------------ invalidating cached responses ------------------- #
+
+@receiver([post_save, post_delete], sender=Farm)
+def invalidate_farm(sender, instance, using, **kwargs):
+    transaction.on_commit(partial(bump_version, f'farm:{instance.id}'), using=using)
+
+
+@receiver([post_save, post_delete], sender=Address)
+@receiver([post_save, post_delete], sender=WorkingHour)
+@receiver([post_save, post_delete], sender=FarmPlants)
+def invalidate_farm_details(sender, instance, using, **kwargs):
+    transaction.on_commit(partial(bump_version, f'farm:{instance.farm_id}'), using=using)
+
+
+def refresh_taxonomy():
+    # Other processes reload their taxonomy when they see the new version
+    bump_version('taxonomy')
+    clear_taxonomy()
+
+
+@receiver([post_save, post_delete], sender=Plant)
+@receiver([post_save, post_delete], sender=PlantCategory)
+def invalidate_taxonomy(sender, using, **kwargs):
+    transaction.on_commit(refresh_taxonomy, using=using)
+
+
+#  ------------ farm last_updated ------------------- #
+
+@receiver([post_save, post_delete], sender=Address)
+@receiver([post_save, post_delete], sender=WorkingHour)
+@receiver([post_save, post_delete], sender=FarmPlants)
+def touch_farm(sender, instance, **kwargs):
+    # The catalog snapshot syncs from the farms whose last_updated advanced, which these models don't have
+    Farm.objects.filter(pk=instance.farm_id).update(last_updated=timezone.now())
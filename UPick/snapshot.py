@@ -0,0 +1,330 @@
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from zoneinfo import ZoneInfo
+from django.conf import settings
+from django.db.models import Count, Max, Sum
+from .caching import catalog_version
+from .geo import bounding_box, haversine_miles
+from .models import Farm, OpenInterval
+from .schedule import second_of_week
+
+# In-process snapshot of the columns the farm list filters read: location, entrance
+# fee, time zone and weekly open intervals, held in array module columns in id order.
+# With UPICK_SNAPSHOT set the farm list answers FarmFilter queries (radius, is_open,
+# entrance_fee, distance ordering) from the snapshot and only fetches the requested
+# page from the database. The snapshot is checked against the catalog cache version
+# on every request and brought up to date from the farms whose last_updated advanced,
+# into a new snapshot, so a request keeps reading the one it started with.
+
+NO_VALUE = float('nan')
+
+# Size in degrees of the grid cells used to find the farms around a search point
+GRID_DEGREES = 1.0
+
+TIME_ZONES = [time_zone for time_zone, _ in Farm.TIME_ZONES]
+TIME_ZONE_INDEX = {time_zone: index for index, time_zone in enumerate(TIME_ZONES)}
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def _cell(lat, long):
+    return math.floor(lat / GRID_DEGREES), math.floor(long / GRID_DEGREES)
+
+
+class CatalogSnapshot:
+
+    def __init__(self):
+        self.version = None
+        self.last_updated = None
+        # One entry per farm in id order
+        self.ids = array('q')
+        self.lats = array('d')
+        self.longs = array('d')
+        self.fees = array('d')
+        self.time_zones = array('B')
+        # Open intervals of each farm in second-of-week, opening times in order and the
+        # latest closing time among the intervals opened so far
+        self.opens = []
+        self.closes = []
+        self.positions = {}
+        self.id_sum = 0
+        # The farm count, id sum and latest last_updated the snapshot was taken at
+        self.state = None
+        self.checked_at = None
+
+    #  ------------ loading ------------------- #
+
+    def farm_rows(self, farms):
+        return farms.order_by('id').values_list('id', 'address__lat', 'address__long', 'entrance_fee', 'time_zone')
+
+    def interval_rows(self, farm_ids=None):
+        intervals = OpenInterval.objects.order_by('farm_id', 'opens_at')
+        if farm_ids is not None:
+            intervals = intervals.filter(farm_id__in=farm_ids)
+        return intervals.values_list('farm_id', 'opens_at', 'closes_at')
+
+    def set_row(self, position, lat, long, fee, time_zone):
+        self.lats[position] = NO_VALUE if lat is None else lat
+        self.longs[position] = NO_VALUE if long is None else long
+        self.fees[position] = NO_VALUE if fee is None else float(fee)
+        self.time_zones[position] = TIME_ZONE_INDEX.get(time_zone, TIME_ZONE_INDEX['UTC'])
+
+    def append_row(self, farm_id):
+        self.positions[farm_id] = len(self.ids)
+        self.ids.append(farm_id)
+        self.id_sum += farm_id
+        for column in (self.lats, self.longs, self.fees):
+            column.append(NO_VALUE)
+        self.time_zones.append(0)
+        self.opens.append(array('l'))
+        self.closes.append(array('l'))
+
+    def add_interval(self, farm_id, opens_at, closes_at):
+        position = self.positions.get(farm_id)
+        if position is not None:
+            closes = self.closes[position]
+            self.opens[position].append(opens_at)
+            closes.append(max(closes_at, closes[-1]) if closes else closes_at)
+
+    def load(self, version):
+        self.__init__()
+        # Taken first, farms changing during the load are applied again by the next sync
+        self.state = Farm.objects.aggregate(farms=Count('id'), id_sum=Sum('id'), last_updated=Max('last_updated'))
+        self.last_updated = self.state['last_updated']
+        for farm_id, lat, long, fee, time_zone in self.farm_rows(Farm.objects.all()).iterator(chunk_size=5000):
+            self.append_row(farm_id)
+            self.set_row(len(self.ids) - 1, lat, long, fee, time_zone)
+        for row in self.interval_rows().iterator(chunk_size=5000):
+            self.add_interval(*row)
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.build_indexes()
+
+    def copy(self):
+        # The per farm interval arrays are shared, sync() replaces them rather than appending
+        snapshot = CatalogSnapshot()
+        snapshot.last_updated, snapshot.id_sum = self.last_updated, self.id_sum
+        for name in ('ids', 'lats', 'longs', 'fees', 'time_zones'):
+            setattr(snapshot, name, array(getattr(self, name).typecode, getattr(self, name)))
+        snapshot.opens, snapshot.closes = list(self.opens), list(self.closes)
+        snapshot.positions = dict(self.positions)
+        return snapshot
+
+    def sync(self, version):
+        """
+        Returns the snapshot with the farms changed since it was taken applied, as a new
+        snapshot so that requests still reading this one see it unchanged. Address, working
+        hour and farm plant changes move Farm.last_updated too. Deleted farms, found by the
+        count and sum of the ids, and farms added below the highest known id need a full load.
+        """
+        state = Farm.objects.aggregate(farms=Count('id'), id_sum=Sum('id'), last_updated=Max('last_updated'))
+        if state == self.state:
+            # Nothing moved, only the bookkeeping read by get_snapshot() changes
+            self.version, self.checked_at = version, time.monotonic()
+            return self
+
+        snapshot = CatalogSnapshot()
+        if self.last_updated is None:
+            snapshot.load(version)
+            return snapshot
+        changed = list(self.farm_rows(Farm.objects.filter(last_updated__gte=self.last_updated)))
+        added = [row[0] for row in changed if row[0] not in self.positions]
+        if (state['farms'] != len(self.ids) + len(added) or (state['id_sum'] or 0) != self.id_sum + sum(added)
+                or (added and self.ids and min(added) < self.ids[-1])):
+            snapshot.load(version)
+            return snapshot
+
+        snapshot = self.copy()
+        for farm_id, lat, long, fee, time_zone in changed:
+            if farm_id not in snapshot.positions:
+                snapshot.append_row(farm_id)
+            position = snapshot.positions[farm_id]
+            snapshot.set_row(position, lat, long, fee, time_zone)
+            snapshot.opens[position], snapshot.closes[position] = array('l'), array('l')
+        for row in snapshot.interval_rows([row[0] for row in changed]):
+            snapshot.add_interval(*row)
+        snapshot.last_updated = max(self.last_updated, state['last_updated'])
+        snapshot.state = state
+        snapshot.version = version
+        snapshot.checked_at = time.monotonic()
+        snapshot.build_indexes()
+        return snapshot
+
+    def sync_due(self):
+        return time.monotonic() - self.checked_at >= settings.UPICK_SNAPSHOT_SYNC_INTERVAL
+
+    def build_indexes(self):
+        # Grid cells of the located farms and the fee column in fee order
+        self.grid = {}
+        for position, (lat, long) in enumerate(zip(self.lats, self.longs)):
+            if not math.isnan(lat):
+                self.grid.setdefault(_cell(lat, long), array('l')).append(position)
+        by_fee = sorted((fee, position) for position, fee in enumerate(self.fees) if not math.isnan(fee))
+        self.sorted_fees = array('d', (fee for fee, _ in by_fee))
+        self.fee_positions = array('l', (position for _, position in by_fee))
+        self.free_positions = array('l', (position for position, fee in enumerate(self.fees) if math.isnan(fee)))
+
+    #  ------------ predicates ------------------- #
+
+    def around(self, lat, long, radius):
+        # {position: distance in miles} of the farms within radius miles of the point
+        min_lat, max_lat, long_ranges = bounding_box(lat, long, radius)
+        (low_row, _), (high_row, _) = _cell(min_lat, 0), _cell(max_lat, 0)
+        distances = {}
+        for min_long, max_long in long_ranges:
+            (_, low_column), (_, high_column) = _cell(0, min_long), _cell(0, max_long)
+            for row in range(low_row, high_row + 1):
+                for column in range(low_column, high_column + 1):
+                    for position in self.grid.get((row, column), ()):
+                        distance = haversine_miles(lat, long, self.lats[position], self.longs[position])
+                        if distance <= radius:
+                            distances[position] = distance
+        return distances
+
+    def fee_range(self, low, high):
+        # Positions with a fee between low and high (None for open ends), unordered
+        start = 0 if low is None else bisect_left(self.sorted_fees, float(low))
+        stop = len(self.sorted_fees) if high is None else bisect_right(self.sorted_fees, float(high))
+        positions = list(self.fee_positions[start:stop])
+        # Farms without an entrance fee are free
+        if (low is None or low <= 0) and (high is None or high >= 0):
+            positions.extend(self.free_positions)
+        return positions
+
+    def open_test(self, now):
+        # Returns a function telling whether the farm at a position is open at now
+        current = [second_of_week(now.astimezone(ZoneInfo(time_zone))) for time_zone in TIME_ZONES]
+        opens, closes, time_zones = self.opens, self.closes, self.time_zones
+
+        def is_open(position):
+            second = current[time_zones[position]]
+            index = bisect_right(opens[position], second) - 1
+            return index >= 0 and closes[position][index] >= second
+        return is_open
+
+
+def get_snapshot():
+    """
+    The process wide snapshot, loaded on first use and synced when the catalog version
+    moves, or every UPICK_SNAPSHOT_SYNC_INTERVAL seconds for writes made without the
+    model signals. Syncs build a new snapshot and publish it in one assignment.
+    """
+    global _snapshot
+    version = catalog_version()
+    snapshot = _snapshot
+    if snapshot is None or snapshot.version != version or snapshot.sync_due():
+        with _lock:
+            snapshot = _snapshot
+            if snapshot is None:
+                snapshot = CatalogSnapshot()
+                snapshot.load(version)
+            elif snapshot.version != version or snapshot.sync_due():
+                snapshot = snapshot.sync(version)
+            _snapshot = snapshot
+    return snapshot
+
+
+def clear_snapshot():
+    global _snapshot
+    _snapshot = None
+
+
+#  ------------ answering farm list queries ------------------- #
+
+class SnapshotResult:
+    """
+    The farms matching a validated FarmFilter, ordered like the filtered queryset
+    would be. It stands in for the queryset given to the paginator: count() and
+    slicing are answered from the snapshot, and only the rows of a slice are
+    fetched, from queryset. Matches are found lazily, so with a cached count a
+    page only looks at the farms up to its last row.
+    """
+
+    def __init__(self, snapshot, filterset, queryset, now):
+        self.snapshot = snapshot
+        self.queryset = queryset
+        self.distances = {}
+        positions = self.match(filterset, now)
+        if isinstance(positions, (list, range)):
+            self.matched, self.pending = positions, None
+        else:
+            self.matched, self.pending = [], positions
+
+    def match(self, filterset, now):
+        data = filterset.form.cleaned_data
+        snapshot = self.snapshot
+        tests = []
+
+        candidates = None
+        if any(data.get(name) is not None for name in ('radius', 'address__lat', 'address__long')):
+            radius, lat, long = filterset.get_search_point()
+            self.distances = snapshot.around(lat, long, radius)
+            candidates = sorted(self.distances)
+
+        fee = data.get('entrance_fee')
+        if fee is not None and (fee.start is not None or fee.stop is not None):
+            in_range = snapshot.fee_range(fee.start, fee.stop)
+            if candidates is None:
+                candidates = sorted(in_range)
+            else:
+                tests.append(set(in_range).__contains__)
+
+        if data.get('is_open') is not None:
+            is_open = snapshot.open_test(now)
+            tests.append(is_open if data['is_open'] else lambda position: not is_open(position))
+
+        if candidates is None:
+            candidates = range(len(snapshot.ids))
+        positions = candidates
+        if tests:
+            positions = (position for position in candidates if all(test(position) for test in tests))
+
+        if data.get('ordering') == 'distance':
+            positions = list(positions)
+            if not self.distances:
+                _, lat, long = filterset.get_search_point()
+                self.distances = {
+                    position: haversine_miles(lat, long, snapshot.lats[position], snapshot.longs[position])
+                    for position in positions if not math.isnan(snapshot.lats[position])
+                }
+            # Farms without an address sort first, like NULL distances in the database
+            positions.sort(key=lambda position: (position in self.distances, self.distances.get(position, 0), position))
+        return positions
+
+    def fill(self, stop=None):
+        # Finds matches until there are stop of them, or all of them when stop is None
+        if self.pending is None:
+            return
+        missing = None if stop is None else stop - len(self.matched)
+        if missing is None or missing > 0:
+            self.matched.extend(islice(self.pending, missing))
+
+    def count(self):
+        self.fill()
+        return len(self.matched)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.stop is None or index.stop < 0:
+            self.fill()
+        else:
+            self.fill(index.stop)
+        positions = self.matched[index] if isinstance(index, slice) else [self.matched[index]]
+        ids = [self.snapshot.ids[position] for position in positions]
+        farms = self.queryset.filter(id__in=ids).in_bulk()
+        rows = []
+        for position, farm_id in zip(positions, ids):
+            # A farm deleted since the snapshot was synced is left out
+            if farm_id in farms:
+                farm = farms[farm_id]
+                if position in self.distances:
+                    farm.distance_miles = self.distances[position]
+                rows.append(farm)
+        return rows if isinstance(index, slice) else rows[0]
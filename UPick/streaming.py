@@ -0,0 +1,61 @@
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+from .metrics import serializer_timer
+
+# Streaming responses. A list page is written as the {"info": ..., "results": [...]}
+# envelope followed by one result at a time, and exports walk the whole filtered
+# queryset in primary key chunks, so memory does not grow with the response size.
+
+
+def iterate_in_chunks(queryset, chunk_size):
+    """
+    Yields the rows of queryset in primary key order, chunk_size rows and one query
+    (plus prefetches) at a time. Unlike QuerySet.iterator() this keeps memory flat on
+    MySQL too, where the driver buffers whole result sets.
+    """
+    last_pk = None
+    queryset = queryset.order_by('pk')
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def _represent(request, serializer, rows, render):
+    # The results of one chunk or page rendered one by one, timed as serializer time
+    for row in rows:
+        with serializer_timer(request):
+            representation = serializer.to_representation(row)
+        yield render(representation)
+
+
+def stream_list(request, info, serializer, page):
+    """
+    Streams a list response with the same content as Response({'info': info, 'results': ...}).
+    serializer is the many=True serializer of the page, whose child renders each row.
+    """
+    def render(data):
+        return request.accepted_renderer.render(data, request.accepted_media_type)
+
+    def content():
+        yield b'{"info":' + render(info) + b',"results":['
+        for index, result in enumerate(_represent(request, serializer.child, page, render)):
+            yield result if index == 0 else b',' + result
+        yield b']}'
+
+    return StreamingHttpResponse(content(), content_type=request.accepted_renderer.media_type)
+
+
+def stream_ndjson(request, queryset, serializer, chunk_size):
+    # Streams every row of queryset as one JSON document per line
+    render = JSONRenderer().render
+
+    def content():
+        for chunk in iterate_in_chunks(queryset, chunk_size):
+            for result in _represent(request, serializer, chunk, render):
+                yield result + b'\n'
+
+    return StreamingHttpResponse(content(), content_type='application/x-ndjson')
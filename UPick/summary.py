@@ -0,0 +1,127 @@
+from collections import namedtuple
+from datetime import time
+from django.db import transaction
+from .models import Farm, FarmPlants, FarmSummary, WorkingHour
+
+# The FarmSummary table holds one pre-joined row per farm: the farm columns, its
+# flattened address, its weekly hours packed in one string and the ids of its plants
+# and their categories. The farm list reads it instead of joining and prefetching the
+# address and working hours. The model signals rebuild the row of every farm they touch,
+# and manage.py rebuild_farm_summaries rebuilds the whole table and checks it.
+
+WeeklyHour = namedtuple('WeeklyHour', ['day', 'opening_time', 'closing_time'])
+
+FARM_VALUES = ['id', 'title', 'image_url', 'description', 'entrance_fee', 'phone', 'email', 'website', 'time_zone']
+ADDRESS_VALUES = ['street', 'city', 'state', 'country', 'zip_code', 'lat', 'long', 'geohash']
+
+# Every FarmSummary column, in the order summary_rows() builds them
+SUMMARY_FIELDS = FARM_VALUES + ADDRESS_VALUES + ['weekly_hours', 'plant_ids', 'category_ids']
+
+CHUNK_SIZE = 2000
+
+
+#  ------------ encoding ------------------- #
+
+def _encode_time(value):
+    return '-' if value is None else value.isoformat()
+
+
+def _decode_time(value):
+    return None if value == '-' else time.fromisoformat(value)
+
+
+def encode_weekly_hours(working_hours):
+    # (day, opening_time, closing_time) rows as 'mon 08:00:00 17:00:00;tue - -'
+    return ';'.join(
+        f'{day} {_encode_time(opening_time)} {_encode_time(closing_time)}'
+        for day, opening_time, closing_time in working_hours
+    )
+
+
+def weekly_hours(encoded):
+    # The WeeklyHour rows of an encoded week, they stand in for WorkingHour in clock.is_open()
+    hours = []
+    for entry in encoded.split(';') if encoded else ():
+        day, opening_time, closing_time = entry.split(' ')
+        hours.append(WeeklyHour(day, _decode_time(opening_time), _decode_time(closing_time)))
+    return hours
+
+
+def encode_ids(ids):
+    return f',{",".join(str(id_) for id_ in ids)},' if ids else ''
+
+
+def decode_ids(encoded):
+    return [int(id_) for id_ in encoded.strip(',').split(',')] if encoded else []
+
+
+#  ------------ building the table ------------------- #
+
+def summary_rows(farms, working_hours, farm_plants):
+    """
+    Yields the FarmSummary values of the farms queryset as dicts, keyed like
+    SUMMARY_FIELDS, in id order. working_hours and farm_plants are the querysets
+    to read the hours and plants from.
+    """
+    farms = farms.order_by('id').values_list(*FARM_VALUES, *(f'address__{name}' for name in ADDRESS_VALUES))
+    last_id = None
+    while True:
+        chunk = list((farms if last_id is None else farms.filter(id__gt=last_id))[:CHUNK_SIZE])
+        if not chunk:
+            return
+        farm_ids = [row[0] for row in chunk]
+        last_id = farm_ids[-1]
+
+        hours = {}
+        for farm_id, *hour in working_hours.filter(farm_id__in=farm_ids).order_by('farm_id', 'id').values_list(
+                'farm_id', 'day', 'opening_time', 'closing_time'):
+            hours.setdefault(farm_id, []).append(hour)
+        plants, categories = {}, {}
+        for farm_id, plant_id, category_id in farm_plants.filter(farm_id__in=farm_ids).order_by(
+                'farm_id', 'plant_id').values_list('farm_id', 'plant_id', 'plant__category_id'):
+            plants.setdefault(farm_id, []).append(plant_id)
+            categories.setdefault(farm_id, set()).add(category_id)
+
+        for row in chunk:
+            farm_id = row[0]
+            yield dict(zip(SUMMARY_FIELDS, (
+                *row,
+                encode_weekly_hours(hours.get(farm_id, ())),
+                encode_ids(sorted(set(plants.get(farm_id, ())))),
+                encode_ids(sorted(categories.get(farm_id, ()))),
+            )))
+
+
+def _summaries(farm_ids, using):
+    farms = Farm.objects.using(using)
+    if farm_ids is not None:
+        farms = farms.filter(id__in=farm_ids)
+    return summary_rows(farms, WorkingHour.objects.using(using), FarmPlants.objects.using(using))
+
+
+def rebuild_farm_summaries(farm_ids=None, using='default'):
+    """
+    Rebuilds the FarmSummary rows of the given farms, or of every farm when
+    farm_ids is None. Rows of farms that no longer exist are removed.
+    """
+    summaries = FarmSummary.objects.using(using)
+    if farm_ids is not None:
+        summaries = summaries.filter(id__in=farm_ids)
+    rows = [FarmSummary(**values) for values in _summaries(farm_ids, using)]
+
+    with transaction.atomic(using=using):
+        summaries.delete()
+        FarmSummary.objects.using(using).bulk_create(rows, batch_size=1000)
+
+
+def stale_farm_summaries(using='default'):
+    """
+    Returns the sorted ids of the farms whose FarmSummary row is missing or differs
+    from what a rebuild would write, and of the rows left from deleted farms.
+    """
+    stored = {values['id']: values for values in FarmSummary.objects.using(using).values(*SUMMARY_FIELDS).iterator()}
+    stale = []
+    for values in _summaries(None, using):
+        if stored.pop(values['id'], None) != values:
+            stale.append(values['id'])
+    return sorted(stale + list(stored))
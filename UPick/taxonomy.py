@@ -0,0 +1,101 @@
+from django.db.models import Count, F, Value
+from .caching import aget_version, get_version
+from .models import FarmPlants, Plant, PlantCategory
+
+# In-process copy of the plant taxonomy (categories and plants), which is small and
+# rarely changes. It is loaded once per process and reloaded when the 'taxonomy'
+# cache version moves, which the Plant and PlantCategory signals bump on every change.
+
+_taxonomy = None
+
+
+class Taxonomy:
+
+    def __init__(self, version, categories, plants):
+        self.version = version
+        # {id: {'id': ..., 'name': ...}}, shared by every plant of the category
+        self.categories = categories
+        # {id: {'title': ..., 'scientific_name': ..., 'country_of_origin': ..., 'category': {...}}}
+        self.plants = plants
+
+
+def build_taxonomy(version, category_rows, plant_rows):
+    categories = {category_id: {'id': category_id, 'name': name} for category_id, name in category_rows}
+    plants = {
+        plant_id: {
+            'title': title,
+            'scientific_name': scientific_name,
+            'country_of_origin': country_of_origin,
+            'category': categories[category_id],
+        }
+        for plant_id, title, scientific_name, country_of_origin, category_id in plant_rows
+    }
+    return Taxonomy(version, categories, plants)
+
+
+def _category_rows():
+    return PlantCategory.objects.values_list('id', 'name')
+
+
+def _plant_rows():
+    return Plant.objects.values_list('id', 'title', 'scientific_name', 'country_of_origin', 'category_id')
+
+
+def get_taxonomy():
+    global _taxonomy
+    version = get_version('taxonomy')
+    if _taxonomy is None or _taxonomy.version != version:
+        _taxonomy = build_taxonomy(version, list(_category_rows()), list(_plant_rows()))
+    return _taxonomy
+
+
+async def aget_taxonomy():
+    global _taxonomy
+    version = await aget_version('taxonomy')
+    if _taxonomy is None or _taxonomy.version != version:
+        category_rows = [row async for row in _category_rows()]
+        plant_rows = [row async for row in _plant_rows()]
+        _taxonomy = build_taxonomy(version, category_rows, plant_rows)
+    return _taxonomy
+
+
+def clear_taxonomy():
+    global _taxonomy
+    _taxonomy = None
+
+
+#  ------------ facets ------------------- #
+
+def facet_counts(farms):
+    """
+    Counts the farms of the farms queryset that grow each plant and each category,
+    as {'categories': [...], 'plants': [...]} ordered by id. Both groupings run as
+    one UNION ALL query, names come from the taxonomy.
+    """
+    farm_plants = FarmPlants.objects.filter(farm_id__in=farms.order_by().values('id')).order_by()
+    plant_counts = farm_plants.values(key=F('plant_id')).annotate(
+        kind=Value('plant'), farms=Count('farm_id', distinct=True)).values_list('kind', 'key', 'farms')
+    category_counts = farm_plants.values(key=F('plant__category_id')).annotate(
+        kind=Value('category'), farms=Count('farm_id', distinct=True)).values_list('kind', 'key', 'farms')
+
+    taxonomy = get_taxonomy()
+    counts = {'category': {}, 'plant': {}}
+    for kind, key, farm_count in plant_counts.union(category_counts, all=True):
+        counts[kind][key] = farm_count
+
+    categories = [
+        {**taxonomy.categories[category_id], 'farms': farm_count}
+        for category_id, farm_count in sorted(counts['category'].items())
+        if category_id in taxonomy.categories
+    ]
+    plants = [
+        {
+            'id': plant_id,
+            'title': taxonomy.plants[plant_id]['title'],
+            'category': taxonomy.plants[plant_id]['category']['id'],
+            'farms': farm_count,
+        }
+        for plant_id, farm_count in sorted(counts['plant'].items())
+        if plant_id in taxonomy.plants
+    ]
+    return {'categories': categories, 'plants': plants}
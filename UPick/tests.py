@@ -1,3 +1,1349 @@
-from django.test import TestCase
+import io
+import json
+import math
+import os
+import tempfile
+from datetime import date, datetime, time, timezone as dt_timezone
+from pathlib import Path
+from time import sleep
+from unittest import skipUnless
+from unittest.mock import ANY, patch
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from . import async_views
+from .benchmark import compare
+from .caching import response_cache_timeout
+from .checks import check_shared_caches
+from .filters import FarmFilter
+from .geo import EARTH_RADIUS_MILES, MAX_COVERING_CELLS, covering_geohashes, encode_geohash
+from .models import Address, Farm, FarmPlants, FarmSummary, Plant, PlantCategory, SearchToken, WorkingHour
+from .routers import is_healthy, reset_health
+from .schedule import RequestClock, rebuild_open_intervals, second_of_week, working_hour_intervals
+from .seed import parse_sql_values, read_sql_dump
+from .serializers import FarmDetailSerializer
+from .seasons import season_intervals
+from .snapshot import clear_snapshot, get_snapshot
+from .summary import decode_ids, rebuild_farm_summaries, stale_farm_summaries, weekly_hours
+from .taxonomy import get_taxonomy
 
 # Create your tests here.
+
+def create_catalog(farm_count=10, plants_per_farm=12):
+    category = PlantCategory.objects.create(name='Rosaceae')
+    plants = [
+        Plant.objects.create(title=f'Plant {index}', scientific_name=f'Plantae {index}', category=category)
+        for index in range(plants_per_farm)
+    ]
+    for index in range(farm_count):
+        farm = Farm.objects.create(title=f'Farm {index}', email=f'farm{index}@example.com', entrance_fee=index)
+        Address.objects.create(
+            farm=farm, street=f'{index} Orchard Rd', city='Watsonville', state='CA',
+            country='United States', zip_code='95076', lat=36.9 + index / 100, long=-121.7 + index / 10,
+        )
+        for day, _ in WorkingHour.DAYS_OF_WEEK:
+            WorkingHour.objects.create(farm=farm, day=day, opening_time=time(8), closing_time=time(17))
+        for plant in plants:
+            FarmPlants.objects.create(
+                farm=farm, plant=plant, season_start=date(2023, 5, 1),
+                season_end=date(2023, 9, 30), organic=index % 2 == 0,
+            )
+
+
+def response_json(response):
+    content = b''.join(response.streaming_content) if response.streaming else response.content
+    return json.loads(content)
+
+
+# Before any farm opens, every is_open value stays the same until 08:00
+MORNING = datetime(2023, 6, 5, 6, 0, tzinfo=dt_timezone.utc)
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None)
+class PlantListQueryCountTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog()
+
+    def setUp(self):
+        caches['default'].clear()
+        get_taxonomy()
+
+    def assertPageQueries(self, page_size):
+        # The count, the page and today's working hours, plants and categories
+        # come from the loaded taxonomy
+        with self.assertNumQueries(3):
+            response = self.client.get('/UPick/plants/', {'page_size': page_size}, HTTP_ACCEPT='application/json')
+            data = response_json(response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['results']), page_size)
+
+    def test_page_size_1(self):
+        self.assertPageQueries(1)
+
+    def test_page_size_20(self):
+        self.assertPageQueries(20)
+
+    def test_page_size_100(self):
+        self.assertPageQueries(100)
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None, UPICK_FARM_SUMMARY=False)
+class FarmListPrefetchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(farm_count=3, plants_per_farm=1)
+
+    def test_only_todays_working_hours_are_fetched(self):
+        for fast in (True, False):
+            with self.subTest(fast=fast), self.settings(UPICK_FAST_SERIALIZERS=fast), \
+                    patch('django.utils.timezone.now', return_value=MORNING), \
+                    CaptureQueriesContext(connection) as queries:
+                data = response_json(self.client.get('/UPick/farms/', HTTP_ACCEPT='application/json'))
+            hours_queries = [query['sql'] for query in queries if 'workinghour' in query['sql'].lower()]
+            self.assertEqual(len(hours_queries), 1)
+            self.assertIn('"day" IN', hours_queries[0])
+            self.assertEqual({hour['day'] for farm in data['results'] for hour in farm['working_hours']}, {'mon'})
+
+
+def destination(lat, long, bearing, miles):
+    # The point reached going ``miles`` from lat, long on the initial bearing in degrees
+    distance = miles / EARTH_RADIUS_MILES
+    lat, long, bearing = map(math.radians, (lat, long, bearing))
+    end_lat = math.asin(math.sin(lat) * math.cos(distance) + math.cos(lat) * math.sin(distance) * math.cos(bearing))
+    end_long = long + math.atan2(math.sin(bearing) * math.sin(distance) * math.cos(lat),
+                                 math.cos(distance) - math.sin(lat) * math.sin(end_lat))
+    return math.degrees(end_lat), (math.degrees(end_long) + 540) % 360 - 180
+
+
+class GeohashTests(TestCase):
+
+    def assertCovers(self, lat, long, radius):
+        prefixes = covering_geohashes(lat, long, radius)
+        self.assertLessEqual(len(prefixes), MAX_COVERING_CELLS)
+        # The circle edge every 5 degrees, the diagonals reach into the corner cells
+        points = [(lat, long)] + [destination(lat, long, bearing, radius * 0.999) for bearing in range(0, 360, 5)]
+        for point in points:
+            geohash = encode_geohash(*point)
+            self.assertTrue(any(geohash.startswith(prefix) for prefix in prefixes), (point, geohash, prefixes))
+
+    def test_covering_cells(self):
+        for lat, long, radius in [
+            (36.95, -121.7, 10), (36.95, -121.7, 0.01), (45.0, 90.0, 500), (0.0, 0.0, 3),
+            # Around the poles
+            (89.95, 0.0, 30), (-89.9, 45.0, 20), (88.0, -120.0, 300),
+            # Across the antimeridian
+            (0.0, 179.99, 25), (-16.5, -179.95, 15), (65.0, 180.0, 40),
+        ]:
+            with self.subTest(lat=lat, long=long, radius=radius):
+                self.assertCovers(lat, long, radius)
+
+    def test_radius_search_across_the_antimeridian(self):
+        for index, long in enumerate([179.95, -179.95, 178.0]):
+            farm = Farm.objects.create(title=f'Fiji {index}')
+            Address.objects.create(farm=farm, street='1 Coast Rd', city='Labasa', state='Northern',
+                                   country='Fiji', zip_code='0000', lat=-16.5, long=long)
+        response = self.client.get('/UPick/farms/', {'radius': 15, 'address__lat': -16.5, 'address__long': 179.99,
+                                                     'ordering': 'distance'}, HTTP_ACCEPT='application/json')
+        self.assertEqual([farm['title'] for farm in response_json(response)['results']], ['Fiji 0', 'Fiji 1'])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked on SQLite, see migration 0005 for MySQL')
+class FilterIndexTests(TestCase):
+    # Each index added for the list filters shows up in the EXPLAIN QUERY PLAN of its query
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog()
+
+    def filter_farms(self, **params):
+        request = Request(APIRequestFactory().get('/UPick/farms/', params))
+        return FarmFilter(request.query_params, queryset=Farm.objects.all(), request=request).qs
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_radius_uses_geohash_index(self):
+        queryset = self.filter_farms(radius=10, address__lat=36.95, address__long=-121.7)
+        self.assertUsesIndex(queryset, 'upick_address_geo_idx')
+
+    def test_is_open_uses_schedule_index(self):
+        self.assertUsesIndex(self.filter_farms(is_open='true'), 'upick_openinterval_now_idx')
+
+    def test_entrance_fee_uses_fee_index(self):
+        self.assertUsesIndex(self.filter_farms(entrance_fee_min=2, entrance_fee_max=4), 'upick_farm_fee_idx')
+
+    def test_free_entrance_fee_uses_fee_index(self):
+        self.assertUsesIndex(self.filter_farms(entrance_fee_max=4), 'upick_farm_fee_idx')
+
+    def test_working_hours_prefetch_uses_day_index(self):
+        farm_ids = list(Farm.objects.values_list('id', flat=True)[:5])
+        queryset = WorkingHour.objects.filter(farm_id__in=farm_ids, day__in=['mon'])
+        self.assertUsesIndex(queryset, 'upick_workinghour_day_idx')
+
+    def test_plant_filter_uses_season_index(self):
+        plant = Plant.objects.first()
+        queryset = FarmPlants.objects.filter(plant=plant).values('id', 'season_start', 'season_end')
+        self.assertUsesIndex(queryset, 'upick_farmplants_season_idx')
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None)
+class SeasonTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(farm_count=1, plants_per_farm=3)
+        cls.summer, cls.winter, cls.reversed = FarmPlants.objects.order_by('id')
+        # From November into the next February
+        cls.winter.season_start, cls.winter.season_end = date(2023, 11, 1), date(2024, 2, 29)
+        cls.winter.save()
+        # The same season entered with both dates in one year
+        cls.reversed.season_start, cls.reversed.season_end = date(2023, 11, 1), date(2023, 2, 28)
+        cls.reversed.save()
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def in_season(self, day):
+        results = response_json(self.client.get('/UPick/plants/', {'in_season': day}, HTTP_ACCEPT='application/json'))['results']
+        return {result['id'] for result in results}
+
+    def test_season_intervals(self):
+        self.assertEqual(season_intervals(date(2023, 5, 1), date(2023, 9, 30)), [(122, 274)])
+        self.assertEqual(season_intervals(date(2023, 11, 1), date(2024, 2, 29)), [(306, 366), (1, 60)])
+        self.assertEqual(season_intervals(date(2023, 11, 1), date(2023, 2, 28)), [(306, 366), (1, 59)])
+        self.assertEqual(season_intervals(date(2023, 1, 1), date(2024, 1, 1)), [(1, 366)])
+        self.assertEqual(season_intervals(None, date(2024, 1, 1)), [])
+
+    def test_seasons_over_the_new_year(self):
+        self.assertEqual(self.in_season('2024-06-01'), {self.summer.id})
+        self.assertEqual(self.in_season('2023-12-25'), {self.winter.id, self.reversed.id})
+        self.assertEqual(self.in_season('2025-01-15'), {self.winter.id, self.reversed.id})
+        self.assertEqual(self.in_season('2024-02-29'), {self.winter.id})
+        self.assertEqual(self.in_season('2024-10-31'), set())
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None, UPICK_STREAM_LISTS=False)
+class FastSerializerTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(farm_count=4, plants_per_farm=2)
+        Farm.objects.create(title='No address')
+        Farm.objects.filter(title='Farm 1').update(entrance_fee=None, website='https://farm1.example.com')
+        WorkingHour.objects.filter(farm__title='Farm 2', day='mon').update(opening_time=None, closing_time=None)
+        WorkingHour.objects.filter(farm__title='Farm 3', day='mon').update(opening_time=time(13))
+        rebuild_open_intervals()
+        rebuild_farm_summaries()
+
+    def setUp(self):
+        caches['default'].clear()
+        get_taxonomy()
+        # Monday noon, Farm 0 and Farm 1 are open
+        clock = patch('django.utils.timezone.now', return_value=MORNING.replace(hour=12))
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def content(self, path, params):
+        caches['default'].clear()
+        response = self.client.get(path, params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_same_bytes_as_the_drf_serializers(self):
+        point = {'address__lat': 36.9, 'address__long': -121.7}
+        for path, params in [
+            ('/UPick/farms/', {}),
+            ('/UPick/farms/', {'expand': 'farm_plants'}),
+            ('/UPick/farms/', {'fields': 'id,title,working_hours.is_open,address.geo_location'}),
+            ('/UPick/farms/', {'radius': 30, 'ordering': 'distance', **point}),
+            ('/UPick/farms/', {'is_open': 'true', 'page_size': 1, 'page': 2}),
+            ('/UPick/farms/', {'is_open': 'false'}),
+            ('/UPick/plants/', {}),
+            ('/UPick/plants/', {'ordering': 'distance', 'radius': 30, **point}),
+            ('/UPick/plants/export/', {}),
+        ]:
+            with self.subTest(path=path, params=params):
+                fast = self.content(path, params)
+                with self.settings(UPICK_FAST_SERIALIZERS=False):
+                    self.assertEqual(fast, self.content(path, params))
+
+
+SEED_DUMP = r"""USE UPickFront;
+
+-- Farm --
+
+insert into UPick_farm (id, title, description, entrance_fee, email, last_updated) values (1, 'O''Hara Farm', 'Berries, jams\nand pies', 4.5, 'ohara@example.com', '2022-11-30 03:14:00');
+insert into `UPick_farm` (id, title, description, entrance_fee, email, last_updated) values (2, 'It\'s Fresh', null, null, 'fresh@example.com', '2023-01-02 10:00:00');
+insert into UPick_address (id, street, city, state, country, zip_code, lat, `long`, farm_id) values (1, '773 Mesta Trail', 'Springfield', 'MA', 'United States', '01152', 42.1707, -72.6048, '1');
+insert into UPick_workinghour (id, day, opening_time, closing_time, farm_id) values (1, 'mon', '7:51:05.000', '14:18:04.000', '1');
+insert into UPick_plantcategory (id, name, last_updated) values (1, 'Rosaceae', '2022-06-17 00:58:29');
+insert into UPick_plant (id, title, scientific_name, country_of_origin, last_updated, category_id) values (1, 'Strawberry', 'Fragaria', 'Chile', '2023-04-13 22:52:53', '1');
+insert into UPick_farmplants (id, farm_id, plant_id, image_url, season_start, season_end, organic, description) values (1, '1', '1', null, '2023-05-01 09:20:43', '2023-09-30 00:54:29', true, 'Pick your own');
+"""
+
+
+class SeedTests(TestCase):
+
+    def test_parse_sql_values(self):
+        self.assertEqual(
+            parse_sql_values(r"1, 'O''Hara, Farm', null, -72.6048, 'It\'s', TRUE, 'a\nb\\c', 2.5e3"),
+            [1, "O'Hara, Farm", None, -72.6048, "It's", True, 'a\nb\\c', 2500.0],
+        )
+        with self.assertRaises(ValueError):
+            parse_sql_values("1, 'unterminated")
+
+    def test_read_sql_dump(self):
+        records = list(read_sql_dump(SEED_DUMP.splitlines()))
+        self.assertEqual([table for table, _, _ in records], [
+            'UPick_farm', 'UPick_farm', 'UPick_address', 'UPick_workinghour',
+            'UPick_plantcategory', 'UPick_plant', 'UPick_farmplants',
+        ])
+        self.assertEqual(records[1][2], [2, "It's Fresh", None, None, 'fresh@example.com', '2023-01-02 10:00:00'])
+        self.assertEqual(records[2][1][-3:], ['lat', 'long', 'farm_id'])
+
+    def test_load_seed_with_scale(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'seed.sql')
+            with open(path, 'w', encoding='utf-8') as dump:
+                dump.write(SEED_DUMP)
+            output = io.StringIO()
+            call_command('load_seed', path, '--scale', '3', '--batch-size', '4', stdout=output)
+
+        # The 2 loaded farms and 3 times as many synthetic ones
+        self.assertEqual(Farm.objects.count(), 8)
+        self.assertEqual(Address.objects.count(), 7)
+        farm = Farm.objects.get(id=1)
+        self.assertEqual(farm.title, "O'Hara Farm")
+        self.assertEqual(farm.description, 'Berries, jams\nand pies')
+        self.assertEqual(farm.address.geohash, encode_geohash(42.1707, -72.6048))
+        self.assertEqual(str(farm.working_hours.get().opening_time), '07:51:05')
+        self.assertEqual(FarmPlants.objects.get(id=1).season_start, date(2023, 5, 1))
+        # Rows keep the last_updated of the dump
+        self.assertEqual(farm.last_updated, datetime(2022, 11, 30, 3, 14, tzinfo=dt_timezone.utc))
+        self.assertEqual(Plant.objects.get(id=1).last_updated, datetime(2023, 4, 13, 22, 52, 53, tzinfo=dt_timezone.utc))
+        self.assertEqual(PlantCategory.objects.get(id=1).last_updated, datetime(2022, 6, 17, 0, 58, 29, tzinfo=dt_timezone.utc))
+        # The derived tables are rebuilt
+        self.assertEqual(FarmSummary.objects.count(), 8)
+        self.assertEqual(stale_farm_summaries(), [])
+        self.assertTrue(farm.open_intervals.exists())
+        self.assertTrue(FarmPlants.objects.get(id=1).season_intervals.exists())
+        self.assertIn('UPick_farm', output.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('load_seed', '--synthetic-only', '--batch-size', '0')
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None)
+class StreamingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(farm_count=3, plants_per_farm=4)
+
+    def test_streamed_page_matches_rendered_page(self):
+        for path in ('/UPick/farms/', '/UPick/plants/'):
+            with self.settings(UPICK_STREAM_LISTS=False):
+                rendered = self.client.get(path, HTTP_ACCEPT='application/json')
+            streamed = self.client.get(path, HTTP_ACCEPT='application/json')
+            self.assertTrue(streamed.streaming)
+            self.assertEqual(b''.join(streamed.streaming_content), rendered.content)
+
+    @override_settings(UPICK_EXPORT_CHUNK_SIZE=2)
+    def test_export_streams_every_row_as_ndjson(self):
+        response = self.client.get('/UPick/plants/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['id'] for row in rows], list(FarmPlants.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_export_applies_filters(self):
+        response = self.client.get('/UPick/farms/export/', {'entrance_fee_min': 1})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertIn('farm_plants', rows[0])
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None)
+class CountCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(farm_count=3, plants_per_farm=1)
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def farm_count(self, **params):
+        return response_json(self.client.get('/UPick/farms/', params, HTTP_ACCEPT='application/json'))['info']['count']
+
+    def test_counts_are_cached(self):
+        self.assertEqual(self.farm_count(entrance_fee_min=1), 2)
+        # The page only
+        with self.assertNumQueries(1):
+            self.assertEqual(self.farm_count(entrance_fee_min=1), 2)
+
+    def test_writes_invalidate_counts(self):
+        self.assertEqual(self.farm_count(entrance_fee_min=1), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            farm = Farm.objects.create(title='Farm 3', entrance_fee=5)
+        self.assertEqual(self.farm_count(entrance_fee_min=1), 3)
+        farm.entrance_fee = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            farm.save()
+        self.assertEqual(self.farm_count(entrance_fee_min=1), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            Farm.objects.get(title='Farm 2').delete()
+        self.assertEqual(self.farm_count(entrance_fee_min=1), 1)
+
+    def test_versions_move_when_the_write_commits(self):
+        cache = caches['default']
+        self.assertEqual(self.farm_count(entrance_fee_min=1), 2)
+        version = cache.get('upick:version:catalog')
+        with self.settings(UPICK_READ_REPLICAS=['replica'], UPICK_REPLICA_LAG=5), \
+                self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Farm.objects.create(title='Farm 3', entrance_fee=5)
+                self.assertEqual(cache.get('upick:version:catalog'), version)
+                self.assertIsNone(cache.get('upick:recent_write'))
+            # Other requests still see the rows before the write
+            self.assertEqual(cache.get('upick:version:catalog'), version)
+        self.assertNotEqual(cache.get('upick:version:catalog'), version)
+        self.assertTrue(cache.get('upick:recent_write'))
+        self.assertEqual(self.farm_count(entrance_fee_min=1), 3)
+
+    def test_deploy_check_warns_about_per_host_caches(self):
+        self.assertEqual([warning.id for warning in check_shared_caches(None)], ['UPick.W001'])
+        with self.settings(UPICK_RESPONSE_CACHE='default'):
+            self.assertEqual(len(check_shared_caches(None)), 2)
+        with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379'}}):
+            self.assertEqual(check_shared_caches(None), [])
+
+    def test_versions_reach_other_workers(self):
+        with tempfile.TemporaryDirectory() as location, self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}):
+            self.assertEqual(self.farm_count(entrance_fee_min=1), 2)
+            # The cache as another worker process opens it
+            other = caches.create_connection('default')
+            version = other.get('upick:version:catalog')
+            with self.captureOnCommitCallbacks(execute=True):
+                Farm.objects.create(title='Farm 3', entrance_fee=5)
+            self.assertNotEqual(other.get('upick:version:catalog'), version)
+            self.assertEqual(self.farm_count(entrance_fee_min=1), 3)
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None)
+class CursorPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(farm_count=5, plants_per_farm=1)
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def get_page(self, path, params=None):
+        response = self.client.get(path, params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response_json(response)
+
+    def titles(self, *pages):
+        return [farm['title'] for page in pages for farm in page['results']]
+
+    def test_next_and_previous_links(self):
+        first = self.get_page('/UPick/farms/', {'cursor': '', 'page_size': 2})
+        self.assertIsNone(first['info']['previous'])
+        second = self.get_page(first['info']['next'])
+        third = self.get_page(second['info']['next'])
+        self.assertEqual(self.titles(first, second, third), [f'Farm {index}' for index in range(5)])
+        self.assertIsNone(third['info']['next'])
+        self.assertEqual(self.get_page(third['info']['previous'])['results'], second['results'])
+
+    def test_pages_stay_put_across_writes(self):
+        first = self.get_page('/UPick/farms/', {'cursor': '', 'page_size': 2})
+        Farm.objects.get(title='Farm 0').delete()
+        Farm.objects.create(title='Farm 5')
+        second = self.get_page(first['info']['next'])
+        self.assertEqual(self.titles(second), ['Farm 2', 'Farm 3'])
+        self.assertEqual(self.titles(self.get_page(second['info']['next'])), ['Farm 4', 'Farm 5'])
+
+    def test_filters_apply_to_every_page(self):
+        first = self.get_page('/UPick/farms/', {'cursor': '', 'page_size': 2, 'entrance_fee_min': 2, 'count': 'true'})
+        self.assertEqual(first['info']['count'], 3)
+        second = self.get_page(first['info']['next'])
+        self.assertEqual(self.titles(first, second), ['Farm 2', 'Farm 3', 'Farm 4'])
+        self.assertIsNone(second['info']['next'])
+
+    def test_other_orderings_are_rejected(self):
+        for params in ({'ordering': 'distance', 'radius': 50, 'address__lat': 36.9, 'address__long': -121.7}, {'q': 'farm'}):
+            with self.subTest(params=params):
+                response = self.client.get('/UPick/farms/', {'cursor': '', **params}, HTTP_ACCEPT='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('cursor', response.json())
+
+
+class TaxonomyTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            create_catalog(farm_count=4, plants_per_farm=3)
+            category = PlantCategory.objects.create(name='Ericaceae')
+            cls.blueberry = Plant.objects.create(title='Blueberry', category=category)
+            for farm in Farm.objects.filter(entrance_fee__gte=2):
+                FarmPlants.objects.create(
+                    farm=farm, plant=cls.blueberry, season_start=date(2023, 6, 1), season_end=date(2023, 8, 31), organic=False,
+                )
+
+    def test_taxonomy_reloads_after_plant_change(self):
+        self.assertEqual(get_taxonomy().plants[self.blueberry.id]['title'], 'Blueberry')
+        self.blueberry.title = 'Highbush Blueberry'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blueberry.save()
+        with self.assertNumQueries(2):
+            self.assertEqual(get_taxonomy().plants[self.blueberry.id]['title'], 'Highbush Blueberry')
+        with self.assertNumQueries(0):
+            get_taxonomy()
+
+    def test_facets_count_farms_per_category_and_plant(self):
+        facets = self.client.get('/UPick/farms/facets/', HTTP_ACCEPT='application/json').json()
+        self.assertEqual(
+            [(category['name'], category['farms']) for category in facets['categories']],
+            [('Rosaceae', 4), ('Ericaceae', 2)],
+        )
+        self.assertEqual(len(facets['plants']), 4)
+        self.assertEqual(facets['plants'][-1], {
+            'id': self.blueberry.id, 'title': 'Blueberry', 'category': self.blueberry.category_id, 'farms': 2,
+        })
+
+    def test_facets_respect_list_filters(self):
+        facets = self.client.get('/UPick/farms/facets/', {'entrance_fee_max': 2}, HTTP_ACCEPT='application/json').json()
+        self.assertEqual([category['farms'] for category in facets['categories']], [3, 1])
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None)
+class FieldsetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(farm_count=3, plants_per_farm=2)
+
+    def setUp(self):
+        caches['default'].clear()
+        get_taxonomy()
+
+    def test_map_fields_trim_the_list(self):
+        # The count and the page
+        with self.assertNumQueries(2) as queries:
+            response = self.client.get('/UPick/farms/', {'fields': 'id,title,address.geo_location'}, HTTP_ACCEPT='application/json')
+            results = response_json(response)['results']
+        self.assertEqual(results[0], {'id': results[0]['id'], 'title': 'Farm 0', 'address': {'geo_location': {'lat': 36.9, 'long': -121.7}}})
+        # The page query only reads the selected columns
+        page_query = next(query['sql'] for query in queries.captured_queries if 'LIMIT' in query['sql'])
+        self.assertNotIn('"description"', page_query)
+
+    def test_expand_embeds_farm_plants(self):
+        results = response_json(self.client.get('/UPick/farms/', {'expand': 'farm_plants'}, HTTP_ACCEPT='application/json'))['results']
+        detail = self.client.get(f'/UPick/farms/{results[0]["id"]}/', HTTP_ACCEPT='application/json').json()
+        self.assertEqual(results[0]['farm_plants'], detail['farm_plants'])
+        with self.settings(UPICK_FAST_SERIALIZERS=False):
+            caches['default'].clear()
+            response = self.client.get('/UPick/farms/', {'expand': 'farm_plants'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response_json(response)['results'], results)
+
+    def test_detail_fields(self):
+        farm = Farm.objects.first()
+        response = self.client.get(f'/UPick/farms/{farm.id}/', {'fields': 'title,farm_plants.title'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {'title': 'Farm 0', 'farm_plants': [{'title': 'Plant 0'}, {'title': 'Plant 1'}]})
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get('/UPick/farms/', {'fields': 'id,owner'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'fields': ['Unknown fields: owner.']})
+        response = self.client.get('/UPick/farms/', {'expand': 'reviews'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class MapTileTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(farm_count=3, plants_per_farm=1)
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_low_zoom_tiles_cluster_farms(self):
+        tile = self.client.get('/UPick/farms/tiles/0/0/0/', HTTP_ACCEPT='application/json').json()
+        self.assertEqual(tile['pins'], [])
+        self.assertEqual(len(tile['clusters']), 1)
+        self.assertEqual(tile['clusters'][0]['count'], 3)
+        self.assertAlmostEqual(tile['clusters'][0]['geo_location']['long'], -121.6)
+
+    def test_high_zoom_tiles_list_pins(self):
+        # The zoom 12 tile holding the first farm at 36.9, -121.7
+        tile = self.client.get('/UPick/farms/tiles/12/663/1595/', HTTP_ACCEPT='application/json').json()
+        self.assertEqual(tile['clusters'], [])
+        self.assertEqual(tile['pins'], [{'id': Farm.objects.get(title='Farm 0').id, 'title': 'Farm 0', 'geo_location': {'lat': 36.9, 'long': -121.7}}])
+
+    def test_tiles_are_cached_and_filtered(self):
+        path = '/UPick/farms/tiles/3/1/3/'
+        self.client.get(path, {'entrance_fee_min': 1}, HTTP_ACCEPT='application/json')
+        with self.assertNumQueries(0):
+            response = self.client.get(path, {'entrance_fee_min': 1}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['clusters'][0]['count'], 2)
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertEqual(self.client.get('/UPick/farms/tiles/1/2/0/').status_code, 404)
+
+    def test_tiles_outside_the_map(self):
+        for path in ['/UPick/farms/tiles/23/0/0/', '/UPick/farms/tiles/4000000000/0/0/', f'/UPick/farms/tiles/3/{"9" * 5000}/0/']:
+            with self.subTest(path=path[:40]):
+                self.assertEqual(self.client.get(path, HTTP_ACCEPT='application/json').status_code, 404)
+
+
+class RequestClockTests(TestCase):
+
+    def clock_at(self, hour, minute=0, second=0, day=5):
+        # June 2023, the 5th is a Monday
+        return RequestClock(datetime(2023, 6, day, hour, minute, second, tzinfo=dt_timezone.utc))
+
+    def test_is_open_and_seconds_valid(self):
+        hour = WorkingHour(day='mon', opening_time=time(8), closing_time=time(17))
+        for clock, is_open, seconds_valid in [
+            (self.clock_at(7, 59, 59), False, 1),
+            (self.clock_at(8), True, 9 * 3600 + 1),
+            # Closing times are inclusive
+            (self.clock_at(17), True, 1),
+            # Closed until the day changes at midnight
+            (self.clock_at(17, 0, 1), False, 7 * 3600 - 1),
+        ]:
+            with self.subTest(now=clock.now):
+                self.assertIs(clock.is_open(hour, 'UTC'), is_open)
+                self.assertEqual(clock.seconds_valid(), seconds_valid)
+
+    def test_other_days_and_closed_days(self):
+        clock = self.clock_at(12)
+        self.assertIsNone(clock.seconds_valid())
+        self.assertIsNone(clock.is_open(WorkingHour(day='tue', opening_time=time(8), closing_time=time(17)), 'UTC'))
+        self.assertIs(clock.is_open(WorkingHour(day='mon', opening_time=None, closing_time=None), 'UTC'), False)
+        self.assertEqual(clock.seconds_valid(), 12 * 3600)
+
+    def test_hours_past_midnight(self):
+        hour = WorkingHour(day='mon', opening_time=time(22), closing_time=time(2))
+        self.assertIs(self.clock_at(21, 59).is_open(hour, 'UTC'), False)
+        clock = self.clock_at(23)
+        self.assertIs(clock.is_open(hour, 'UTC'), True)
+        self.assertEqual(clock.seconds_valid(), 3600)
+        # After midnight the row is yesterday's and open until it closes
+        clock = self.clock_at(1, day=6)
+        self.assertIs(clock.is_open(hour, 'UTC'), True)
+        self.assertEqual(clock.seconds_valid(), 3600 + 1)
+        self.assertIs(self.clock_at(2, 0, 1, day=6).is_open(hour, 'UTC'), False)
+        # Rows of other days, and yesterday's rows ending before midnight, are not for now
+        self.assertIsNone(self.clock_at(1, day=7).is_open(hour, 'UTC'))
+        self.assertIsNone(self.clock_at(1, day=6).is_open(WorkingHour(day='mon', opening_time=time(8), closing_time=time(17)), 'UTC'))
+
+    def test_overnight_hours_match_the_open_now_index(self):
+        # Sunday night hours run into Monday morning
+        hours = [
+            WorkingHour(day='mon', opening_time=time(22), closing_time=time(2)),
+            WorkingHour(day='sun', opening_time=time(23), closing_time=time(1)),
+        ]
+        for day, hour, minute in [(4, 23, 30), (5, 0, 30), (5, 1, 0), (5, 1, 30), (5, 21, 59), (5, 22, 0), (6, 1, 59), (6, 2, 1)]:
+            clock = self.clock_at(hour, minute, day=day)
+            for working_hour in hours:
+                intervals = working_hour_intervals(working_hour.day, working_hour.opening_time, working_hour.closing_time)
+                now = second_of_week(clock.now)
+                with self.subTest(now=clock.now, day=working_hour.day):
+                    expected = any(opens_at <= now <= closes_at for opens_at, closes_at in intervals)
+                    self.assertEqual(bool(clock.is_open(working_hour, 'UTC')), expected)
+
+    def test_time_zones(self):
+        # 15:30 UTC is 08:30 in Los Angeles and 11:30 in New York
+        clock = self.clock_at(15, 30)
+        self.assertEqual(clock.today('America/Los_Angeles'), 'mon')
+        self.assertIs(clock.is_open(WorkingHour(day='mon', opening_time=time(9), closing_time=time(17)), 'America/Los_Angeles'), False)
+        self.assertIs(clock.is_open(WorkingHour(day='mon', opening_time=time(9), closing_time=time(11, 30)), 'America/New_York'), True)
+        # The earliest change wins, New York closes at 11:30:01, a second away
+        self.assertEqual(clock.seconds_valid(), 1)
+        self.assertEqual(self.clock_at(3).today('America/Los_Angeles'), 'sun')
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None)
+class OpenNowTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for title, time_zone, day, opening_time, closing_time in [
+            ('Night market', 'UTC', 'mon', time(22), time(2)),
+            ('Sunday late', 'UTC', 'sun', time(23), time(1)),
+            ('Pacific', 'America/Los_Angeles', 'mon', time(8), time(17)),
+            ('Eastern', 'America/New_York', 'mon', time(8), time(17)),
+        ]:
+            farm = Farm.objects.create(title=title, time_zone=time_zone)
+            WorkingHour.objects.create(farm=farm, day=day, opening_time=opening_time, closing_time=closing_time)
+
+    def setUp(self):
+        caches['default'].clear()
+        clear_snapshot()
+
+    def open_farms(self, moment, is_open='true'):
+        with patch('django.utils.timezone.now', return_value=moment):
+            response = self.client.get('/UPick/farms/', {'is_open': is_open}, HTTP_ACCEPT='application/json')
+        return {farm['title'] for farm in response_json(response)['results']}
+
+    def test_midnight_and_time_zones(self):
+        everyone = set(Farm.objects.values_list('title', flat=True))
+        # Monday June 5th 2023 in UTC, Los Angeles is 7 hours behind and New York 4
+        for moment, titles in [
+            (datetime(2023, 6, 4, 23, 30), {'Sunday late'}),
+            (datetime(2023, 6, 5, 0, 30), {'Sunday late'}),
+            (datetime(2023, 6, 5, 1, 30), set()),
+            (datetime(2023, 6, 5, 12, 30), {'Eastern'}),
+            (datetime(2023, 6, 5, 16, 0), {'Eastern', 'Pacific'}),
+            (datetime(2023, 6, 5, 23, 0), {'Night market', 'Pacific'}),
+            (datetime(2023, 6, 6, 1, 30), {'Night market'}),
+            (datetime(2023, 6, 6, 2, 30), set()),
+        ]:
+            moment = moment.replace(tzinfo=dt_timezone.utc)
+            for snapshot in (False, True):
+                with self.subTest(moment=moment, snapshot=snapshot), self.settings(UPICK_SNAPSHOT=snapshot):
+                    caches['default'].clear()
+                    self.assertEqual(self.open_farms(moment), titles)
+                    self.assertEqual(self.open_farms(moment, 'false'), everyone - titles)
+
+    def test_details_show_last_nights_hours_open_past_midnight(self):
+        path = f'/UPick/farms/{Farm.objects.get(title="Night market").id}/'
+        for moment, is_open in [(datetime(2023, 6, 6, 1, 30), True), (datetime(2023, 6, 6, 2, 30), False)]:
+            with self.subTest(moment=moment), patch('django.utils.timezone.now', return_value=moment.replace(tzinfo=dt_timezone.utc)):
+                caches['default'].clear()
+                hours = response_json(self.client.get(path, HTTP_ACCEPT='application/json'))['working_hours']
+                self.assertEqual([hour['is_open'] for hour in hours], [is_open])
+
+
+class ResponseCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(farm_count=3, plants_per_farm=2)
+
+    def setUp(self):
+        caches['default'].clear()
+        get_taxonomy()
+        clock = patch('django.utils.timezone.now', return_value=MORNING)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def test_farm_detail_etag_and_cache(self):
+        path = f'/UPick/farms/{Farm.objects.first().id}/'
+        response = self.client.get(path, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(path, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=response['ETag'])
+            cached = self.client.get(path, HTTP_ACCEPT='application/json')
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_missing_farms_leave_no_versions(self):
+        response = self.client.get('/UPick/farms/99999/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 404)
+        for key in ('upick:version:farm:99999', 'upick:changed:farm:99999'):
+            self.assertFalse(caches['default'].has_key(key))
+
+    def test_conditional_get_without_queries(self):
+        for path in ['/UPick/farms/', '/UPick/plants/']:
+            with self.subTest(path=path):
+                response = self.client.get(path, HTTP_ACCEPT='application/json')
+                data = response_json(response)
+                self.assertEqual(response['Last-Modified'], http_date(int(MORNING.timestamp())))
+                with self.assertNumQueries(0):
+                    by_etag = self.client.get(path, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=response['ETag'])
+                    by_date = self.client.get(path, HTTP_ACCEPT='application/json', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                    cached = self.client.get(path, HTTP_ACCEPT='application/json')
+                self.assertEqual((by_etag.status_code, by_date.status_code), (304, 304))
+                self.assertEqual(json.loads(cached.content), data)
+
+    def test_writes_change_the_validators(self):
+        farm = Farm.objects.first()
+        paths = ['/UPick/farms/', f'/UPick/farms/{farm.id}/', '/UPick/plants/']
+        etags = {path: self.client.get(path, HTTP_ACCEPT='application/json')['ETag'] for path in paths}
+        farm.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            farm.save()
+        for path in paths:
+            with self.subTest(path=path):
+                response = self.client.get(path, HTTP_ACCEPT='application/json', HTTP_IF_NONE_MATCH=etags[path])
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etags[path])
+                self.assertIn('Renamed', json.dumps(response_json(response)))
+
+    def test_unknown_farm_has_no_etag(self):
+        response = self.client.get('/UPick/farms/0/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+
+    def test_writes_invalidate_cached_responses(self):
+        farm = Farm.objects.first()
+        paths = ['/UPick/farms/', f'/UPick/farms/{farm.id}/', '/UPick/plants/']
+        for path in paths:
+            response_json(self.client.get(path, HTTP_ACCEPT='application/json'))
+        farm.title = 'Renamed'
+        hour = farm.working_hours.get(day='mon')
+        hour.closing_time = time(18)
+        with self.captureOnCommitCallbacks(execute=True):
+            farm.save()
+            hour.save()
+        for path in paths:
+            with self.subTest(path=path):
+                data = response_json(self.client.get(path, HTTP_ACCEPT='application/json'))
+                self.assertIn('Renamed', json.dumps(data))
+        detail = response_json(self.client.get(paths[1], HTTP_ACCEPT='application/json'))
+        self.assertIn('18:00:00', json.dumps(detail['working_hours']))
+
+    def test_timeout_ends_when_an_is_open_value_changes(self):
+        farm = Farm.objects.first()
+        hours = list(farm.working_hours.all())
+        for params, moment, timeout in [
+            ({}, MORNING, 60 * 60),
+            ({'is_open': 'true'}, MORNING, 60),
+            # Farms open at 08:00, 30 seconds later
+            ({}, MORNING.replace(hour=7, minute=59, second=30), 30),
+            ({'is_open': 'true'}, MORNING.replace(hour=7, minute=59, second=30), 30),
+        ]:
+            with self.subTest(params=params, moment=moment):
+                request = Request(APIRequestFactory().get('/UPick/farms/', params))
+                clock = RequestClock(moment)
+                for hour in hours:
+                    clock.is_open(hour, farm.time_zone)
+                self.assertEqual(response_cache_timeout(request, clock), timeout)
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None)
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(farm_count=3, plants_per_farm=1)
+        category = PlantCategory.objects.create(name='Berries')
+        cls.strawberry = Plant.objects.create(title='Strawberry', scientific_name='Fragaria ananassa', category=category)
+        cls.farm = Farm.objects.create(title='Strawberry Fields', description='Pick your own strawberries.')
+        Address.objects.create(
+            farm=cls.farm, street='1 Berry Ln', city='Santa Cruz', state='CA',
+            country='United States', zip_code='95060', lat=36.97, long=-122.03,
+        )
+        FarmPlants.objects.create(farm=Farm.objects.get(title='Farm 1'), plant=cls.strawberry,
+                                  season_start=date(2023, 5, 1), season_end=date(2023, 9, 30), organic=True)
+
+    def search_ids(self, path, **params):
+        response = self.client.get(path, params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return [result['id'] for result in response_json(response)['results']]
+
+    def test_farm_search_ranks_title_matches_first(self):
+        self.farm.description = None
+        self.farm.save()
+        Farm.objects.filter(title='Farm 2').update(description='Strawberries in June')
+        from .search import index_farms
+        index_farms()
+        farm_2 = Farm.objects.get(title='Farm 2').id
+        self.assertEqual(self.search_ids('/UPick/farms/', q='strawb'), [self.farm.id, farm_2])
+        self.assertEqual(self.search_ids('/UPick/farms/', q='strawberry santa'), [self.farm.id])
+        self.assertEqual(self.search_ids('/UPick/farms/', q='strawb watsonville'), [farm_2])
+
+    def test_search_combines_with_filters(self):
+        self.assertEqual(self.search_ids('/UPick/farms/', q='farm', entrance_fee_min=1), list(
+            Farm.objects.filter(entrance_fee__gte=1).order_by('id').values_list('id', flat=True)))
+
+    def test_index_follows_changes(self):
+        self.farm.title = 'Blueberry Hill'
+        self.farm.save()
+        self.assertEqual(self.search_ids('/UPick/farms/', q='strawberry fields'), [])
+        self.assertEqual(self.search_ids('/UPick/farms/', q='blueberry'), [self.farm.id])
+        self.farm.address.city = 'Aptos'
+        self.farm.address.save()
+        self.assertEqual(self.search_ids('/UPick/farms/', q='aptos'), [self.farm.id])
+        self.farm.delete()
+        self.assertFalse(SearchToken.objects.filter(kind='farm', object_id=self.farm.id).exists())
+
+    def test_plant_search(self):
+        farm_plant = FarmPlants.objects.get(plant=self.strawberry)
+        self.assertEqual(self.search_ids('/UPick/plants/', q='fragaria'), [farm_plant.id])
+        self.strawberry.category.name = 'Soft fruit'
+        self.strawberry.category.save()
+        self.assertEqual(self.search_ids('/UPick/plants/', q='soft fruit'), [farm_plant.id])
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None)
+class BatchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(farm_count=4, plants_per_farm=3)
+        cls.farm_ids = list(Farm.objects.order_by('id').values_list('id', flat=True))
+
+    def batch(self, ids, **params):
+        return self.client.get('/UPick/farms/batch/', {'ids': ids, **params}, HTTP_ACCEPT='application/json')
+
+    def test_results_match_the_details(self):
+        first, second, unknown = self.farm_ids[2], self.farm_ids[0], self.farm_ids[-1] + 1
+        data = self.batch(f'{first},{second},{unknown},{first}').json()
+        self.assertEqual(list(data['results']), [str(first), str(second)])
+        for farm_id in (first, second):
+            detail = self.client.get(f'/UPick/farms/{farm_id}/', HTTP_ACCEPT='application/json').json()
+            self.assertEqual(data['results'][str(farm_id)], detail)
+        self.assertEqual(data['missing'], [unknown])
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        # The farms, addresses, working hours, farm plants and plants with their categories
+        for count in (1, 4):
+            with self.subTest(count=count), self.assertNumQueries(5):
+                self.batch(','.join(map(str, self.farm_ids[:count])))
+
+    def test_fields(self):
+        data = self.batch(str(self.farm_ids[0]), fields='title,farm_plants.title').json()
+        self.assertEqual(data['results'][str(self.farm_ids[0])], {
+            'title': 'Farm 0', 'farm_plants': [{'title': 'Plant 0'}, {'title': 'Plant 1'}, {'title': 'Plant 2'}],
+        })
+
+    @override_settings(UPICK_BATCH_SIZE=2)
+    def test_invalid_ids(self):
+        for ids, error in [
+            ('', 'Give the farm ids to fetch, like ?ids=1,5,9.'),
+            ('1,x', 'Ids must be positive integers.'),
+            ('-1', 'Ids must be positive integers.'),
+            ('1,2,3', 'At most 2 ids per request.'),
+        ]:
+            with self.subTest(ids=ids):
+                response = self.batch(ids)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'ids': [error]})
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None)
+class SnapshotTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(farm_count=6, plants_per_farm=1)
+        Farm.objects.create(title='No address')
+        WorkingHour.objects.filter(farm__entrance_fee=2).update(closing_time=time(8, 30))
+
+    def setUp(self):
+        clear_snapshot()
+
+    def assertSameAsDatabase(self, params):
+        caches['default'].clear()
+        expected = response_json(self.client.get('/UPick/farms/', params, HTTP_ACCEPT='application/json'))
+        caches['default'].clear()
+        with self.settings(UPICK_SNAPSHOT=True):
+            response = self.client.get('/UPick/farms/', params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response_json(response), expected)
+
+    def test_filters_match_the_database(self):
+        point = {'address__lat': 36.9, 'address__long': -121.7}
+        for params in [
+            {}, {'page_size': 2, 'page': 2}, {'page': 'last', 'page_size': 4},
+            {'radius': 15, **point}, {'radius': 15, 'ordering': 'distance', **point},
+            {'ordering': 'distance', **point}, {'is_open': 'true'}, {'is_open': 'false'},
+            {'entrance_fee_min': 1, 'entrance_fee_max': 3}, {'entrance_fee_max': 0},
+            {'radius': 40, 'is_open': 'false', 'entrance_fee_min': 2, **point},
+            {'fields': 'id,title', 'radius': 40, **point},
+        ]:
+            with self.subTest(params=params):
+                self.assertSameAsDatabase(params)
+
+    @override_settings(UPICK_SNAPSHOT=True)
+    def test_page_is_the_only_farm_query(self):
+        get_snapshot()
+        caches['default'].clear()
+        get_snapshot()
+        self.client.get('/UPick/farms/', {'entrance_fee_min': 1}, HTTP_ACCEPT='application/json')
+        with self.assertNumQueries(1) as queries:
+            response_json(self.client.get('/UPick/farms/', {'entrance_fee_min': 1}, HTTP_ACCEPT='application/json'))
+        page_query = queries.captured_queries[0]['sql']
+        self.assertIn('"UPick_farmsummary"."id" IN', page_query)
+        self.assertNotIn('entrance_fee" >=', page_query)
+
+    def test_snapshot_follows_changes(self):
+        snapshot = get_snapshot()
+        farm = Farm.objects.get(title='Farm 0')
+        farm.entrance_fee = 30
+        with self.captureOnCommitCallbacks(execute=True):
+            farm.save()
+        # Requests still reading the old snapshot see it unchanged
+        synced = get_snapshot()
+        self.assertIsNot(synced, snapshot)
+        self.assertEqual(snapshot.fees[snapshot.positions[farm.id]], 0)
+        self.assertEqual(synced.fees[synced.positions[farm.id]], 30)
+        self.assertSameAsDatabase({'entrance_fee_min': 20})
+        with self.captureOnCommitCallbacks(execute=True):
+            Farm.objects.create(title='Farm 7', entrance_fee=25)
+        self.assertSameAsDatabase({'entrance_fee_min': 20})
+        with self.captureOnCommitCallbacks(execute=True):
+            Farm.objects.get(title='Farm 5').delete()
+        self.assertSameAsDatabase({})
+
+    def test_writes_without_signals_are_synced_on_interval(self):
+        snapshot = get_snapshot()
+        Farm.objects.filter(title='Farm 1').update(entrance_fee=40, last_updated=timezone.now())
+        self.assertIs(get_snapshot(), snapshot)
+        with self.settings(UPICK_SNAPSHOT_SYNC_INTERVAL=0):
+            synced = get_snapshot()
+            self.assertEqual(synced.fees[synced.positions[Farm.objects.get(title='Farm 1').id]], 40)
+            # Unchanged farms need no new snapshot
+            self.assertIs(get_snapshot(), synced)
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None)
+class FarmSummaryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(farm_count=5, plants_per_farm=2)
+        Farm.objects.create(title='No address')
+        WorkingHour.objects.filter(farm__entrance_fee=2).update(closing_time=None)
+
+    def setUp(self):
+        caches['default'].clear()
+        rebuild_farm_summaries()
+
+    def assertSameAsFarms(self, params):
+        caches['default'].clear()
+        with self.settings(UPICK_FARM_SUMMARY=False):
+            expected = response_json(self.client.get('/UPick/farms/', params, HTTP_ACCEPT='application/json'))
+        caches['default'].clear()
+        response = self.client.get('/UPick/farms/', params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response_json(response), expected)
+
+    def test_list_matches_the_farms(self):
+        point = {'address__lat': 36.9, 'address__long': -121.7}
+        for params in [
+            {}, {'page_size': 2, 'page': 'last'}, {'radius': 15, 'ordering': 'distance', **point},
+            {'is_open': 'false', 'entrance_fee_max': 3}, {'q': 'watsonville'},
+            {'fields': 'id,working_hours.is_open,address.city,distance_miles', 'ordering': 'distance', **point},
+        ]:
+            with self.subTest(params=params):
+                self.assertSameAsFarms(params)
+
+    def test_page_is_a_single_table_query(self):
+        # The count and the page
+        with self.assertNumQueries(2) as queries:
+            response_json(self.client.get('/UPick/farms/', HTTP_ACCEPT='application/json'))
+        self.assertNotIn('JOIN', queries.captured_queries[1]['sql'])
+
+    def test_plant_and_category_filters(self):
+        category = PlantCategory.objects.create(name='Vitaceae')
+        grape = Plant.objects.create(title='Grape', scientific_name='Vitis vinifera', category=category)
+        for title in ['Farm 1', 'Farm 3']:
+            FarmPlants.objects.create(farm=Farm.objects.get(title=title), plant=grape, season_start=date(2023, 8, 1),
+                                      season_end=date(2023, 10, 31), organic=False)
+        for params, titles in [
+            ({'plant': grape.id}, ['Farm 1', 'Farm 3']),
+            ({'category': category.id}, ['Farm 1', 'Farm 3']),
+            ({'plant': grape.id, 'entrance_fee_min': 2}, ['Farm 3']),
+            ({'category': category.id, 'q': 'farm'}, ['Farm 1', 'Farm 3']),
+        ]:
+            with self.subTest(params=params):
+                self.assertSameAsFarms(params)
+                caches['default'].clear()
+                with self.settings(UPICK_SNAPSHOT=True):
+                    results = response_json(self.client.get('/UPick/farms/', params, HTTP_ACCEPT='application/json'))['results']
+                self.assertEqual([farm['title'] for farm in results], titles)
+        response = self.client.get('/UPick/farms/', {'plant': '1.5'}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_signals_keep_summaries_current(self):
+        farm = Farm.objects.get(title='Farm 1')
+        farm.working_hours.filter(day='mon').update(opening_time=time(9))
+        farm.working_hours.first().save()
+        farm.address.city = 'Aptos'
+        farm.address.save()
+        farm.plants.first().delete()
+        plant = Plant.objects.first()
+        plant.category = PlantCategory.objects.create(name='Ericaceae')
+        plant.save()
+        self.assertEqual(stale_farm_summaries(), [])
+        summary = FarmSummary.objects.get(id=farm.id)
+        self.assertEqual(summary.city, 'Aptos')
+        self.assertEqual(weekly_hours(summary.weekly_hours)[0], ('mon', time(9), time(17)))
+        self.assertEqual(len(decode_ids(summary.plant_ids)), 1)
+        Farm.objects.get(title='Farm 0').delete()
+        self.assertEqual(stale_farm_summaries(), [])
+        self.assertSameAsFarms({})
+
+    def test_rebuild_command(self):
+        farm = Farm.objects.get(title='Farm 3')
+        FarmSummary.objects.filter(id=farm.id).update(entrance_fee=99)
+        with self.assertRaisesMessage(CommandError, f'1 farm summaries differ from their farms: {farm.id}'):
+            call_command('rebuild_farm_summaries', '--verify-only', stdout=io.StringIO())
+        call_command('rebuild_farm_summaries', stdout=io.StringIO())
+        self.assertEqual(FarmSummary.objects.get(id=farm.id).entrance_fee, 3)
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None)
+class AsyncViewTests(TransactionTestCase):
+    # The count runs on its own connection, which only sees committed rows
+
+    def setUp(self):
+        create_catalog(farm_count=5, plants_per_farm=4)
+        caches['default'].clear()
+
+    def assertSameResponse(self, path, params, view, *args):
+        caches['default'].clear()
+        expected = self.client.get(path, params, HTTP_ACCEPT='application/json')
+        caches['default'].clear()
+        response = async_to_sync(view)(AsyncRequestFactory().get(path, params), *args)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, b''.join(expected.streaming_content) if expected.streaming else expected.content)
+
+    def test_farm_list(self):
+        self.assertSameResponse('/UPick/farms/', {'page_size': 2, 'page': 2}, async_views.farm_list)
+        self.assertSameResponse('/UPick/farms/', {'page': 'last', 'page_size': 2}, async_views.farm_list)
+        self.assertSameResponse('/UPick/farms/', {'page': 9}, async_views.farm_list)
+
+    def test_farm_filters(self):
+        self.assertSameResponse('/UPick/farms/', {
+            'radius': 20, 'address__lat': 36.9, 'address__long': -121.7, 'ordering': 'distance',
+            'is_open': 'false', 'entrance_fee_max': 3,
+        }, async_views.farm_list)
+        self.assertSameResponse('/UPick/farms/', {'radius': 20}, async_views.farm_list)
+        self.assertSameResponse('/UPick/farms/', {'q': 'farm watsonville', 'entrance_fee_max': 3}, async_views.farm_list)
+
+    def test_plant_list(self):
+        plant = Plant.objects.first()
+        self.assertSameResponse('/UPick/plants/', {'plant': plant.id, 'in_season': '2024-06-01'}, async_views.plant_list)
+        self.assertSameResponse('/UPick/plants/', {'plant': 0}, async_views.plant_list)
+        self.assertSameResponse('/UPick/plants/', {'q': 'plant rosaceae'}, async_views.plant_list)
+
+    def test_cursor_pages_are_rejected(self):
+        for view in (async_views.farm_list, async_views.plant_list):
+            with self.subTest(view=view.__name__):
+                response = async_to_sync(view)(AsyncRequestFactory().get('/UPick/farms/', {'cursor': ''}))
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('cursor', json.loads(response.content))
+
+    def test_details(self):
+        farm_plant = FarmPlants.objects.first()
+        self.assertSameResponse(f'/UPick/farms/{farm_plant.farm_id}/', {}, async_views.farm_detail, farm_plant.farm_id)
+        self.assertSameResponse('/UPick/farms/0/', {}, async_views.farm_detail, 0)
+        self.assertSameResponse(f'/UPick/plants/{farm_plant.id}/', {}, async_views.plant_detail, farm_plant.id)
+
+    def test_fieldsets(self):
+        farm = Farm.objects.first()
+        self.assertSameResponse('/UPick/farms/', {'fields': 'id,title,address.geo_location', 'expand': 'farm_plants'}, async_views.farm_list)
+        self.assertSameResponse('/UPick/farms/', {'fields': 'title,farm_plants', 'expand': 'farm_plants'}, async_views.farm_list)
+        self.assertSameResponse('/UPick/farms/', {'fields': 'nope'}, async_views.farm_list)
+        self.assertSameResponse(f'/UPick/farms/{farm.id}/', {'fields': 'id,working_hours.is_open'}, async_views.farm_detail, farm.id)
+
+
+class BenchmarkComparisonTests(SimpleTestCase):
+
+    def setUp(self):
+        with open(Path(__file__).parent / 'benchmark-baseline.json', encoding='utf-8') as baseline_file:
+            self.baseline = json.load(baseline_file)
+
+    def results(self, **changes):
+        # The stored baseline with some scenarios of the 1000 farm scale changed
+        results = json.loads(json.dumps(self.baseline))
+        for name, change in changes.items():
+            results['scales']['1000'][name].update(change)
+        return results
+
+    def test_the_baseline_matches_itself(self):
+        self.assertEqual(compare(self.baseline, self.baseline), [])
+
+    def test_slower_medians_and_more_queries_regress(self):
+        farms = self.baseline['scales']['1000']['farms']
+        regressions = compare(self.results(
+            farms={'p50_ms': farms['p50_ms'] * 2 + 5},
+            farm_detail={'queries': self.baseline['scales']['1000']['farm_detail']['queries'] + 1},
+        ), self.baseline)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('1000 farms, farms: p50'))
+        self.assertIn('farm_detail', regressions[1])
+
+    def test_noise_and_new_scenarios_pass(self):
+        farms = self.baseline['scales']['1000']['farms']
+        results = self.results(farms={'p50_ms': farms['p50_ms'] + 1.5})
+        results['scales']['1000']['new_scenario'] = dict(farms)
+        results['scales']['500'] = {'farms': dict(farms)}
+        self.assertEqual(compare(results, self.baseline), [])
+
+
+@override_settings(UPICK_RESPONSE_CACHE=None, UPICK_METRICS_SAMPLE_RATE=0)
+class RequestMetricsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog(farm_count=2)
+
+    def server_timing(self, response):
+        # The Server-Timing entries as {name: (duration, description)}
+        timings = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, *params = entry.split(';')
+            params = dict(param.split('=', 1) for param in params)
+            timings[name] = float(params['dur']), params.get('desc', '').strip('"')
+        return timings
+
+    @override_settings(UPICK_STREAM_LISTS=False)
+    def test_server_timing_reports_queries(self):
+        caches['default'].clear()
+        get_taxonomy()
+        with self.assertNumQueries(3):
+            response = self.client.get('/UPick/plants/', HTTP_ACCEPT='application/json')
+        timings = self.server_timing(response)
+        self.assertEqual(timings['db'][1], '3 queries')
+        self.assertEqual(set(timings), {'db', 'serialize', 'total'})
+
+    def test_server_timing_reports_serializer_time(self):
+        to_representation = FarmDetailSerializer.to_representation
+
+        def slow_representation(serializer, instance):
+            sleep(0.02)
+            return to_representation(serializer, instance)
+
+        with patch.object(FarmDetailSerializer, 'to_representation', slow_representation):
+            response = self.client.get(f'/UPick/farms/{Farm.objects.first().id}/', HTTP_ACCEPT='application/json')
+        timings = self.server_timing(response)
+        self.assertGreaterEqual(timings['serialize'][0], 20)
+        self.assertGreaterEqual(timings['total'][0], timings['serialize'][0] + timings['db'][0])
+
+    def test_streamed_lists_only_time_the_queries_before_the_body(self):
+        caches['default'].clear()
+        get_taxonomy()
+        with self.assertLogs('UPick.metrics', level='INFO') as logs, self.settings(UPICK_METRICS_SAMPLE_RATE=1):
+            response = self.client.get('/UPick/plants/', HTTP_ACCEPT='application/json')
+            b''.join(response.streaming_content)
+        self.assertEqual(self.server_timing(response), {'db': (ANY, '3 queries before the body')})
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(line['queries'], 3)
+        self.assertIn('serialize_ms', line)
+
+    @override_settings(UPICK_SLOW_QUERY_MS=0)
+    def test_slow_queries_are_logged_with_sql(self):
+        with self.assertLogs('UPick.metrics', level='WARNING') as logs:
+            self.client.get(f'/UPick/farms/{Farm.objects.first().id}/', HTTP_ACCEPT='application/json')
+        self.assertIn('SELECT', logs.output[0])
+
+
+# Replica aliases of the test settings, see UPickFront/test_settings.py
+REPLICAS = [alias for alias in settings.DATABASES if alias != 'default']
+
+
+@skipUnless(connection.vendor == 'sqlite' and len(REPLICAS) >= 2, 'Needs the SQLite replicas of UPickFront.test_settings')
+@override_settings(UPICK_RESPONSE_CACHE=None, UPICK_READ_REPLICAS=REPLICAS[:2])
+class ReadReplicaTests(TransactionTestCase):
+    # Copies of the test database stand in for replicated ones
+    databases = {'default', *REPLICAS[:2]}
+
+    def setUp(self):
+        create_catalog(farm_count=3, plants_per_farm=1)
+        self.replicate()
+        reset_health()
+        caches['default'].clear()
+
+    def replicate(self):
+        connection.ensure_connection()
+        for alias in REPLICAS[:2]:
+            connections[alias].ensure_connection()
+            connection.connection.backup(connections[alias].connection)
+
+    def get_farms(self):
+        # Clearing the cache also ends the UPICK_REPLICA_LAG window of the last write
+        caches['default'].clear()
+        return self.list_farms()
+
+    def list_farms(self):
+        return response_json(self.client.get('/UPick/farms/', HTTP_ACCEPT='application/json'))
+
+    def test_reads_go_to_the_replicas_in_turn(self):
+        with CaptureQueriesContext(connection) as primary, \
+                CaptureQueriesContext(connections[REPLICAS[0]]) as first, \
+                CaptureQueriesContext(connections[REPLICAS[1]]) as second:
+            results = self.get_farms()['results']
+            self.assertEqual(self.get_farms()['results'], results)
+        self.assertEqual(len(primary), 0)
+        self.assertTrue(first and second)
+        with self.settings(UPICK_READ_REPLICAS=[]):
+            self.assertEqual(self.get_farms()['results'], results)
+
+        # Writes go to default, the replicas only see them once replicated
+        farm = Farm.objects.get(title='Farm 0')
+        farm.title = 'Renamed'
+        farm.save()
+        self.assertEqual(self.get_farms()['results'][0]['title'], 'Farm 0')
+        self.replicate()
+        self.assertEqual(self.get_farms()['results'][0]['title'], 'Renamed')
+
+    @override_settings(UPICK_RESPONSE_CACHE='default')
+    def test_stale_replicas_are_not_cached_after_writes(self):
+        self.assertEqual(self.list_farms()['results'][0]['title'], 'Farm 0')
+        farm = Farm.objects.get(title='Farm 0')
+        farm.title = 'Renamed'
+        farm.save()
+        # The replicas don't have the write yet, reads right after it stay on default
+        with CaptureQueriesContext(connections[REPLICAS[0]]) as first, \
+                CaptureQueriesContext(connections[REPLICAS[1]]) as second:
+            self.assertEqual(self.list_farms()['results'][0]['title'], 'Renamed')
+            detail = self.client.get(f'/UPick/farms/{farm.id}/', HTTP_ACCEPT='application/json').json()
+        self.assertEqual((len(first), len(second)), (0, 0))
+        self.assertEqual(detail['title'], 'Renamed')
+        # What was cached under the new versions stays right once the replicas are used again
+        caches['default'].delete('upick:recent_write')
+        self.assertEqual(self.list_farms()['results'][0]['title'], 'Renamed')
+        self.assertEqual(self.client.get(f'/UPick/farms/{farm.id}/', HTTP_ACCEPT='application/json').json(), detail)
+
+    def test_streamed_bodies_read_from_the_replica(self):
+        with CaptureQueriesContext(connection) as primary, \
+                CaptureQueriesContext(connections[REPLICAS[0]]) as first, \
+                CaptureQueriesContext(connections[REPLICAS[1]]) as second:
+            response = self.client.get('/UPick/farms/export/')
+            rows = b''.join(response.streaming_content).splitlines()
+            self.assertEqual(self.get_farms(), self.list_farms())
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(len(primary), 0)
+        self.assertTrue(first and second)
+
+    def test_failed_health_check(self):
+        down, up = REPLICAS[:2]
+        # Point the first replica at a directory that doesn't exist
+        settings_dict = connections[down].settings_dict
+        name = settings_dict['NAME']
+        connections[down].close()
+        settings_dict['NAME'] = os.path.join(tempfile.gettempdir(), 'upick-missing', 'replica.sqlite3')
+        try:
+            with CaptureQueriesContext(connections[up]) as replica:
+                self.get_farms()
+                self.get_farms()
+            # One health check, then the count and the page twice
+            self.assertEqual(len(replica), 5)
+            self.assertFalse(is_healthy(down))
+            with self.settings(UPICK_READ_REPLICAS=[down]):
+                with CaptureQueriesContext(connection) as primary:
+                    self.assertEqual(len(self.get_farms()['results']), 3)
+                self.assertTrue(primary)
+        finally:
+            connections[down].close()
+            settings_dict['NAME'] = name
+
+    def test_failed_query_falls_back_to_default(self):
+        replica = REPLICAS[0]
+        with connections[replica].cursor() as cursor:
+            cursor.execute('DROP TABLE "UPick_farmsummary"')
+        with self.settings(UPICK_READ_REPLICAS=[replica]):
+            self.assertEqual(len(self.get_farms()['results']), 3)
+            self.assertFalse(is_healthy(replica))
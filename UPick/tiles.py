@@ -0,0 +1,84 @@
+import math
+from django.conf import settings
+from django.db.models import Avg, Count, F, Value
+from django.db.models.functions import Floor
+from .geo import covering_box, geohash_q
+from .models import Address
+
+# Map tiles for the farm map. A tile is the usual web map z/x/y square (Web Mercator,
+# as used by Leaflet, Mapbox and OpenStreetMap). Below UPICK_TILE_PIN_ZOOM the farms of
+# a tile are grouped on a UPICK_TILE_GRID x UPICK_TILE_GRID grid and returned as
+# clusters with a count and centroid, from that zoom on every farm is a small pin.
+
+MAX_ZOOM = 22
+
+
+def tile_bounds(zoom, x, y):
+    """
+    Returns the (west, south, east, north) of a tile in degrees, or None when the
+    tile does not exist at that zoom.
+    """
+    if not 0 <= zoom <= MAX_ZOOM:
+        return None
+    tiles = 1 << zoom
+    if not (0 <= x < tiles and 0 <= y < tiles):
+        return None
+    west = x / tiles * 360.0 - 180.0
+    east = (x + 1) / tiles * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / tiles))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / tiles))))
+    return west, south, east, north
+
+
+def tile_addresses(farms, bounds):
+    # Addresses of the farms queryset inside the tile, the tile edges belong to one tile only
+    west, south, east, north = bounds
+    return Address.objects.filter(
+        geohash_q('geohash', covering_box(south, north, [(west, east)])),
+        lat__gte=south, lat__lt=north, long__gte=west, long__lt=east,
+        farm_id__in=farms.order_by().values('id'),
+    )
+
+
+def tile_clusters(addresses, bounds, grid):
+    west, south, east, north = bounds
+    height = (north - south) / grid
+    width = (east - west) / grid
+    cells = addresses.annotate(
+        row=Floor((F('lat') - Value(south)) / Value(height)),
+        column=Floor((F('long') - Value(west)) / Value(width)),
+    ).values('row', 'column').annotate(
+        farms=Count('id'), centroid_lat=Avg('lat'), centroid_long=Avg('long'),
+    ).order_by('row', 'column')
+    return [
+        {'count': cell['farms'], 'geo_location': {'lat': cell['centroid_lat'], 'long': cell['centroid_long']}}
+        for cell in cells
+    ]
+
+
+def tile_pins(addresses):
+    return [
+        {'id': farm_id, 'title': title, 'geo_location': {'lat': lat, 'long': long}}
+        for farm_id, title, lat, long in addresses.values_list(
+            'farm_id', 'farm__title', 'lat', 'long').order_by('farm_id')
+    ]
+
+
+def farm_tile(farms, zoom, x, y):
+    """
+    Returns the map tile of the farms queryset as {'zoom', 'x', 'y', 'bbox', 'clusters',
+    'pins'}, or None for a tile outside the map. One of clusters and pins is empty.
+    """
+    bounds = tile_bounds(zoom, x, y)
+    if bounds is None:
+        return None
+    addresses = tile_addresses(farms, bounds)
+    pins = zoom >= settings.UPICK_TILE_PIN_ZOOM
+    return {
+        'zoom': zoom,
+        'x': x,
+        'y': y,
+        'bbox': list(bounds),
+        'clusters': [] if pins else tile_clusters(addresses, bounds, settings.UPICK_TILE_GRID),
+        'pins': tile_pins(addresses) if pins else [],
+    }
@@ -1,5 +1,6 @@
+from django.conf import settings
 from django.urls import path , include
-from . import views
+from . import async_views, views
 from rest_framework_nested import routers
 
 router = routers.DefaultRouter()
@@ -8,4 +9,13 @@ router.register('plants', views.PlantViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
-]
\ No newline at end of file
+]
+
+if settings.UPICK_ASYNC_VIEWS:
+    # Serve the list and detail reads from the async views, ahead of the viewset routes
+    urlpatterns[:0] = [
+        path('farms/', async_views.farm_list, name='async-farm-list'),
+        path('farms/<int:pk>/', async_views.farm_detail, name='async-farm-detail'),
+        path('plants/', async_views.plant_list, name='async-plant-list'),
+        path('plants/<int:pk>/', async_views.plant_detail, name='async-plant-detail'),
+    ]
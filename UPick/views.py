@@ -1,84 +1,345 @@
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 from django_filters import rest_framework as filters
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Farm, FarmPlants
-from .serializers import FarmListSerializer, FarmDetailSerializer, PlantFarmsSerializer
-from .filters import FarmFilter
+from django_filters.utils import translate_validation
+from django.db import DatabaseError
+from django.db.models import Prefetch
+from .models import Farm, FarmPlants, FarmSummary, WorkingHour
+from django.conf import settings
+from .serializers import (
+    FarmListSerializer, FarmDetailSerializer, PlantFarmsSerializer,
+    FastFarmListSerializer, FastFarmSummarySerializer, FastPlantFarmsSerializer,
+)
+from .caching import (
+    count_cache_entry, get_cache, get_response_cache, get_versions, response_cache_key, response_cache_timeout,
+)
+from .conditional import conditional_validators
+from .fieldsets import farm_columns, farm_lookups, requested_expansions, requested_fields, summary_columns
+from .filters import FarmFilter, FarmSummaryFilter, PlantFilter
+from .metrics import serializer_timer
+from .snapshot import SnapshotResult, get_snapshot
+from .streaming import stream_list, stream_ndjson
+from .taxonomy import facet_counts
+from .tiles import farm_tile
+from .pagination import UPickCursorPagination, UPickPagination
+from .routers import choose_replica, mark_down, replica_reads, replica_stream
+from .schedule import get_request_clock
 
-class UPickPagination(PageNumberPagination):
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
+class RequestClockMixin:
+    # Reads the clock once per request for the is_open filter and every working-hours row
 
-class FarmViewSet(ModelViewSet):
-    http_method_names = ['get']
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['clock'] = get_request_clock(self.request)
+        return context
+
+
+class ReplicaReadMixin:
+    """
+    Runs the reads of a request on a healthy read replica, see UPick.routers, streamed
+    bodies included. When a query on the replica fails, the replica is left out and
+    default answers the request.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        alias = choose_replica()
+        if alias is None:
+            return super().dispatch(request, *args, **kwargs)
+        try:
+            with replica_reads(alias):
+                response = super().dispatch(request, *args, **kwargs)
+        except DatabaseError:
+            mark_down(alias)
+            return super().dispatch(request, *args, **kwargs)
+        if response.streaming:
+            response.streaming_content = replica_stream(alias, response.streaming_content)
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Sets ETag and Last-Modified from the cache versions returned by get_cache_versions(),
+    see ResponseCacheMixin, and answers 304 Not Modified before the response cache is
+    read or anything is queried.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        versions, changed_at = get_versions(self.get_cache_versions())
+        etag, last_modified = conditional_validators(request, versions, changed_at, get_request_clock(request).now)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class ResponseCacheMixin:
+    """
+    Serves rendered JSON from the response cache. Keys embed the cache versions
+    returned by get_cache_versions(), which the model signals bump on every change.
+    """
+
+    def get_cache_versions(self):
+        return ['catalog']
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        cache = get_response_cache()
+        if cache is None or request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+
+        key = response_cache_key(request, self.basename, self.get_cache_versions())
+        cached = cache.get(key)
+        if cached is not None:
+            content_type, content = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            timeout = response_cache_timeout(request, get_request_clock(request))
+            if timeout > 0 and response.streaming:
+                response.streaming_content = self.cache_stream(
+                    response.streaming_content, cache, key, response['Content-Type'], timeout)
+            elif timeout > 0:
+                response.add_post_render_callback(
+                    lambda rendered: cache.set(key, (rendered['Content-Type'], rendered.content), timeout))
+        return response
+
+    def cache_stream(self, streaming_content, cache, key, content_type, timeout):
+        # Streamed list pages are cached once the last chunk has been sent
+        chunks = []
+        for chunk in streaming_content:
+            chunks.append(chunk)
+            yield chunk
+        cache.set(key, (content_type, b''.join(chunks)), timeout)
+
+
+class UPickListMixin:
+    """
+    Page number pagination by default, keyset pagination when the request carries a cursor.
+    JSON pages are streamed one result at a time when UPICK_STREAM_LISTS is set, and the
+    export action streams every row matching the filters as NDJSON.
+    """
     pagination_class = UPickPagination
-    filter_backends = [DjangoFilterBackend]
-    filterset_class = FarmFilter
+    cursor_pagination_class = UPickCursorPagination
 
-    def get_queryset(self):
-        if self.action == 'list':
-            # Adjust the queryset for the list view
-            return Farm.objects.prefetch_related('working_hours', 'address').all()
-        elif self.action == 'retrieve':
-            # Adjust the queryset for the detail view
-            return Farm.objects.prefetch_related(
-                'address',
-                'working_hours',
-                'plants__plant',
-                'plants__plant__category'
-            )
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.cursor_pagination_class.cursor_query_param in self.request.query_params:
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
-    def get_serializer_class(self):
-        if self.action == 'list':
-            return FarmListSerializer
-        elif self.action == 'retrieve':
-            return FarmDetailSerializer
-    
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
         page = self.paginate_queryset(queryset)
         serializer = self.get_serializer(page, many=True)
-        results_count = self.paginator.page.paginator.count if page is not None else 0
-        results_per_page = len(serializer.data) if page is not None else 0
-        info = {
-            'count': results_count,
-            'next': self.paginator.get_next_link(),
-            'previous': self.paginator.get_previous_link(),
-            'results_per_page': results_per_page
-        }
+        if settings.UPICK_STREAM_LISTS and request.accepted_renderer.format == 'json':
+            return stream_list(request, self.paginator.get_info(len(page)), serializer, page)
+        with serializer_timer(request):
+            results = serializer.data
         response_data = {
-            'info': info,
-            'results': serializer.data
+            'info': self.paginator.get_info(len(results)),
+            'results': results
         }
         return Response(response_data)
 
+    def retrieve(self, request, *args, **kwargs):
+        # Below the conditional GET and response cache mixins, which wrap it
+        serializer = self.get_serializer(self.get_object())
+        with serializer_timer(request):
+            data = serializer.data
+        return Response(data)
+
+    @action(detail=False)
+    def export(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return stream_ndjson(request, queryset, self.get_serializer(), settings.UPICK_EXPORT_CHUNK_SIZE)
 
-class PlantViewSet(ModelViewSet):
-    pagination_class = UPickPagination
 
+class FarmViewSet(ReplicaReadMixin, ConditionalGetMixin, ResponseCacheMixin, RequestClockMixin, UPickListMixin, ModelViewSet):
     http_method_names = ['get']
-    queryset = FarmPlants.objects.prefetch_related('plant', 'plant__category','farm','farm__working_hours', 'farm__address').all()
+    filter_backends = [DjangoFilterBackend]
+
+    @property
+    def filterset_class(self):
+        return FarmSummaryFilter if self.uses_summary() else FarmFilter
+
+    def uses_summary(self):
+        # List pages come from the FarmSummary table unless they embed the farm plants
+        return (settings.UPICK_FARM_SUMMARY and settings.UPICK_FAST_SERIALIZERS and self.action == 'list'
+                and 'farm_plants' not in self.get_fieldset()[1])
+
+    def get_cache_versions(self):
+        if self.action == 'retrieve':
+            return [f'farm:{self.kwargs["pk"]}', 'taxonomy']
+        return ['catalog']
+
+    def get_fieldset(self):
+        # The ?fields= selection and ?expand= relations, parsed once per request
+        if not hasattr(self, '_fieldset'):
+            self._fieldset = requested_fields(self.request), requested_expansions(self.request)
+        return self._fieldset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'], context['expand'] = self.get_fieldset()
+        return context
+
+    def get_queryset(self):
+        fields, expand = self.get_fieldset()
+        if self.uses_summary():
+            # One row per farm with the address and weekly hours, nothing to prefetch
+            queryset = FarmSummary.objects.order_by('id')
+            if fields is not None:
+                queryset = queryset.only(*summary_columns(fields))
+            return queryset
+        elif self.action == 'list':
+            # Adjust the queryset for the list view
+            queryset = Farm.objects.order_by('id')
+            today = get_request_clock(self.request).days_today()
+            if self.get_serializer_class() is FastFarmListSerializer:
+                # Only the fast serializer builds nothing but the selected fields
+                if fields is not None:
+                    queryset = queryset.only(*farm_columns(fields))
+                return queryset.prefetch_related(*farm_lookups(fields, expand, today=today))
+            return queryset.prefetch_related(*farm_lookups(None, expand, today=today))
+        elif self.action in ('retrieve', 'export', 'batch'):
+            # Adjust the queryset for the detail view
+            queryset = Farm.objects.all()
+            if fields is not None:
+                queryset = queryset.only(*farm_columns(fields))
+            return queryset.prefetch_related(*farm_lookups(fields, detail=True))
+        return Farm.objects.all()
+
+    def filter_queryset(self, queryset):
+        # List pages are filtered in the in-process snapshot when it is enabled, keyword
+        # searches, plant and category filters and keyset pages need the database
+        if (settings.UPICK_SNAPSHOT and self.action == 'list'
+                and not isinstance(self.paginator, self.cursor_pagination_class)):
+            filterset = self.filterset_class(self.request.query_params, queryset=queryset, request=self.request)
+            if not filterset.is_valid():
+                raise translate_validation(filterset.errors)
+            data = filterset.form.cleaned_data
+            if not data.get('q') and data.get('plant') is None and data.get('category') is None:
+                return SnapshotResult(get_snapshot(), filterset, queryset, get_request_clock(self.request).now)
+        return super().filter_queryset(queryset)
+
+    @action(detail=False)
+    def batch(self, request, *args, **kwargs):
+        """
+        Farm details of several farms, ?ids=1,5,9, keyed by id and fetched with the same
+        queries as a single farm. Ids without a farm are listed in missing.
+        """
+        ids = self.get_batch_ids()
+        farms = self.get_queryset().filter(id__in=ids).in_bulk()
+        found = [farm_id for farm_id in ids if farm_id in farms]
+        serializer = self.get_serializer([farms[farm_id] for farm_id in found], many=True)
+        with serializer_timer(request):
+            results = serializer.data
+        return Response({
+            'results': dict(zip(found, results)),
+            'missing': [farm_id for farm_id in ids if farm_id not in farms],
+        })
+
+    def get_batch_ids(self):
+        # The ?ids= of a batch in the order given, without repeats
+        values = ','.join(self.request.query_params.getlist('ids'))
+        try:
+            ids = list(dict.fromkeys(int(value) for value in values.split(',') if value.strip()))
+        except ValueError:
+            ids = None
+        if ids is None or not all(0 < farm_id < 2 ** 63 for farm_id in ids):
+            raise ValidationError({'ids': ['Ids must be positive integers.']})
+        if not ids:
+            raise ValidationError({'ids': ['Give the farm ids to fetch, like ?ids=1,5,9.']})
+        if len(ids) > settings.UPICK_BATCH_SIZE:
+            raise ValidationError({'ids': [f'At most {settings.UPICK_BATCH_SIZE} ids per request.']})
+        return ids
+
+    @action(detail=False)
+    def facets(self, request, *args, **kwargs):
+        """
+        Farms per plant category and per plant among the farms matching the list
+        filters, cached like the list counts.
+        """
+        cache = get_cache()
+        cache_key, cache_timeout = count_cache_entry(request, 'farm-facets')
+        facets = cache.get(cache_key)
+        if facets is None:
+            facets = facet_counts(self.filter_queryset(Farm.objects.all()))
+            cache.set(cache_key, facets, timeout=cache_timeout)
+        return Response(facets)
+
+    @action(detail=False, url_path=r'tiles/(?P<zoom>\d{1,2})/(?P<x>\d{1,7})/(?P<y>\d{1,7})')
+    def tiles(self, request, zoom, x, y, *args, **kwargs):
+        """
+        Farm clusters or pins of one map tile among the farms matching the list
+        filters, see UPick.tiles. Tiles are cached like the list counts.
+        """
+        cache = get_cache()
+        cache_key, cache_timeout = count_cache_entry(request, f'farm-tile:{zoom}:{x}:{y}')
+        tile = cache.get(cache_key)
+        if tile is None:
+            tile = farm_tile(self.filter_queryset(Farm.objects.all()), int(zoom), int(x), int(y))
+            if tile is None:
+                raise NotFound('Invalid tile.')
+            cache.set(cache_key, tile, timeout=cache_timeout)
+        response = Response(tile)
+        patch_cache_control(response, public=True, max_age=min(cache_timeout, settings.UPICK_TILE_MAX_AGE))
+        return response
+
+    def get_serializer_class(self):
+        if self.uses_summary():
+            return FastFarmSummarySerializer
+        elif self.action == 'list':
+            if settings.UPICK_FAST_SERIALIZERS:
+                return FastFarmListSerializer
+            return FarmListSerializer
+        elif self.action in ('retrieve', 'export', 'batch'):
+            return FarmDetailSerializer
+
+
+class PlantViewSet(ReplicaReadMixin, ConditionalGetMixin, ResponseCacheMixin, RequestClockMixin, UPickListMixin, ModelViewSet):
+    http_method_names = ['get']
+    # Forward relations are joined, today's working hours are prefetched once per page.
+    # The fast serializer reads plants and categories from the in-process taxonomy.
+    queryset = FarmPlants.objects.select_related('farm__address').order_by('id')
     serializer_class = PlantFarmsSerializer
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['plant__category', 'farm', 'plant']
+    filterset_class = PlantFilter
 
-    def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        page = self.paginate_queryset(queryset)
-        serializer = self.get_serializer(page, many=True)
-        results_count = self.paginator.page.paginator.count if page is not None else 0
-        results_per_page = len(serializer.data) if page is not None else 0
-        info = {
-            'count': results_count,
-            'next': self.paginator.get_next_link(),
-            'previous': self.paginator.get_previous_link(),
-            'results_per_page': results_per_page
-        }
-        response_data = {
-            'info': info,
-            'results': serializer.data
-        }
-        return Response(response_data)
\ No newline at end of file
+    def get_queryset(self):
+        today = get_request_clock(self.request).days_today()
+        queryset = super().get_queryset().prefetch_related(
+            Prefetch('farm__working_hours', queryset=WorkingHour.objects.filter(day__in=today))
+        )
+        if self.get_serializer_class() is not FastPlantFarmsSerializer:
+            queryset = queryset.select_related('plant__category')
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'export') and settings.UPICK_FAST_SERIALIZERS:
+            return FastPlantFarmsSerializer
+        return super().get_serializer_class()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,7 +40,6 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'django_filters',
     'rest_framework',
-    'debug_toolbar',
     'core',
     'UPick',
     
@@ -53,7 +53,7 @@ INTERNAL_IPS = [
 
 
 MIDDLEWARE = [
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'UPick.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +63,15 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# The debug toolbar is for development only, RequestMetricsMiddleware reports
+# query counts and timings in every environment. The toolbar goes inside it, as
+# it rewrites the Server-Timing header of the responses it wraps
+DEBUG_TOOLBAR = DEBUG
+
+if DEBUG_TOOLBAR:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.insert(1, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'UPickFront.urls'
 
 TEMPLATES = [
@@ -94,9 +103,16 @@ DATABASES = {
         'HOST': 'localhost',
         'USER': 'root',
         'PASSWORD': '2155@Abdo',
+        # Keep connections open between requests, each thread reuses its own after a
+        # health check, instead of connecting on every request
+        'CONN_MAX_AGE': 10 * 60,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Reads of FarmViewSet and PlantViewSet go to the replicas in UPICK_READ_REPLICAS
+DATABASE_ROUTERS = ['UPick.routers.ReadReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -134,6 +150,25 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# The UPick caches and the versions the model signals bump to invalidate them have to
+# be shared by every worker, or the others keep serving what was cached before a change.
+# The file cache below is for development only, it is shared by the workers of one host
+# and slows down as it fills. Deployments point default at memcached or redis, reached
+# by every host, e.g. (with the redis package installed)
+#     'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#     'LOCATION': 'redis://cache-host:6379/1',
+# and manage.py check --deploy warns while the UPick caches are per host.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'upick-cache',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -141,3 +176,107 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'core.User'
 
+# UPick API
+
+# Build list responses with the hand-written serializers in UPick.serializers,
+# set to False to compare against the DRF ModelSerializer output
+UPICK_FAST_SERIALIZERS = True
+
+# Cache alias used for list counts and cache versions
+UPICK_CACHE = 'default'
+
+# Seconds a list count is cached
+UPICK_COUNT_TIMEOUT = 60 * 60
+
+# Cache alias for rendered farm and plant responses, None disables the response cache.
+# Like UPICK_CACHE it has to be shared by all workers
+UPICK_RESPONSE_CACHE = 'default'
+
+# Seconds a rendered response is cached at most, entries expire earlier when
+# an is_open value they contain is about to change
+UPICK_RESPONSE_CACHE_TIMEOUT = 60 * 60
+
+# Seconds counts and responses filtered on is_open are cached, the set of
+# open farms changes whenever any farm opens or closes
+UPICK_OPEN_FILTER_TIMEOUT = 60
+
+# ETag and Last-Modified of farm and plant responses move forward every this many
+# seconds so that clients pick up is_open changes
+UPICK_ETAG_TIME_BUCKET = 60
+
+# Stream JSON list pages one result at a time instead of rendering the whole page
+UPICK_STREAM_LISTS = True
+
+# Rows fetched per query by the NDJSON exports at /UPick/farms/export/ and /UPick/plants/export/
+UPICK_EXPORT_CHUNK_SIZE = 500
+
+# Serve farm and plant list and detail requests from the native async views in
+# UPick.async_views, for ASGI deployments (see UPickFront/asgi.py). They skip
+# conditional GET, the response cache and the read replicas, and reject ?cursor=
+UPICK_ASYNC_VIEWS = False
+
+# Filter the farm list in an in-process copy of the farm locations, fees and opening
+# hours (UPick.snapshot) and only query the database for the rows of the page
+UPICK_SNAPSHOT = False
+
+# Seconds between checks of the snapshot against the farms table, which also catch
+# writes made without the model signals
+UPICK_SNAPSHOT_SYNC_INTERVAL = 60
+
+# Read farm list pages from the FarmSummary table (UPick.summary), one row per farm with
+# its address and weekly hours, instead of prefetching them. Needs UPICK_FAST_SERIALIZERS
+UPICK_FARM_SUMMARY = True
+
+# Map tiles at /UPick/farms/tiles/<zoom>/<x>/<y>/ group farms on a grid of this many
+# cells per side below UPICK_TILE_PIN_ZOOM and list every farm as a pin from that zoom on
+UPICK_TILE_GRID = 8
+UPICK_TILE_PIN_ZOOM = 11
+
+# Seconds clients and proxies may reuse a map tile (Cache-Control max-age)
+UPICK_TILE_MAX_AGE = 5 * 60
+
+# Aliases of read replicas of default in DATABASES, set up like default with
+# 'TEST': {'MIRROR': 'default'}. The farm and plant viewsets read from them in turn
+# (UPick.routers), an empty list keeps every read on default
+UPICK_READ_REPLICAS = []
+
+# Seconds a replica that passed its health check is used before it is checked again,
+# and seconds a replica that failed is left out
+UPICK_REPLICA_CHECK_INTERVAL = 10
+UPICK_REPLICA_RETRY = 30
+
+# Seconds after a write during which reads stay on default, above the time the
+# replicas take to apply a write
+UPICK_REPLICA_LAG = 5
+
+# Threads, and so persistent connections per database, for the queries the async
+# views run next to the request's own. Sync requests reuse one connection per worker thread
+UPICK_DB_POOL_SIZE = 4
+
+# Most farms one /UPick/farms/batch/?ids= request can fetch
+UPICK_BATCH_SIZE = 100
+
+# Share of requests logged with their query count, database and serializer time
+# and response size to the UPick.metrics logger, between 0 and 1
+UPICK_METRICS_SAMPLE_RATE = 0.1
+
+# Queries taking at least this many milliseconds are logged with their SQL,
+# None disables the check
+UPICK_SLOW_QUERY_MS = 200
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'UPick.metrics': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,28 @@
+# Settings for running the tests without a MySQL server:
+#   python manage.py test --settings=UPickFront.test_settings
+# SQLite files stand in for the primary and two read replicas, the test runner gives
+# each one its own test database and ReadReplicaTests copies the primary into them
+
+from UPickFront.settings import *  # noqa
+
+DATABASES = {
+    alias: {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+        'TEST': {'NAME': BASE_DIR / f'test_{alias}.sqlite3'},
+    }
+    for alias in ['default', 'replica_1', 'replica_2']
+}
+
+# The tests run in one process and clear the cache between tests
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# The viewsets only read from the replicas in ReadReplicaTests
+UPICK_READ_REPLICAS = []
+
+# Keeps the sampled request metrics out of the test output
+UPICK_METRICS_SAMPLE_RATE = 0